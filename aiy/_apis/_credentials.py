@@ -0,0 +1,198 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keeps OAuth access tokens fresh ahead of their expiry."""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('credentials')
+
+# Path to a tmpfs directory, so cached tokens don't outlive a reboot and don't
+# wear the SD card.
+TMP_DIR = '/run/user/%d' % os.getuid()
+
+_EXPIRY_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# One manager per credentials object, shared by all requests using it.
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+class CredentialsManager(object):
+    """Refreshes google.auth credentials from a background thread.
+
+    The thread refreshes the access token REFRESH_MARGIN_S before it expires,
+    so requests never wait for a refresh. The token and its expiry are cached
+    in TMP_DIR, so a restarted process can skip the initial refresh.
+    """
+
+    REFRESH_MARGIN_S = 300
+    RETRY_S = 30
+
+    def __init__(self, credentials, cache_dir=TMP_DIR):
+        self.credentials = credentials
+        self.metrics = {
+            'refreshes': 0,
+            'failures': 0,
+            'cache_hits': 0,
+            'last_refresh_s': None,
+            'max_refresh_s': None,
+        }
+        self._cache_path = None
+        if cache_dir and os.path.isdir(cache_dir):
+            self._cache_path = os.path.join(
+                cache_dir, 'aiy-token-%s.json' % self._cache_key())
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start refreshing in the background."""
+        with self._lock:
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def ensure_valid(self, wait=True, background=True):
+        """Make sure the credentials have a usable token, refreshing if needed.
+
+        This only blocks if there is neither a valid cached token nor a token
+        refreshed by the background thread.
+
+        Args:
+          wait: if False, never block; without a valid token the background
+              thread refreshes right away, and until then the credentials
+              are left for their user to refresh.
+          background: if False, don't start the background thread. For
+              credentials that their user refreshes itself, like the
+              Assistant library does: google.auth credentials must not be
+              refreshed from two threads at once.
+        """
+        if not self.credentials.valid:
+            self.load_cached_token()
+        if not self.credentials.valid and wait:
+            self.refresh()
+        if background:
+            self.start()
+
+    def load_cached_token(self):
+        """Use the cached token if it is still valid. Returns True on success."""
+        if not self._cache_path:
+            return False
+        try:
+            with open(self._cache_path, 'r') as f:
+                cached = json.load(f)
+            expiry = datetime.datetime.strptime(cached['expiry'], _EXPIRY_FORMAT)
+        except (IOError, OSError, ValueError, KeyError):
+            return False
+
+        if self._seconds_left(expiry) <= self.REFRESH_MARGIN_S:
+            return False
+
+        self.credentials.token = cached['token']
+        self.credentials.expiry = expiry
+        self.metrics['cache_hits'] += 1
+        logger.info('using cached access token, %d s left',
+                    self._seconds_left(expiry))
+        return True
+
+    def refresh(self):
+        """Refresh the access token now and update the cache."""
+        # Imported here, it pulls in requests and urllib3, which startup
+        # doesn't need when there is a cached token.
+        import google.auth.transport.requests
+
+        with self._lock:
+            start = time.monotonic()
+            try:
+                self.credentials.refresh(google.auth.transport.requests.Request())
+            except Exception:
+                self.metrics['failures'] += 1
+                raise
+            duration = time.monotonic() - start
+
+            self.metrics['refreshes'] += 1
+            self.metrics['last_refresh_s'] = duration
+            self.metrics['max_refresh_s'] = max(
+                duration, self.metrics['max_refresh_s'] or 0)
+            logger.info('refreshed access token in %.3f s', duration)
+            self._save_cached_token()
+
+        # Let the background thread reschedule for the new expiry.
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            expiry = self.credentials.expiry
+            if expiry is None and self.credentials.token:
+                # Tokens without expiry never need a refresh.
+                return
+            # Without a token, refresh right away.
+            delay = self._seconds_left(expiry) - self.REFRESH_MARGIN_S if expiry else 0
+            if delay > 0:
+                self._wakeup.wait(delay)
+                self._wakeup.clear()
+                if self.credentials.expiry != expiry:
+                    # Refreshed by someone else meanwhile.
+                    continue
+            try:
+                self.refresh()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('background token refresh failed')
+                time.sleep(self.RETRY_S)
+            self._wakeup.clear()
+
+    def _save_cached_token(self):
+        if not self._cache_path or not self.credentials.expiry:
+            return
+        try:
+            fd = os.open(self._cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({
+                    'token': self.credentials.token,
+                    'expiry': self.credentials.expiry.strftime(_EXPIRY_FORMAT),
+                }, f)
+        except (IOError, OSError):
+            logger.exception('could not cache the access token')
+
+    def _cache_key(self):
+        identity = [
+            getattr(self.credentials, 'service_account_email', None),
+            getattr(self.credentials, 'client_id', None),
+            getattr(self.credentials, 'refresh_token', None),
+        ]
+        identity.extend(sorted(getattr(self.credentials, 'scopes', None) or []))
+        return hashlib.sha256(
+            repr(identity).encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def _seconds_left(expiry):
+        # google.auth keeps expiry as a naive UTC datetime.
+        return (expiry - datetime.datetime.utcnow()).total_seconds()
+
+
+def get_credentials_manager(credentials):
+    """Returns the CredentialsManager shared by all users of credentials."""
+    with _managers_lock:
+        manager = _managers.get(id(credentials))
+        if manager is None or manager.credentials is not credentials:
+            manager = _managers[id(credentials)] = CredentialsManager(credentials)
+        return manager
@@ -0,0 +1,364 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local stand-in for the Cloud Speech and Embedded Assistant servers.
+
+It implements the Speech.StreamingRecognize and EmbeddedAssistant.Converse
+streaming RPCs used by aiy._apis._speech, and answers each request from a
+Script: what was "said", when the endpointer fires, what audio comes back,
+how slow the server and the link are, and which errors to return. This makes
+latency measurements reproducible without the live Google services.
+
+Usage:
+    server = FakeSpeechServer([Script(transcript='what time is it')])
+    server.start()
+    aiy._apis._speech.set_api_override(server.target)
+    ...
+    server.stop()
+
+Or from the command line, for a separate process:
+    python3 -m aiy._apis._fake_server --port 50051 --transcript 'hello'
+    AIY_SPEECH_API_OVERRIDE=localhost:50051 ./my_recognizer.py
+"""
+
+from concurrent import futures
+import collections
+import logging
+import threading
+import time
+
+from google.assistant.embedded.v1alpha1 import embedded_assistant_pb2
+from google.cloud.grpc.speech.v1beta1 import cloud_speech_pb2 as cloud_speech
+from google.rpc import status_pb2
+import grpc
+
+logger = logging.getLogger('fake_server')
+
+AUDIO_SAMPLE_SIZE = 2  # bytes per sample
+AUDIO_SAMPLE_RATE_HZ = 16000
+_BYTES_PER_S = AUDIO_SAMPLE_SIZE * AUDIO_SAMPLE_RATE_HZ
+
+
+class Script(object):
+    """Describes how the fake server answers one request.
+
+    Args:
+      transcript: text "recognized" from the request audio.
+      endpoint_after_s: seconds of received audio after which the endpointer
+        fires (END_OF_AUDIO or END_OF_UTTERANCE).
+      endpointer_delay_s: extra wall time before the endpointer event is sent.
+      first_response_delay_s: wall time before the first response, on top of
+        the audio needed for it.
+      final_delay_s: wall time between the client closing its stream and the
+        final result.
+      interim_every_s: with interim results enabled, send a partial transcript
+        for every this many seconds of audio.
+      response_audio: audio returned by the Assistant, or None to return
+        response_audio_s seconds of silence.
+      response_audio_s: length of the generated response audio.
+      response_chunk_bytes: size of each audio_out message.
+      response_bytes_per_s: pace of the response audio, or None to send it
+        as fast as possible.
+      request_bytes_per_s: throughput limit when reading request audio, or
+        None for no limit.
+      follow_on: ask the Assistant client to keep the microphone open.
+      error_code: grpc.StatusCode to fail the call with, or None.
+      error_after_s: seconds of audio received before failing, instead of
+        answering.
+      in_band_error: send the error as a response with 'error' set instead of
+        failing the call.
+      error_message: details of the error.
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+
+    def __init__(self, transcript='', endpoint_after_s=1.0, endpointer_delay_s=0,
+                 first_response_delay_s=0, final_delay_s=0, interim_every_s=0.5,
+                 response_audio=None, response_audio_s=1.0,
+                 response_chunk_bytes=3200, response_bytes_per_s=None,
+                 request_bytes_per_s=None, follow_on=False, error_code=None,
+                 error_after_s=0, in_band_error=False, error_message='fake error'):
+        self.transcript = transcript
+        self.endpoint_after_s = endpoint_after_s
+        self.endpointer_delay_s = endpointer_delay_s
+        self.first_response_delay_s = first_response_delay_s
+        self.final_delay_s = final_delay_s
+        self.interim_every_s = interim_every_s
+        if response_audio is None:
+            response_audio = bytes(int(response_audio_s * _BYTES_PER_S))
+        self.response_audio = response_audio
+        self.response_chunk_bytes = response_chunk_bytes
+        self.response_bytes_per_s = response_bytes_per_s
+        self.request_bytes_per_s = request_bytes_per_s
+        self.follow_on = follow_on
+        self.error_code = error_code
+        self.error_after_s = error_after_s
+        self.in_band_error = in_band_error
+        self.error_message = error_message
+
+
+# What the server saw for each request, for checks and benchmarks.
+RequestLog = collections.namedtuple(
+    'RequestLog', ['method', 'audio_bytes', 'start', 'end_of_speech', 'end'])
+
+
+class _Session(object):
+    """Reads the request audio of one call, applying the script's limits."""
+
+    def __init__(self, script, request_iterator, audio_field):
+        self.script = script
+        self.audio_bytes = 0
+        self.start = time.monotonic()
+        self.end_of_speech = None
+        self._requests = request_iterator
+        self._audio_field = audio_field
+        self._first_response_sent = False
+        self.config = next(self._requests)
+
+    def read_audio(self, until_s):
+        """Read requests until until_s of audio arrived or the client is done.
+
+        Returns False if the client closed its stream first.
+        """
+        limit = self.script.request_bytes_per_s
+        for request in self._requests:
+            self.audio_bytes += len(getattr(request, self._audio_field))
+            if limit:
+                # Pretend the link is this slow.
+                ahead = self.audio_bytes / limit - (time.monotonic() - self.start)
+                if ahead > 0:
+                    time.sleep(ahead)
+            if self.audio_bytes >= until_s * _BYTES_PER_S:
+                return True
+        return False
+
+    def drain(self):
+        for request in self._requests:
+            self.audio_bytes += len(getattr(request, self._audio_field))
+
+    def before_response(self):
+        if not self._first_response_sent:
+            self._first_response_sent = True
+            time.sleep(self.script.first_response_delay_s)
+
+    def error_status(self):
+        return status_pb2.Status(code=self.script.error_code.value[0],
+                                 message=self.script.error_message)
+
+    def fail(self, context):
+        context.set_code(self.script.error_code)
+        context.set_details(self.script.error_message)
+
+
+class FakeSpeechServer(object):
+    """A gRPC server implementing both speech services from a list of Scripts.
+
+    Each request takes the next script; the last one is reused once the list
+    is exhausted. Requests are recorded in self.log.
+    """
+
+    def __init__(self, scripts=None, port=0, max_workers=4):
+        self.log = []
+        self._scripts = collections.deque(scripts or [Script()])
+        self._lock = threading.Lock()
+        self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+        cloud_speech.add_SpeechServicer_to_server(_SpeechServicer(self), self._server)
+        embedded_assistant_pb2.add_EmbeddedAssistantServicer_to_server(
+            _AssistantServicer(self), self._server)
+        self.port = self._server.add_insecure_port('localhost:%d' % port)
+
+    @property
+    def target(self):
+        return 'localhost:%d' % self.port
+
+    def add_script(self, script):
+        with self._lock:
+            self._scripts.append(script)
+
+    def start(self):
+        self._server.start()
+        logger.info('fake speech server listening on %s', self.target)
+
+    def stop(self, grace=None):
+        self._server.stop(grace)
+
+    def _next_script(self):
+        with self._lock:
+            if len(self._scripts) > 1:
+                return self._scripts.popleft()
+            return self._scripts[0]
+
+    def _record(self, method, session):
+        with self._lock:
+            self.log.append(RequestLog(method, session.audio_bytes, session.start,
+                                       session.end_of_speech, time.monotonic()))
+
+
+class _SpeechServicer(cloud_speech.SpeechServicer):
+
+    def __init__(self, server):
+        self._server = server
+
+    def StreamingRecognize(self, request_iterator, context):  # pylint: disable=invalid-name
+        script = self._server._next_script()  # pylint: disable=protected-access
+        session = _Session(script, request_iterator, 'audio_content')
+        try:
+            for response in self._respond(session, context):
+                session.before_response()
+                yield response
+        finally:
+            self._server._record('StreamingRecognize', session)  # pylint: disable=protected-access
+
+    def _respond(self, session, context):
+        script = session.script
+        interim = session.config.streaming_config.interim_results
+        words = script.transcript.split()
+
+        if script.error_code:
+            session.read_audio(script.error_after_s)
+            if script.in_band_error:
+                yield cloud_speech.StreamingRecognizeResponse(error=session.error_status())
+            else:
+                session.fail(context)
+            return
+
+        heard_s = 0.0
+        step_s = script.interim_every_s if interim and words else script.endpoint_after_s
+        while heard_s < script.endpoint_after_s:
+            heard_s = min(heard_s + step_s, script.endpoint_after_s)
+            if not session.read_audio(heard_s):
+                break
+            if interim and words and heard_s < script.endpoint_after_s:
+                count = max(1, int(len(words) * heard_s / script.endpoint_after_s))
+                yield cloud_speech.StreamingRecognizeResponse(results=[
+                    cloud_speech.StreamingRecognitionResult(
+                        alternatives=[cloud_speech.SpeechRecognitionAlternative(
+                            transcript=' '.join(words[:count]))],
+                        stability=heard_s / script.endpoint_after_s)])
+
+        time.sleep(script.endpointer_delay_s)
+        session.end_of_speech = time.monotonic()
+        yield cloud_speech.StreamingRecognizeResponse(
+            endpointer_type=cloud_speech.StreamingRecognizeResponse.END_OF_AUDIO)
+
+        session.drain()
+        time.sleep(script.final_delay_s)
+        yield cloud_speech.StreamingRecognizeResponse(results=[
+            cloud_speech.StreamingRecognitionResult(
+                alternatives=[cloud_speech.SpeechRecognitionAlternative(
+                    transcript=script.transcript, confidence=0.9)],
+                is_final=True)])
+
+
+class _AssistantServicer(embedded_assistant_pb2.EmbeddedAssistantServicer):
+
+    def __init__(self, server):
+        self._server = server
+
+    def Converse(self, request_iterator, context):  # pylint: disable=invalid-name
+        script = self._server._next_script()  # pylint: disable=protected-access
+        session = _Session(script, request_iterator, 'audio_in')
+        try:
+            for response in self._respond(session, context):
+                session.before_response()
+                yield response
+        finally:
+            self._server._record('Converse', session)  # pylint: disable=protected-access
+
+    def _respond(self, session, context):
+        script = session.script
+
+        if script.error_code:
+            session.read_audio(script.error_after_s)
+            if script.in_band_error:
+                yield embedded_assistant_pb2.ConverseResponse(error=session.error_status())
+            else:
+                session.fail(context)
+            return
+
+        session.read_audio(script.endpoint_after_s)
+        time.sleep(script.endpointer_delay_s)
+        session.end_of_speech = time.monotonic()
+        yield embedded_assistant_pb2.ConverseResponse(
+            event_type=embedded_assistant_pb2.ConverseResponse.END_OF_UTTERANCE)
+
+        session.drain()
+        time.sleep(script.final_delay_s)
+        if script.follow_on:
+            microphone_mode = embedded_assistant_pb2.ConverseResult.DIALOG_FOLLOW_ON
+        else:
+            microphone_mode = embedded_assistant_pb2.ConverseResult.CLOSE_MICROPHONE
+        yield embedded_assistant_pb2.ConverseResponse(
+            result=embedded_assistant_pb2.ConverseResult(
+                spoken_request_text=script.transcript,
+                microphone_mode=microphone_mode,
+                conversation_state=b'fake-state'))
+
+        audio = script.response_audio
+        start = time.monotonic()
+        for offset in range(0, len(audio), script.response_chunk_bytes):
+            if script.response_bytes_per_s:
+                ahead = offset / script.response_bytes_per_s - (time.monotonic() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+            yield embedded_assistant_pb2.ConverseResponse(
+                audio_out=embedded_assistant_pb2.AudioOut(
+                    audio_data=audio[offset:offset + script.response_chunk_bytes]))
+
+
+def _main():
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Local fake speech server')
+    parser.add_argument('--port', type=int, default=50051)
+    parser.add_argument('--transcript', default='hello')
+    parser.add_argument('--endpoint-after', type=float, default=1.0,
+                        help='seconds of audio before the endpointer fires')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds before the first response')
+    parser.add_argument('--final-delay', type=float, default=0,
+                        help='seconds between end of audio and the result')
+    parser.add_argument('--response-audio', type=float, default=1.0,
+                        help='seconds of Assistant response audio')
+    parser.add_argument('--realtime-response', action='store_true',
+                        help='pace the response audio in real time')
+    parser.add_argument('--request-rate', type=int, default=None,
+                        help='request audio throughput limit in bytes/s')
+    parser.add_argument('--error', default=None,
+                        help='fail with this grpc.StatusCode name, eg UNAVAILABLE')
+    args = parser.parse_args()
+
+    server = FakeSpeechServer([Script(
+        transcript=args.transcript,
+        endpoint_after_s=args.endpoint_after,
+        first_response_delay_s=args.latency,
+        final_delay_s=args.final_delay,
+        response_audio_s=args.response_audio,
+        response_bytes_per_s=_BYTES_PER_S if args.realtime_response else None,
+        request_bytes_per_s=args.request_rate,
+        error_code=getattr(grpc.StatusCode, args.error) if args.error else None,
+    )], port=args.port)
+    server.start()
+    print('Listening on %s. Press Ctrl+C to quit...' % server.target)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    _main()
@@ -19,6 +19,8 @@ import collections
 import logging
 import os
 import tempfile
+import threading
+import time
 import wave
 
 import google.auth
@@ -31,6 +33,7 @@ from google.assistant.embedded.v1alpha1 import embedded_assistant_pb2
 import grpc
 from six.moves import queue
 
+import aiy._apis._credentials
 import aiy.i18n
 
 logger = logging.getLogger('speech')
@@ -40,36 +43,141 @@ AUDIO_SAMPLE_RATE_HZ = 16000
 
 
 _Result = collections.namedtuple('_Result', ['transcript', 'response_audio'])
+_Partial = collections.namedtuple('_Partial', ['transcript', 'stability', 'is_final'])
+
+
+# host:port to send all requests to instead of the Google APIs, eg the local
+# stand-in server in aiy._apis._fake_server. See set_api_override().
+_api_override = os.getenv('AIY_SPEECH_API_OVERRIDE')
+_api_override_insecure = bool(_api_override)
 
 
 class Error(Exception):
     pass
 
 
+def set_api_override(target, insecure=True):
+    """Send requests created from now on to target instead of Google.
+
+    This is for testing and benchmarking against a local server such as
+    aiy._apis._fake_server. It can also be set through the
+    AIY_SPEECH_API_OVERRIDE environment variable, which implies insecure.
+
+    Args:
+      target: 'host:port' of the server, or None to use the Google APIs.
+      insecure: if True, connect without TLS or credentials.
+    """
+    global _api_override, _api_override_insecure
+    _api_override = target
+    _api_override_insecure = insecure
+
+
 class _ChannelFactory(object):
 
-    """Creates gRPC channels with a given configuration."""
+    """Creates gRPC channels with a given configuration.
+
+    The channel is kept open and reused by later requests, so only the first
+    request pays for the TCP, TLS and HTTP/2 setup. Keepalive pings keep the
+    connection warm between turns, gRPC releases it after IDLE_TIMEOUT_MS
+    without calls and reconnects on the next one. A channel that reports
+    TRANSIENT_FAILURE or SHUTDOWN, or that failed a call with UNAVAILABLE, is
+    replaced by a fresh one on the next make_channel().
+    """
+
+    KEEPALIVE_TIME_MS = 60000
+    KEEPALIVE_TIMEOUT_MS = 10000
+    IDLE_TIMEOUT_MS = 300000
+
+    def __init__(self, api_host, credentials, target=None, insecure=None):
+        """Args:
+          api_host: host name of the Google API.
+          credentials: google.auth credentials; may be None if insecure.
+          target: 'host:port' to connect to; defaults to the API override set
+            by set_api_override(), if any, or api_host on port 443.
+          insecure: connect without TLS or credentials; defaults to the
+            override's setting.
+        """
+        override_insecure = False
+        if target is None and _api_override:
+            target, override_insecure = _api_override, _api_override_insecure
 
-    def __init__(self, api_host, credentials):
         self._api_host = api_host
         self._credentials = credentials
+        self._target = target or api_host + ':443'
+        self._insecure = override_insecure if insecure is None else insecure
+        self._credentials_manager = None
+        if not self._insecure:
+            self._credentials_manager = (
+                aiy._apis._credentials.get_credentials_manager(credentials))
 
-        self._checked = False
+        self._channel = None
+        self._connectivity = None
+        self._lock = threading.Lock()
 
     def make_channel(self):
-        """Creates a secure channel."""
+        """Returns the cached secure channel, creating it if needed."""
+
+        with self._lock:
+            if self._channel and self._connectivity in (
+                    grpc.ChannelConnectivity.TRANSIENT_FAILURE,
+                    grpc.ChannelConnectivity.SHUTDOWN):
+                logger.info('channel is %s, reconnecting', self._connectivity)
+                self._close_channel()
+
+            if not self._channel:
+                self._channel = self._create_channel()
+                self._channel.subscribe(self._on_connectivity_change)
+
+            return self._channel
+
+    def invalidate(self):
+        """Drop the cached channel, eg after it failed with UNAVAILABLE."""
+        with self._lock:
+            self._close_channel()
+
+    def warm_up(self):
+        """Starts connecting in the background, ahead of the first request."""
+        channel = self.make_channel()
+        grpc.channel_ready_future(channel).add_done_callback(
+            lambda _: logger.info('channel to %s is ready', self._target))
+
+    def _create_channel(self):
+        if self._insecure:
+            logger.info('using insecure channel to %s', self._target)
+            return grpc.insecure_channel(
+                self._target, options=self._channel_options())
 
         request = google.auth.transport.requests.Request()
-        target = self._api_host + ':443'
 
-        if not self._checked:
-            # Refresh now, to catch any errors early. Otherwise, they'll be
-            # raised and swallowed somewhere inside gRPC.
-            self._credentials.refresh(request)
-            self._checked = True
+        # Get a valid token now, to catch any errors early. Otherwise, they'll
+        # be raised and swallowed somewhere inside gRPC. After that, the
+        # manager refreshes it in the background before it expires.
+        self._credentials_manager.ensure_valid()
 
         return google.auth.transport.grpc.secure_authorized_channel(
-            self._credentials, request, target)
+            self._credentials, request, self._target,
+            options=self._channel_options())
+
+    def _channel_options(self):
+        return [
+            ('grpc.keepalive_time_ms', self.KEEPALIVE_TIME_MS),
+            ('grpc.keepalive_timeout_ms', self.KEEPALIVE_TIMEOUT_MS),
+            ('grpc.keepalive_permit_without_calls', 1),
+            ('grpc.http2.max_pings_without_data', 0),
+            ('grpc.client_idle_timeout_ms', self.IDLE_TIMEOUT_MS),
+        ]
+
+    def _close_channel(self):
+        """Must be called with _lock held."""
+        if self._channel:
+            self._channel.unsubscribe(self._on_connectivity_change)
+            self._channel.close()
+        self._channel = None
+        self._connectivity = None
+
+    def _on_connectivity_change(self, connectivity):
+        logger.debug('channel to %s: %s', self._target, connectivity)
+        self._connectivity = connectivity
 
 
 class GenericSpeechRequest(object):
@@ -81,14 +189,21 @@ class GenericSpeechRequest(object):
 
     DEADLINE_SECS = 185
 
+    _channel_factory_class = _ChannelFactory
+
     def __init__(self, api_host, credentials):
         self.dialog_follow_on = False
         self._audio_queue = queue.Queue()
+        self._audio_ended = False
         self._phrases = []
-        self._channel_factory = _ChannelFactory(api_host, credentials)
+        self._channel_factory = self._channel_factory_class(api_host, credentials)
         self._endpointer_cb = None
         self._audio_logging_enabled = False
         self._request_log_wav = None
+        self._response_stream = None
+        self._cancelled = False
+        self.start_time = None
+        self.timings = {}
 
     def add_phrases(self, phrases):
         """Makes the recognition more likely to recognize the given phrase(s).
@@ -114,19 +229,44 @@ class GenericSpeechRequest(object):
             self._audio_log_ix = 0
 
     def reset(self):
+        self._audio_ended = False
+        self._cancelled = False
+        self.dialog_follow_on = False
+        self._drain_audio_queue()
+
+    def _drain_audio_queue(self):
         while True:
             try:
                 self._audio_queue.get(False)
             except queue.Empty:
                 return
 
-        self.dialog_follow_on = False
-
     def add_data(self, data):
-        self._audio_queue.put(data)
+        # The recorder lends us a view into its ring buffer, so take a copy
+        # before handing it to the request thread.
+        self._audio_queue.put(bytes(data))
 
     def end_audio(self):
-        self.add_data(None)
+        """Stop sending audio to the server.
+
+        This may be called by a local endpointer before the server detects
+        the end of speech; later calls have no effect until reset().
+        """
+        if not self._audio_ended:
+            self._audio_ended = True
+            self._audio_queue.put(None)
+
+    def cancel(self):
+        """Abort the request in progress, eg once a partial result is enough.
+
+        do_request() then returns the result received so far. Safe to call
+        from any thread.
+        """
+        self._cancelled = True
+        self._end_audio_request()
+        response_stream = self._response_stream
+        if response_stream:
+            response_stream.cancel()
 
     def _get_speech_context(self):
         """Return a SpeechContext instance to bias recognition towards certain
@@ -200,12 +340,18 @@ class GenericSpeechRequest(object):
         return
 
     def _end_audio_request(self):
+        if self._audio_ended:
+            # Already ended locally, see end_audio().
+            return
         self.end_audio()
         if self._endpointer_cb:
             self._endpointer_cb()
 
     def _handle_response_stream(self, response_stream):
         for resp in response_stream:
+            if 'first_response' not in self.timings:
+                self.timings['first_response'] = time.monotonic() - self.start_time
+
             if resp.error.code != error_code.OK:
                 self._end_audio_request()
                 raise Error('Server error: ' + resp.error.message)
@@ -249,23 +395,47 @@ class GenericSpeechRequest(object):
                 transcript: string with transcript of user query
                 response_audio: optionally, an audio response from the server
 
+        After the request, self.timings holds the seconds since
+        self.start_time (a time.monotonic() value) spent getting a channel
+        ('channel'), until the first response ('first_response'), until the
+        final transcript ('transcript') and for the whole request ('total').
+
         Raises speech.Error on error.
         """
+        self.timings = {}
+        self.start_time = time.monotonic()
         try:
             service = self._make_service(self._channel_factory.make_channel())
+            self.timings['channel'] = time.monotonic() - self.start_time
 
             response_stream = self._create_response_stream(
                 service, self._request_stream(), self.DEADLINE_SECS)
+            self._response_stream = response_stream
+            if self._cancelled:
+                response_stream.cancel()
 
             if self._audio_logging_enabled:
                 self._start_logging_request()
 
             return self._handle_response_stream(response_stream)
-        except (
-                google.auth.exceptions.GoogleAuthError,
-                grpc.RpcError,
-        ) as exc:
+        except grpc.RpcError as exc:
+            if self._cancelled:
+                return self._finish_request()
+            if (isinstance(exc, grpc.Call) and
+                    exc.code() == grpc.StatusCode.UNAVAILABLE):
+                self._channel_factory.invalidate()
             raise Error('Exception in speech request') from exc
+        except google.auth.exceptions.GoogleAuthError as exc:
+            raise Error('Exception in speech request') from exc
+        finally:
+            self._response_stream = None
+            self.timings['total'] = time.monotonic() - self.start_time
+            logger.info('request timings: %s', ', '.join(
+                '%s %.3fs' % item for item in sorted(self.timings.items())))
+
+    def warm_up(self):
+        """Connects to the server in the background, before the first request."""
+        self._channel_factory.warm_up()
 
 
 class CloudSpeechRequest(GenericSpeechRequest):
@@ -273,14 +443,17 @@ class CloudSpeechRequest(GenericSpeechRequest):
     """A transcription request to the Cloud Speech API.
 
     Args:
-        credentials_file: path to service account credentials JSON file
+        credentials_file: path to service account credentials JSON file, or
+            None with an insecure API override (see set_api_override).
     """
 
     SCOPE = 'https://www.googleapis.com/auth/cloud-platform'
 
     def __init__(self, credentials_file):
-        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_file
-        credentials, _ = google.auth.default(scopes=[self.SCOPE])
+        credentials = None
+        if credentials_file is not None:
+            os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_file
+            credentials, _ = google.auth.default(scopes=[self.SCOPE])
 
         super().__init__('speech.googleapis.com', credentials)
 
@@ -290,11 +463,22 @@ class CloudSpeechRequest(GenericSpeechRequest):
             raise ValueError("cloud_speech_pb2.py doesn't have StreamingRecognizeRequest.")
 
         self._transcript = None
+        self._partial_result_cb = None
 
     def reset(self):
         super().reset()
         self._transcript = None
 
+    def set_partial_result_cb(self, cb):
+        """Callback to invoke with each hypothesis as it arrives.
+
+        Enables interim results. cb receives a _Partial with the transcript so
+        far, the stability of its first result (0.0 to 1.0, 1.0 once final)
+        and whether it is final. It runs on the thread calling do_request(),
+        and may call cancel() to stop early. Use None to disable.
+        """
+        self._partial_result_cb = cb
+
     def _make_service(self, channel):
         return cloud_speech.SpeechStub(channel)
 
@@ -312,6 +496,7 @@ class CloudSpeechRequest(GenericSpeechRequest):
         streaming_config = cloud_speech.StreamingRecognitionConfig(
             config=recognition_config,
             single_utterance=True,  # TODO(rodrigoq): find a way to handle pauses
+            interim_results=self._partial_result_cb is not None,
         )
 
         return cloud_speech.StreamingRecognizeRequest(
@@ -335,12 +520,21 @@ class CloudSpeechRequest(GenericSpeechRequest):
         return resp.endpointer_type == END_OF_AUDIO
 
     def _handle_response(self, resp):
-        """Store the last transcript we received."""
+        """Store the last transcript we received, and report it if asked."""
         if resp.results:
             self._transcript = ' '.join(
                 result.alternatives[0].transcript for result in resp.results)
             logger.info('transcript: %s', self._transcript)
 
+            is_final = any(result.is_final for result in resp.results)
+            if is_final and 'transcript' not in self.timings:
+                self.timings['transcript'] = time.monotonic() - self.start_time
+
+            if self._partial_result_cb:
+                stability = 1.0 if is_final else resp.results[0].stability
+                self._partial_result_cb(
+                    _Partial(self._transcript, stability, is_final))
+
     def _finish_request(self):
         super()._finish_request()
         return _Result(self._transcript, None)
@@ -355,14 +549,24 @@ class AssistantSpeechRequest(GenericSpeechRequest):
         super().__init__('embeddedassistant.googleapis.com', credentials)
 
         self._conversation_state = None
-        self._response_audio = b''
+        self._response_audio = []
+        self._audio_sink = None
         self._transcript = None
 
     def reset(self):
         super().reset()
-        self._response_audio = b''
+        self._response_audio = []
         self._transcript = None
 
+    def set_audio_sink(self, sink):
+        """Pass response audio to sink.write() as soon as it arrives.
+
+        This lets playback start with the first chunk of the answer instead
+        of after the whole answer was downloaded. The audio is still returned
+        by do_request(). Use None to disable.
+        """
+        self._audio_sink = sink
+
     def _make_service(self, channel):
         return embedded_assistant_pb2.EmbeddedAssistantStub(channel)
 
@@ -408,8 +612,15 @@ class AssistantSpeechRequest(GenericSpeechRequest):
         if resp.result.spoken_request_text:
             logger.info('transcript: %s', resp.result.spoken_request_text)
             self._transcript = resp.result.spoken_request_text
+            if 'transcript' not in self.timings:
+                self.timings['transcript'] = time.monotonic() - self.start_time
 
-        self._response_audio += resp.audio_out.audio_data
+        if resp.audio_out.audio_data:
+            if 'first_audio' not in self.timings:
+                self.timings['first_audio'] = time.monotonic() - self.start_time
+            self._response_audio.append(resp.audio_out.audio_data)
+            if self._audio_sink:
+                self._audio_sink.write(resp.audio_out.audio_data)
 
         if resp.result.conversation_state:
             self._conversation_state = resp.result.conversation_state
@@ -422,10 +633,11 @@ class AssistantSpeechRequest(GenericSpeechRequest):
     def _finish_request(self):
         super()._finish_request()
 
-        if self._response_audio and self._audio_logging_enabled:
-            self._log_audio_out(self._response_audio)
+        response_audio = b''.join(self._response_audio)
+        if response_audio and self._audio_logging_enabled:
+            self._log_audio_out(response_audio)
 
-        return _Result(self._transcript, self._response_audio)
+        return _Result(self._transcript, response_audio)
 
     def _log_audio_out(self, frames):
         response_filename = '%s/response.%03d.wav' % (
@@ -0,0 +1,240 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""asyncio variants of the speech requests in aiy._apis._speech.
+
+These use grpc's asyncio API, so a request doesn't need a thread of its own
+and can be awaited next to button, LED and playback events. They build the
+same protocol messages as their synchronous counterparts, which keep working
+unchanged.
+
+Requests must be created from a coroutine, on the loop that awaits them.
+"""
+
+import asyncio
+import logging
+import time
+
+import google.auth.exceptions
+import google.auth.transport.grpc
+import google.auth.transport.requests
+from google.rpc import code_pb2 as error_code
+import grpc
+import grpc.aio
+
+import aiy._apis._speech
+
+logger = logging.getLogger('speech')
+
+
+class _AsyncChannelFactory(aiy._apis._speech._ChannelFactory):
+
+    """Creates grpc.aio channels, with the same caching as _ChannelFactory."""
+
+    async def make_aio_channel(self):
+        """Returns the cached secure asyncio channel, creating it if needed."""
+        if self._channel and self._channel.get_state() in (
+                grpc.ChannelConnectivity.TRANSIENT_FAILURE,
+                grpc.ChannelConnectivity.SHUTDOWN):
+            await self.close()
+
+        if not self._channel:
+            if self._credentials_manager:
+                # The first call may block on a token refresh.
+                await asyncio.get_event_loop().run_in_executor(
+                    None, self._credentials_manager.ensure_valid)
+            self._channel = self._create_aio_channel()
+
+        return self._channel
+
+    async def close(self):
+        """Close the cached channel, if any."""
+        channel, self._channel = self._channel, None
+        if channel:
+            await channel.close()
+
+    def _create_aio_channel(self):
+        if self._insecure:
+            return grpc.aio.insecure_channel(
+                self._target, options=self._channel_options())
+
+        request = google.auth.transport.requests.Request()
+        metadata_plugin = google.auth.transport.grpc.AuthMetadataPlugin(
+            self._credentials, request)
+        channel_credentials = grpc.composite_channel_credentials(
+            grpc.ssl_channel_credentials(),
+            grpc.metadata_call_credentials(metadata_plugin))
+        return grpc.aio.secure_channel(
+            self._target, channel_credentials,
+            options=self._channel_options())
+
+
+class _AsyncRequestMixin(object):
+
+    """Replaces the blocking request engine of a GenericSpeechRequest.
+
+    Audio comes from an asyncio queue fed by add_data(), which may be called
+    from any thread (eg the Recorder's), or from an async iterable passed to
+    do_request().
+    """
+
+    # pylint: disable=attribute-defined-outside-init
+
+    _channel_factory_class = _AsyncChannelFactory
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loop = asyncio.get_event_loop()
+        self._audio_queue = asyncio.Queue()
+        self._call = None
+
+    def _drain_audio_queue(self):
+        while not self._audio_queue.empty():
+            self._audio_queue.get_nowait()
+
+    def add_data(self, data):
+        self._loop.call_soon_threadsafe(self._audio_queue.put_nowait, bytes(data))
+
+    def end_audio(self):
+        if not self._audio_ended:
+            self._audio_ended = True
+            self._loop.call_soon_threadsafe(self._audio_queue.put_nowait, None)
+
+    def cancel(self):
+        """Abort the request in progress; do_request() returns the result so far.
+
+        Must be called from the event loop's thread.
+        """
+        self._cancelled = True
+        self._end_audio_request()
+        if self._call:
+            self._call.cancel()
+
+    async def warm_up(self):
+        """Connects to the server ahead of the first request."""
+        channel = await self._channel_factory.make_aio_channel()
+        await channel.channel_ready()
+
+    async def _async_request_stream(self, audio_source):
+        yield self._create_config_request()
+
+        if audio_source is None:
+            audio_source = self._queued_audio()
+
+        async for data in audio_source:
+            if self._audio_ended:
+                return
+
+            if self._request_log_wav:
+                self._request_log_wav.writeframes(data)
+
+            yield self._create_audio_request(data)
+
+    async def _queued_audio(self):
+        while True:
+            data = await self._audio_queue.get()
+            if not data:
+                return
+            yield data
+
+    async def _handle_call(self, call):
+        async for resp in call:
+            if 'first_response' not in self.timings:
+                self.timings['first_response'] = time.monotonic() - self.start_time
+
+            if resp.error.code != error_code.OK:
+                self._end_audio_request()
+                raise aiy._apis._speech.Error('Server error: ' + resp.error.message)
+
+            if self._stop_sending_audio(resp):
+                self._end_audio_request()
+
+            self._handle_response(resp)
+
+        # Server has closed the connection
+        return self._finish_request() or ''
+
+    async def do_request(self, audio_source=None, timeout=None):
+        """Stream audio to the cloud endpoint and return its result.
+
+        Args:
+          audio_source: async iterable of audio chunks to send, or None to
+            send the audio passed to add_data() until end_audio().
+          timeout: seconds before the request is aborted with speech.Error.
+            Cancelling the awaiting task also cancels the gRPC call.
+
+        Returns:
+          the same namedtuple as GenericSpeechRequest.do_request().
+        """
+        self.timings = {}
+        self.start_time = time.monotonic()
+        try:
+            return await asyncio.wait_for(
+                self._do_request(audio_source), timeout)
+        except asyncio.TimeoutError as exc:
+            raise aiy._apis._speech.Error('Speech request timed out') from exc
+        finally:
+            self.timings['total'] = time.monotonic() - self.start_time
+            logger.info('request timings: %s', ', '.join(
+                '%s %.3fs' % item for item in sorted(self.timings.items())))
+
+    async def _do_request(self, audio_source):
+        try:
+            channel = await self._channel_factory.make_aio_channel()
+            service = self._make_service(channel)
+            self.timings['channel'] = time.monotonic() - self.start_time
+
+            if self._audio_logging_enabled:
+                self._start_logging_request()
+
+            self._call = self._create_response_stream(
+                service, self._async_request_stream(audio_source),
+                self.DEADLINE_SECS)
+            if self._cancelled:
+                self._call.cancel()
+
+            return await self._handle_call(self._call)
+        except asyncio.CancelledError:
+            if self._cancelled and not self._current_task_cancelling():
+                return self._finish_request()
+            raise
+        except grpc.RpcError as exc:
+            if self._cancelled:
+                return self._finish_request()
+            if (isinstance(exc, grpc.aio.AioRpcError) and
+                    exc.code() == grpc.StatusCode.UNAVAILABLE):
+                await self._channel_factory.close()
+            raise aiy._apis._speech.Error('Exception in speech request') from exc
+        except google.auth.exceptions.GoogleAuthError as exc:
+            raise aiy._apis._speech.Error('Exception in speech request') from exc
+        finally:
+            if self._call and not self._call.done():
+                self._call.cancel()
+            self._call = None
+
+    @staticmethod
+    def _current_task_cancelling():
+        task = asyncio.current_task()
+        return bool(task and getattr(task, 'cancelling', lambda: 0)())
+
+
+class AsyncCloudSpeechRequest(_AsyncRequestMixin, aiy._apis._speech.CloudSpeechRequest):
+
+    """An asyncio transcription request to the Cloud Speech API."""
+
+
+class AsyncAssistantSpeechRequest(_AsyncRequestMixin,
+                                  aiy._apis._speech.AssistantSpeechRequest):
+
+    """An asyncio request to the Assistant API, which returns audio and text."""
@@ -14,6 +14,7 @@
 
 """Button driver for the VoiceHat."""
 
+import threading
 import time
 import RPi.GPIO as GPIO
 
@@ -21,15 +22,27 @@ import RPi.GPIO as GPIO
 class Button(object):
     """Detect edges on the given GPIO channel."""
 
+    LONG_PRESS_TIME = 1.0
+    DOUBLE_PRESS_TIME = 0.4
+
     def __init__(self,
                  channel,
                  polarity=GPIO.FALLING,
                  pull_up_down=GPIO.PUD_UP,
-                 debounce_time=0.08):
+                 debounce_time=0.08,
+                 long_press_time=LONG_PRESS_TIME,
+                 double_press_time=DOUBLE_PRESS_TIME):
         """A simple GPIO-based button driver.
 
         This driver supports a simple GPIO-based button. It works by detecting
-        edges on the given GPIO channel. Debouncing is automatic.
+        edges on the given GPIO channel. Debouncing is automatic: a press is
+        reported on its first edge, and further edges within debounce_time
+        are ignored as contact bounce. Nothing sleeps in the GPIO callback
+        thread.
+
+        The metrics dict counts presses, long and double presses and ignored
+        bounces, and records the latency from an edge reaching the driver to
+        the callback being called or wait_for_press() returning.
 
         Args:
           channel: the GPIO pin number to use (BCM mode)
@@ -38,6 +51,9 @@ class Button(object):
           pull_up_down: whether the port should be pulled up or down; defaults to
             GPIO.PUD_UP.
           debounce_time: the time used in debouncing the button in seconds.
+          long_press_time: how long the button must be held for a long press.
+          double_press_time: maximum time between the two presses of a
+            double press.
         """
         if polarity not in [GPIO.FALLING, GPIO.RISING]:
             raise ValueError(
@@ -47,59 +63,164 @@ class Button(object):
         self.polarity = polarity
         self.expected_value = polarity == GPIO.RISING
         self.debounce_time = debounce_time
+        self.long_press_time = long_press_time
+        self.double_press_time = double_press_time
 
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(channel, GPIO.IN, pull_up_down=pull_up_down)
 
         self.callback = None
+        self.long_press_callback = None
+        self.double_press_callback = None
+        self.metrics = {
+            'presses': 0,
+            'long_presses': 0,
+            'double_presses': 0,
+            'bounces_ignored': 0,
+            'last_callback_latency_s': None,
+            'max_callback_latency_s': None,
+            'last_wait_latency_s': None,
+            'max_wait_latency_s': None,
+        }
+
+        self._lock = threading.Lock()
+        self._press_event = threading.Condition(self._lock)
+        self._presses = 0
+        self._pressed = False
+        self._pressed_at = None
+        self._last_edge = None
+        self._last_press = None
+        self._waiters = 0
+        self._detect_lock = threading.Lock()
+        self._detecting = False
 
     def __del__(self):
         GPIO.cleanup(self.channel)
 
-    def wait_for_press(self):
+    def wait_for_press(self, timeout=None):
         """Wait for the button to be pressed.
 
-        This method blocks until the button is pressed.
+        This method blocks until the button is pressed, or for at most timeout
+        seconds. It cancels any callback registered with on_press().
+
+        Returns:
+          True if the button was pressed, False if the wait timed out.
         """
-        GPIO.add_event_detect(self.channel, self.polarity)
-        while True:
-            if GPIO.event_detected(self.channel) and self._debounce():
-                GPIO.remove_event_detect(self.channel)
-                return
-            time.sleep(0.02)
+        with self._lock:
+            self.callback = None
+            presses = self._presses
+            self._waiters += 1
+        self._update_detection()
+        try:
+            with self._lock:
+                pressed = self._press_event.wait_for(
+                    lambda: self._presses != presses, timeout)
+                if pressed:
+                    self._record_latency('wait', self._pressed_at)
+        finally:
+            with self._lock:
+                self._waiters -= 1
+            self._update_detection()
+        return pressed
 
     def on_press(self, callback):
         """Call the callback whenever the button is pressed.
 
         Args:
           callback: a function to call whenever the button is pressed. It should
-            take a single channel number. If the callback is None, the previously
+            take no arguments. If the callback is None, the previously
             registered callback, if any, is canceled.
 
         Example:
-          def MyButtonPressHandler(channel):
-              print "button pressed: channel = %d" % channel
+          def MyButtonPressHandler():
+              print "button pressed"
           my_button.on_press(MyButtonPressHandler)
         """
-        GPIO.remove_event_detect(self.channel)
-        if callback is not None:
-            self.callback = callback
-            GPIO.add_event_detect(
-                self.channel, self.polarity, callback=self._debounce_and_callback)
+        self.callback = callback
+        self._update_detection()
 
-    def _debounce_and_callback(self, _):
-        if self._debounce():
-            self.callback()
+    def on_long_press(self, callback):
+        """Call the callback once the button is held for long_press_time.
 
-    def _debounce(self):
-        """Debounce the GPIO signal.
+        The press is reported to on_press() callbacks and waiters as well.
+        """
+        self.long_press_callback = callback
+        self._update_detection()
+
+    def on_double_press(self, callback):
+        """Call the callback when a press follows the previous one quickly.
 
-        Check that the input holds the expected value for the debounce
-        period, to avoid false trigger on short pulses.
+        Both presses are reported to on_press() callbacks and waiters too.
         """
-        start = time.time()
-        while time.time() < start + self.debounce_time:
-            if GPIO.input(self.channel) != self.expected_value:
-                return False
-            time.sleep(0.01)
-        return True
+        self.double_press_callback = callback
+        self._update_detection()
+
+    def _update_detection(self):
+        """Watch the button while anyone is waiting or has a callback."""
+        with self._detect_lock:
+            wanted = bool(self._waiters or self.callback or self.long_press_callback or
+                          self.double_press_callback)
+            if wanted and not self._detecting:
+                with self._lock:
+                    self._pressed = GPIO.input(self.channel) == self.expected_value
+                GPIO.add_event_detect(self.channel, GPIO.BOTH, callback=self._on_edge)
+                self._detecting = True
+            elif not wanted and self._detecting:
+                GPIO.remove_event_detect(self.channel)
+                self._detecting = False
+
+    def _on_edge(self, _):
+        now = time.monotonic()
+        pressed = GPIO.input(self.channel) == self.expected_value
+        with self._lock:
+            if self._last_edge is not None and now - self._last_edge < self.debounce_time:
+                self.metrics['bounces_ignored'] += 1
+                return
+            if not pressed:
+                # A release, or a glitch that was over before we looked.
+                if self._pressed:
+                    self._pressed = False
+                    self._last_edge = now
+                return
+            # A press, even if the release before it was lost in a bounce.
+            self._pressed = True
+            self._last_edge = now
+            self._pressed_at = now
+            self._presses += 1
+            self.metrics['presses'] += 1
+            double = (self._last_press is not None and
+                      now - self._last_press <= self.double_press_time)
+            # After a double press, the next press starts afresh.
+            self._last_press = None if double else now
+            self._press_event.notify_all()
+            presses = self._presses
+            callback = self.callback
+            double_press_callback = self.double_press_callback if double else None
+            if double:
+                self.metrics['double_presses'] += 1
+
+        if self.long_press_callback:
+            timer = threading.Timer(self.long_press_time, self._check_long_press, [presses])
+            timer.daemon = True
+            timer.start()
+        if callback:
+            self._record_latency('callback', now)
+            callback()
+        if double_press_callback:
+            double_press_callback()
+
+    def _check_long_press(self, presses):
+        with self._lock:
+            held = (self._presses == presses and self._pressed and
+                    GPIO.input(self.channel) == self.expected_value)
+            if held:
+                self.metrics['long_presses'] += 1
+            callback = self.long_press_callback
+        if held and callback:
+            callback()
+
+    def _record_latency(self, kind, since):
+        latency = time.monotonic() - since
+        self.metrics['last_%s_latency_s' % kind] = latency
+        self.metrics['max_%s_latency_s' % kind] = max(
+            latency, self.metrics['max_%s_latency_s' % kind] or 0)
@@ -14,11 +14,109 @@
 
 """LED driver for the VoiceHat."""
 
+import array
+import collections
 import itertools
 import threading
 import time
 import RPi.GPIO as GPIO
 
+# A pattern compiled into runs of equal duty cycle: duties[i] is shown until
+# ends[i] seconds into the period. A static pattern has a period of None.
+_Compiled = collections.namedtuple('_Compiled', ['duties', 'ends', 'period'])
+
+
+def _compile(frames, frame_s=None):
+    """Compile a cycle of duty cycles, each shown for frame_s seconds."""
+    duties = array.array('B')
+    ends = array.array('d')
+    elapsed = 0
+    for duty, run in itertools.groupby(frames):
+        elapsed += len(list(run))
+        duties.append(duty)
+        ends.append(elapsed * (frame_s or 0))
+    return _Compiled(duties, ends, ends[-1] if frame_s else None)
+
+
+# Easing curves for Pattern keyframes: map progress 0..1 through a
+# transition to the fraction of the change in duty cycle.
+EASINGS = {
+    'step': lambda x: 1.0 if x >= 1 else 0.0,
+    'linear': lambda x: x,
+    'ease-in': lambda x: x * x,
+    'ease-out': lambda x: x * (2 - x),
+    'ease-in-out': lambda x: x * x * (3 - 2 * x),
+}
+
+
+class Pattern(object):
+    """An LED pattern, defined by keyframes and compiled once.
+
+    Keyframes are (time_s, duty_cycle) or (time_s, duty_cycle, easing)
+    tuples with increasing times, the first at 0. The duty cycle moves
+    from one keyframe to the next along the easing curve of the later one
+    (see EASINGS; 'linear' by default). The pattern loops with a period of
+    the last keyframe's time, or is static if there is a single keyframe.
+
+    The curve is sampled every frame_s seconds into a table of runs of
+    equal duty cycle, so showing the pattern costs no per-frame work.
+
+    Example, a slow 'breathing' pattern:
+        Pattern([(0, 0), (1.5, 60, 'ease-in-out'), (3, 0, 'ease-in-out')])
+    """
+
+    FRAME_S = 0.05
+
+    def __init__(self, keyframes, frame_s=FRAME_S):
+        keyframes = [tuple(keyframe) for keyframe in keyframes]
+        if not keyframes or keyframes[0][0] != 0:
+            raise ValueError('the first keyframe must be at time 0')
+        for keyframe in keyframes:
+            if len(keyframe) == 3 and keyframe[2] not in EASINGS:
+                raise ValueError('unknown easing: %s' % keyframe[2])
+        if len(keyframes) == 1:
+            self.compiled = _compile([int(round(keyframes[0][1]))])
+            return
+
+        frames = []
+        period = keyframes[-1][0]
+        count = max(1, int(round(period / frame_s)))
+        segment = 1
+        for i in range(count):
+            t = i * frame_s
+            while keyframes[segment][0] <= t and segment < len(keyframes) - 1:
+                segment += 1
+            start, end = keyframes[segment - 1], keyframes[segment]
+            easing = EASINGS[end[2] if len(end) == 3 else 'linear']
+            progress = (t - start[0]) / (end[0] - start[0]) if end[0] > start[0] else 1
+            frames.append(int(round(start[1] + (end[1] - start[1]) * easing(progress))))
+        self.compiled = _compile(frames, frame_s)
+
+    @classmethod
+    def from_frames(cls, frames, frame_s):
+        """Make a looping pattern that shows each duty cycle for frame_s."""
+        pattern = cls.__new__(cls)
+        pattern.compiled = _compile(frames, frame_s)
+        return pattern
+
+    @classmethod
+    def static(cls, duty_cycle):
+        """Make a pattern that keeps the LED at one duty cycle."""
+        return cls([(0, duty_cycle)])
+
+
+_patterns = {}
+
+
+def register_pattern(name, pattern):
+    """Make a Pattern available to LED.set_state() under the given name."""
+    _patterns[name] = pattern
+
+
+def get_pattern(name):
+    """Return the Pattern registered under name, or None."""
+    return _patterns.get(name)
+
 
 class LED:
     """Starts a background thread to show patterns with the LED.
@@ -28,6 +126,14 @@ class LED:
         my_led.start()
         my_led.set_state(LED.BEACON)
         my_led.stop()
+
+    Patterns (see Pattern) are compiled once into runs of equal duty cycle. The thread
+    sleeps on a condition variable until the next run is due or the state
+    changes, so a new state shows at once. Runs are scheduled on the
+    monotonic clock from the start of each period, so timing doesn't drift.
+
+    The metrics dict counts wakeups of the thread, duty cycle changes and
+    state changes, and the latency from set_state() to the LED changing.
     """
 
     OFF = 0
@@ -43,14 +149,23 @@ class LED:
     def __init__(self, channel):
         self.animator = threading.Thread(target=self._animate, daemon=True)
         self.channel = channel
-        self.iterator = None
         self.running = False
         self.state = None
-        self.sleep = 0
+        self.metrics = {
+            'wakeups': 0,
+            'duty_changes': 0,
+            'state_changes': 0,
+            'last_state_latency_s': None,
+            'max_state_latency_s': None,
+        }
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(channel, GPIO.OUT)
         self.pwm = GPIO.PWM(channel, 100)
         self.lock = threading.Lock()
+        self._changed = threading.Condition(self.lock)
+        self._pending = None
+        self._requested_at = None
+        self._duty = None
 
     def __del__(self):
         self.stop()
@@ -62,86 +177,102 @@ class LED:
             if not self.running:
                 self.running = True
                 self.pwm.start(0)  # off by default
+                self._duty = 0
                 self.animator.start()
 
     def stop(self):
         """Stop the LED driver and sets the LED to off."""
         with self.lock:  # pylint: disable=E1129
-            if self.running:
-                self.running = False
-                self.animator.join()
-                self.pwm.stop()
+            if not self.running:
+                return
+            self.running = False
+            self._changed.notify()
+        self.animator.join()
+        self.pwm.stop()
 
     def set_state(self, state):
         """Set the LED driver's new state.
 
+        The state is one of the constants like LED.BEACON, the name of a
+        pattern added with register_pattern(), or a Pattern.
+
         Note the LED driver must be started for this to have any effect.
         """
+        pattern = state if isinstance(state, Pattern) else _patterns.get(state)
+        if pattern is None:
+            raise ValueError('unsupported state: %s' % (state,))
         with self.lock:  # pylint: disable=E1129
             self.state = state
+            self._pending = pattern.compiled
+            self._requested_at = time.monotonic()
+            self._changed.notify()
+
+    def _set_duty(self, duty):
+        if duty != self._duty:
+            self.pwm.ChangeDutyCycle(duty)
+            self._duty = duty
+            self.metrics['duty_changes'] += 1
 
     def _animate(self):
-        while True:
-            state = None
-            running = False
-            with self.lock:  # pylint: disable=E1129
-                state = self.state
-                self.state = None
-                running = self.running
-            if not running:
-                return
-            if state is not None:
-                if not self._parse_state(state):
-                    raise ValueError('unsupported state: %d' % state)
-            if self.iterator:
-                self.pwm.ChangeDutyCycle(next(self.iterator))
-                time.sleep(self.sleep)
-            else:
-                # We can also wait for a state change here with a Condition.
-                time.sleep(1)
-
-    def _parse_state(self, state):
-        self.iterator = None
-        self.sleep = 0.0
-        handled = False
-
-        if state == self.OFF:
-            self.pwm.ChangeDutyCycle(0)
-            handled = True
-        elif state == self.ON:
-            self.pwm.ChangeDutyCycle(100)
-            handled = True
-        elif state == self.BLINK:
-            self.iterator = itertools.cycle([0, 100])
-            self.sleep = 0.5
-            handled = True
-        elif state == self.BLINK_3:
-            self.iterator = itertools.cycle([0, 100] * 3 + [0, 0])
-            self.sleep = 0.25
-            handled = True
-        elif state == self.BEACON:
-            self.iterator = itertools.cycle(
-                itertools.chain([30] * 100, [100] * 8, range(100, 30, -5)))
-            self.sleep = 0.05
-            handled = True
-        elif state == self.BEACON_DARK:
-            self.iterator = itertools.cycle(
-                itertools.chain([0] * 100, range(0, 30, 3), range(30, 0, -3)))
-            self.sleep = 0.05
-            handled = True
-        elif state == self.DECAY:
-            self.iterator = itertools.cycle(range(100, 0, -2))
-            self.sleep = 0.05
-            handled = True
-        elif state == self.PULSE_SLOW:
-            self.iterator = itertools.cycle(
-                itertools.chain(range(0, 100, 2), range(100, 0, -2)))
-            self.sleep = 0.1
-            handled = True
-        elif state == self.PULSE_QUICK:
-            self.iterator = itertools.cycle(
-                itertools.chain(range(0, 100, 5), range(100, 0, -5)))
-            self.sleep = 0.05
-            handled = True
-
-        return handled
+        compiled = None
+        index = 0
+        period_start = 0
+        deadline = None
+        with self._changed:
+            while self.running:
+                now = time.monotonic()
+                if self._pending is not None:
+                    compiled, self._pending = self._pending, None
+                    index = 0
+                    period_start = now
+                    self._set_duty(compiled.duties[0])
+                    latency = time.monotonic() - self._requested_at
+                    self.metrics['state_changes'] += 1
+                    self.metrics['last_state_latency_s'] = latency
+                    self.metrics['max_state_latency_s'] = max(
+                        latency, self.metrics['max_state_latency_s'] or 0)
+                elif deadline is not None and now >= deadline:
+                    # Advance to the run due now, skipping any that were missed.
+                    if now - period_start >= 2 * compiled.period:
+                        period_start = now - (now - period_start) % compiled.period
+                        index = 0
+                    while period_start + compiled.ends[index] <= now:
+                        index += 1
+                        if index == len(compiled.duties):
+                            index = 0
+                            period_start += compiled.period
+                    self._set_duty(compiled.duties[index])
+
+                deadline = None
+                if compiled and compiled.period:
+                    deadline = period_start + compiled.ends[index]
+                    self._changed.wait(max(0, deadline - time.monotonic()))
+                else:
+                    self._changed.wait()
+                self.metrics['wakeups'] += 1
+
+
+# The built-in states, by constant and by name.
+for _state, _name, _pattern in [
+        (LED.OFF, 'off', Pattern.static(0)),
+        (LED.ON, 'on', Pattern.static(100)),
+        (LED.BLINK, 'blink', Pattern.from_frames([0, 100], 0.5)),
+        (LED.BLINK_3, 'blink-3', Pattern.from_frames([0, 100] * 3 + [0, 0], 0.25)),
+        (LED.BEACON, 'beacon', Pattern.from_frames(
+            itertools.chain([30] * 100, [100] * 8, range(100, 30, -5)), 0.05)),
+        (LED.BEACON_DARK, 'beacon-dark', Pattern.from_frames(
+            itertools.chain([0] * 100, range(0, 30, 3), range(30, 0, -3)), 0.05)),
+        (LED.DECAY, 'decay', Pattern.from_frames(range(100, 0, -2), 0.05)),
+        (LED.PULSE_SLOW, 'pulse-slow', Pattern.from_frames(
+            itertools.chain(range(0, 100, 2), range(100, 0, -2)), 0.1)),
+        (LED.PULSE_QUICK, 'pulse-quick', Pattern.from_frames(
+            itertools.chain(range(0, 100, 5), range(100, 0, -5)), 0.05)),
+        # Slow breathing while music plays, and a double blip every few
+        # seconds when offline.
+        (None, 'music', Pattern([(0, 5), (2, 40, 'ease-in-out'), (4, 5, 'ease-in-out')])),
+        (None, 'offline', Pattern([(0, 0), (3, 0), (3.1, 60, 'step'), (3.2, 0, 'step'),
+                                   (3.3, 60, 'step'), (3.4, 0, 'step')])),
+]:
+    register_pattern(_name, _pattern)
+    if _state is not None:
+        register_pattern(_state, _pattern)
@@ -0,0 +1,202 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A queue that plays audio clips in the background."""
+
+import asyncio
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger('audio')
+
+# Lower values play first, and pre-empt a playing clip of a higher value.
+PRIORITY_URGENT = 0
+PRIORITY_NORMAL = 10
+PRIORITY_BACKGROUND = 20
+
+
+class PlaybackHandle(object):
+    """A clip in a PlaybackQueue.
+
+    wait() for it, `await` it from a coroutine, or cancel() it. Either way
+    the result is True if the clip played to the end, and False if it was
+    cancelled or failed.
+
+    The monotonic timestamps enqueued_at, started_at, cancelled_at and
+    finished_at tell when things happened; started_at and cancelled_at stay
+    None if the clip never started or wasn't cancelled.
+    """
+
+    def __init__(self, play, priority):
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.cancelled_at = None
+        self.finished_at = None
+        self._play = play
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._future = concurrent.futures.Future()
+
+    def cancel(self):
+        """Stop the clip, or drop it from the queue if it hasn't started."""
+        with self._lock:
+            if self._future.done() or self._cancelled.is_set():
+                return
+            self._cancelled.set()
+            self.cancelled_at = time.monotonic()
+            if self.started_at is None:
+                self._finish(False)
+
+    def cancelled(self):
+        """Return True if cancel() was called before the clip finished."""
+        return self._cancelled.is_set()
+
+    def done(self):
+        """Return True if the clip finished playing or was cancelled."""
+        return self._future.done()
+
+    def wait(self, timeout=None):
+        """Wait until the clip is done and return whether it played fully.
+
+        Raises concurrent.futures.TimeoutError after timeout seconds.
+        """
+        return self._future.result(timeout)
+
+    def add_done_callback(self, callback):
+        """Call callback(handle) once the clip is done."""
+        self._future.add_done_callback(lambda _: callback(self))
+
+    def __await__(self):
+        return asyncio.wrap_future(self._future).__await__()
+
+    @property
+    def cancel_latency_s(self):
+        """Seconds from cancel() until the clip went silent, or None."""
+        if self.cancelled_at is None or self.started_at is None or \
+                self.finished_at is None:
+            return None
+        return self.finished_at - self.cancelled_at
+
+    def _start(self):
+        with self._lock:
+            if self._cancelled.is_set():
+                return False
+            self.started_at = time.monotonic()
+            return True
+
+    def _finish(self, played):
+        self.finished_at = time.monotonic()
+        self._future.set_result(played)
+
+
+class PlaybackQueue(object):
+    """Plays clips one after another on a background thread.
+
+    Each clip is a function play(player, cancelled) that plays some audio
+    with the player and stops as soon as the threading.Event cancelled is
+    set, like Player.play_bytes(). Clips play in order of priority, then in
+    the order they were queued. A clip of a more urgent priority than the
+    one playing cancels it, so eg an error earcon can cut off a long answer.
+
+    The cancel-to-silence latency of cancelled clips is kept in
+    cancel_latencies, for the last CANCEL_LATENCY_HISTORY cancels.
+    """
+
+    CANCEL_LATENCY_HISTORY = 100
+
+    def __init__(self, player):
+        self._player = player
+        self._heap = []
+        self._counter = itertools.count()
+        self._current = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self.cancel_latencies = collections.deque(maxlen=self.CANCEL_LATENCY_HISTORY)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def enqueue(self, play, priority=PRIORITY_NORMAL):
+        """Queue a clip function and return its PlaybackHandle."""
+        handle = PlaybackHandle(play, priority)
+        with self._cond:
+            heapq.heappush(self._heap, (priority, next(self._counter), handle))
+            current = self._current
+            self._cond.notify()
+        if current and priority < current.priority:
+            logger.info('pre-empting playback for a more urgent clip')
+            current.cancel()
+        return handle
+
+    def enqueue_bytes(self, audio_bytes, sample_rate, sample_width=2,
+                      priority=PRIORITY_NORMAL):
+        """Queue raw audio, see Player.play_bytes()."""
+        return self.enqueue(
+            lambda player, cancelled: player.play_bytes(
+                audio_bytes, sample_rate, sample_width, cancelled),
+            priority)
+
+    def enqueue_wav(self, wav_path, priority=PRIORITY_NORMAL):
+        """Queue a WAV file, see Player.play_wav()."""
+        return self.enqueue(
+            lambda player, cancelled: player.play_wav(wav_path, cancelled),
+            priority)
+
+    def flush(self):
+        """Cancel the playing clip and everything queued after it."""
+        with self._cond:
+            handles = [entry[2] for entry in self._heap]
+            self._heap = []
+            if self._current:
+                handles.append(self._current)
+        for handle in handles:
+            handle.cancel()
+
+    def close(self):
+        """Flush the queue and stop the background thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                _, _, handle = heapq.heappop(self._heap)
+                if not handle._start():  # pylint: disable=protected-access
+                    continue
+                self._current = handle
+
+            try:
+                played = handle._play(self._player, handle._cancelled)  # pylint: disable=protected-access
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('playback failed')
+                played = False
+
+            with self._cond:
+                self._current = None
+            handle._finish(played is not False and not handle.cancelled())  # pylint: disable=protected-access
+            if handle.cancel_latency_s is not None:
+                self.cancel_latencies.append(handle.cancel_latency_s)
+                logger.debug('playback silenced %.1f ms after cancel',
+                             handle.cancel_latency_s * 1000)
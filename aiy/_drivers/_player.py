@@ -14,8 +14,13 @@
 
 """A driver for audio playback."""
 
+import collections
 import logging
+import os
+import queue
 import subprocess
+import threading
+import time
 import wave
 
 import aiy._drivers._alsa
@@ -23,21 +28,392 @@ import aiy._drivers._alsa
 logger = logging.getLogger('audio')
 
 
+class _QueuedStream(object):
+    """Plays audio as it arrives, see Player.open_stream().
+
+    write() only queues the data, so the caller is never held up by the
+    speed of playback. A feeder thread passes it on with _write_chunk().
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._feeder = threading.Thread(target=self._feed, daemon=True)
+        self._feeder.start()
+
+    def write(self, data):
+        """Queue audio data (mono, in the stream's format) for playback."""
+        if data:
+            self._queue.put(bytes(data))
+
+    def close(self):
+        """Wait until all queued audio has been played."""
+        self._queue.put(None)
+        self._feeder.join()
+        self._finish()
+
+    def _feed(self):
+        while True:
+            data = self._queue.get()
+            if data is None or not self._write_chunk(data):
+                break
+
+    def _write_chunk(self, data):
+        """Pass data on for playback. Returns False to stop feeding."""
+        raise NotImplementedError
+
+    def _finish(self):
+        """Called by close() once everything was passed on."""
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _AplayStream(_QueuedStream):
+    """A stream played by an aplay process of its own."""
+
+    def __init__(self, cmd):
+        self._aplay = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        super().__init__()
+
+    def _write_chunk(self, data):
+        try:
+            self._aplay.stdin.write(data)
+            self._aplay.stdin.flush()
+            return True
+        except BrokenPipeError:
+            logger.error('aplay exited while streaming')
+            return False
+
+    def _finish(self):
+        try:
+            self._aplay.stdin.close()
+        except BrokenPipeError:
+            pass
+        retcode = self._aplay.wait()
+        if retcode:
+            logger.error('aplay failed with %d', retcode)
+
+
+class _PersistentStream(_QueuedStream):
+    """A stream played through the Player's long-lived output."""
+
+    def __init__(self, output, sample_rate, sample_width):
+        self._output = output
+        self._format = (sample_rate, sample_width)
+        self._end = 0.0
+        super().__init__()
+
+    def _write_chunk(self, data):
+        self._end = self._output.write(data, *self._format)
+        return True
+
+    def _finish(self):
+        _sleep_until(self._end)
+
+
+class _PersistentOutput(object):
+    """One long-lived aplay process that plays all clips of a Player.
+
+    This saves forking aplay and opening the ALSA device for every clip.
+    Clips are written to aplay's stdin back to back; the time each one ends
+    is estimated from its length. If the sample format changes, the process
+    is restarted with the new format once the queued audio has played. If
+    aplay dies, it is restarted and the clip is written again. After
+    idle_timeout_s without audio the process exits, releasing the device.
+    """
+
+    # Bytes written to aplay at a time; restart() never waits for more than
+    # one piece, and a write in progress keeps no lock while it blocks.
+    PIECE_BYTES = 4096
+
+    def __init__(self, make_cmd, idle_timeout_s):
+        self._make_cmd = make_cmd
+        self._idle_timeout_s = idle_timeout_s
+        self._write_lock = threading.Lock()  # one clip at a time
+        self._lock = threading.Lock()  # the process and its state
+        self._aplay = None
+        self._format = None
+        self._end = 0.0  # time.monotonic() at which the queued audio ends
+        self._generation = 0  # incremented by restart()
+        self._writing = False
+        self._idle_timer = None
+
+    def write(self, data, sample_rate, sample_width):
+        """Queue data for playback and return the time.monotonic() it ends.
+
+        If restart() is called meanwhile, the rest of data is dropped.
+        """
+        audio_format = (sample_rate, sample_width)
+        data = memoryview(data).cast('B')
+        with self._write_lock:
+            if self._aplay and audio_format != self._format:
+                logger.info('audio format changed to %s, restarting aplay',
+                            audio_format)
+                _sleep_until(self._end)
+                with self._lock:
+                    aplay = self._detach()
+                _close_aplay(aplay)
+
+            with self._lock:
+                generation = self._generation
+                start = max(time.monotonic(), self._end)
+                self._writing = True
+            try:
+                if not self._write_pieces(data, audio_format, generation):
+                    return time.monotonic()
+                with self._lock:
+                    self._end = start + len(data) / float(sample_rate * sample_width)
+                    return self._end
+            finally:
+                with self._lock:
+                    self._writing = False
+                    self._schedule_idle_close()
+
+    def _write_pieces(self, data, audio_format, generation):
+        """Write data to aplay, restarting it once if it died.
+
+        Returns False if the audio was dropped.
+        """
+        written = 0
+        retried = False
+        while written < len(data):
+            with self._lock:
+                if self._generation != generation:
+                    return False
+                if not self._aplay or self._aplay.poll() is not None:
+                    self._open(audio_format)
+                aplay = self._aplay
+            try:
+                aplay.stdin.write(data[written:written + self.PIECE_BYTES])
+                aplay.stdin.flush()
+                written += self.PIECE_BYTES
+            except (BrokenPipeError, OSError, ValueError):
+                with self._lock:
+                    if self._generation != generation:
+                        return False
+                    aplay = self._detach()
+                _kill_aplay(aplay)
+                if retried:
+                    logger.error('could not restart aplay, dropping audio')
+                    return False
+                logger.warning('aplay died, restarting it')
+                retried = True
+                written = 0
+        return True
+
+    def restart(self):
+        """Drop any audio queued in aplay, for silence as soon as possible."""
+        with self._lock:
+            self._generation += 1
+            aplay = self._detach()
+        _kill_aplay(aplay)
+
+    def close(self):
+        """Wait for the queued audio, then stop aplay."""
+        with self._write_lock:
+            _sleep_until(self._end)
+            with self._lock:
+                aplay = self._detach()
+            _close_aplay(aplay)
+
+    def _open(self, audio_format):
+        self._aplay = subprocess.Popen(self._make_cmd(*audio_format),
+                                       stdin=subprocess.PIPE)
+        self._format = audio_format
+        self._end = 0.0
+
+    def _detach(self):
+        """Take aplay out of use and return it; must be called with _lock held.
+
+        The caller closes or kills it after releasing _lock, so a stuck aplay
+        doesn't block writers and the idle timer.
+        """
+        aplay, self._aplay = self._aplay, None
+        self._end = 0.0
+        return aplay
+
+    def _schedule_idle_close(self):
+        """Start the idle timer unless it runs; must be called with _lock held."""
+        if self._aplay and not self._idle_timer:
+            self._start_idle_timer(self._end - time.monotonic() + self._idle_timeout_s)
+
+    def _start_idle_timer(self, delay):
+        self._idle_timer = threading.Timer(delay, self._close_if_idle)
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+
+    def _close_if_idle(self):
+        aplay = None
+        with self._lock:
+            self._idle_timer = None
+            if not self._aplay:
+                return
+            # If audio was written since the timer started, check again once
+            # that has been idle long enough.
+            if self._writing:
+                self._start_idle_timer(self._idle_timeout_s)
+                return
+            remaining = self._end + self._idle_timeout_s - time.monotonic()
+            if remaining > 0:
+                self._start_idle_timer(remaining)
+                return
+            logger.info('releasing the audio device after %.0f s idle',
+                        self._idle_timeout_s)
+            aplay = self._detach()
+        _close_aplay(aplay)
+
+
+def _close_aplay(aplay):
+    """Let aplay play what it has, then reap it."""
+    if not aplay:
+        return
+    try:
+        aplay.stdin.close()
+    except BrokenPipeError:
+        pass
+    retcode = aplay.wait()
+    if retcode:
+        logger.error('aplay failed with %d', retcode)
+
+
+def _kill_aplay(aplay):
+    """Stop aplay at once, dropping what it has buffered, and reap it."""
+    if not aplay:
+        return
+    aplay.kill()
+    try:
+        aplay.stdin.close()
+    except BrokenPipeError:
+        pass
+    aplay.wait()
+
+
+def _pieces(chunks, piece_bytes):
+    """Split each chunk into memoryviews of at most piece_bytes."""
+    for chunk in chunks:
+        data = memoryview(chunk).cast('B')
+        for start in range(0, len(data), piece_bytes):
+            yield data[start:start + piece_bytes]
+
+
+def _sleep_until(deadline):
+    delay = deadline - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+
+_Clip = collections.namedtuple(
+    '_Clip', ['frames', 'sample_rate', 'sample_width', 'mtime', 'size', 'pinned'])
+
+
+class _PcmCache(object):
+    """An LRU cache of decoded WAV files, so clips play from RAM.
+
+    Entries are keyed by path and checked against the file's mtime and size
+    before use, so an edited file is decoded again. Least recently used
+    entries are evicted once the decoded audio exceeds max_bytes. Clips
+    passed to preload() are pinned: they are never evicted and are used
+    without even a stat() of the file. Call preload() again after changing
+    such a file.
+    """
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._clips = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, wav_path):
+        """Return the (frames, sample_rate, sample_width) of a WAV file."""
+        with self._lock:
+            clip = self._clips.get(wav_path)
+            if clip and clip.pinned:
+                self._clips.move_to_end(wav_path)
+                self.hits += 1
+                return clip[:3]
+
+        stat = os.stat(wav_path)
+        with self._lock:
+            clip = self._clips.get(wav_path)
+            if clip and (clip.mtime, clip.size) == (stat.st_mtime, stat.st_size):
+                self._clips.move_to_end(wav_path)
+                self.hits += 1
+                return clip[:3]
+            self.misses += 1
+        return self._load(wav_path, stat, pinned=False)[:3]
+
+    def preload(self, wav_path):
+        """Decode a WAV file now and keep it in memory for good."""
+        self._load(wav_path, os.stat(wav_path), pinned=True)
+
+    def clear(self):
+        """Drop all cached clips, including preloaded ones."""
+        with self._lock:
+            self._clips.clear()
+            self._bytes = 0
+
+    def _load(self, wav_path, stat, pinned):
+        with wave.open(wav_path, 'r') as wav:
+            if wav.getnchannels() != 1:
+                raise ValueError(wav_path + ' is not a mono file')
+            clip = _Clip(wav.readframes(wav.getnframes()), wav.getframerate(),
+                         wav.getsampwidth(), stat.st_mtime, stat.st_size, pinned)
+
+        with self._lock:
+            old = self._clips.pop(wav_path, None)
+            if old:
+                self._bytes -= len(old.frames)
+            if pinned or len(clip.frames) <= self._max_bytes:
+                self._clips[wav_path] = clip
+                self._bytes += len(clip.frames)
+                self._evict()
+        return clip
+
+    def _evict(self):
+        for path in list(self._clips):
+            if self._bytes <= self._max_bytes:
+                return
+            clip = self._clips[path]
+            if not clip.pinned:
+                del self._clips[path]
+                self._bytes -= len(clip.frames)
+
+
 class Player(object):
     """Plays short audio clips from a buffer or file."""
 
-    def __init__(self, output_device='default'):
-        self._output_device = output_device
+    # play_chunks writes CHUNK_S pieces, up to LEAD_S ahead of playback.
+    CHUNK_S = 0.05
+    LEAD_S = 0.2
+    IDLE_TIMEOUT_S = 10
+    PCM_CACHE_BYTES = 4 * 1024 * 1024
 
-    def play_bytes(self, audio_bytes, sample_rate, sample_width=2):
-        """Play audio from the given bytes-like object.
+    def __init__(self, output_device='default', persistent=False,
+                 idle_timeout_s=IDLE_TIMEOUT_S, pcm_cache_bytes=PCM_CACHE_BYTES):
+        """Create a Player for the given ALSA device.
 
         Args:
-          audio_bytes: audio data (mono)
-          sample_rate: sample rate in Hertz (24 kHz by default)
-          sample_width: sample width in bytes (eg 2 for 16-bit audio)
+          output_device: name of ALSA device (for a list, run `aplay -L`)
+          persistent: if True, keep one aplay process open and play all clips
+            through it, instead of starting aplay for every clip
+          idle_timeout_s: with persistent, release the device after this many
+            seconds without audio
+          pcm_cache_bytes: how much decoded audio play_wav keeps in memory
         """
-        cmd = [
+        self._output_device = output_device
+        self.pcm_cache = _PcmCache(pcm_cache_bytes)
+        self._output = None
+        if persistent:
+            self._output = _PersistentOutput(self._aplay_cmd, idle_timeout_s)
+
+    def _aplay_cmd(self, sample_rate, sample_width):
+        return [
             'aplay',
             '-q',
             '-t', 'raw',
@@ -48,6 +424,46 @@ class Player(object):
             '-r', str(sample_rate),
         ]
 
+    def open_stream(self, sample_rate, sample_width=2):
+        """Open a stream that plays audio as it is written to it.
+
+        Usage:
+            with player.open_stream(16000) as stream:
+                for chunk in chunks:
+                    stream.write(chunk)
+
+        Args:
+          sample_rate: sample rate in Hertz
+          sample_width: sample width in bytes (eg 2 for 16-bit audio)
+        """
+        if self._output:
+            return _PersistentStream(self._output, sample_rate, sample_width)
+        return _AplayStream(self._aplay_cmd(sample_rate, sample_width))
+
+    def play_bytes(self, audio_bytes, sample_rate, sample_width=2,
+                   cancelled=None):
+        """Play audio from the given bytes-like object.
+
+        Args:
+          audio_bytes: audio data (mono)
+          sample_rate: sample rate in Hertz (24 kHz by default)
+          sample_width: sample width in bytes (eg 2 for 16-bit audio)
+          cancelled: optional threading.Event; once it is set, playback stops
+            and the speaker is silenced as soon as possible
+
+        Returns:
+          False if playback was cancelled, True otherwise.
+        """
+        if cancelled is not None:
+            return self.play_chunks([audio_bytes], sample_rate, sample_width,
+                                    cancelled)
+
+        if self._output:
+            _sleep_until(self._output.write(audio_bytes, sample_rate, sample_width))
+            return True
+
+        cmd = self._aplay_cmd(sample_rate, sample_width)
+
         aplay = subprocess.Popen(cmd, stdin=subprocess.PIPE)
         aplay.stdin.write(audio_bytes)
         aplay.stdin.close()
@@ -55,17 +471,90 @@ class Player(object):
 
         if retcode:
             logger.error('aplay failed with %d', retcode)
+        return True
+
+    def play_chunks(self, chunks, sample_rate, sample_width=2, cancelled=None):
+        """Play an iterable of audio chunks back to back.
+
+        The chunks go to one aplay process (or the persistent one), so they
+        play without gaps as long as each arrives before the previous one
+        ends. The iterable may block, eg while the next chunk is computed.
+
+        Audio is written in CHUNK_S pieces, at most LEAD_S ahead of playback,
+        so writes never block on a full pipe and a cancel is noticed right
+        away. aplay is then killed, dropping whatever it still had buffered.
+
+        Args:
+          chunks: iterable of bytes-like audio data (mono)
+          sample_rate: sample rate in Hertz
+          sample_width: sample width in bytes (eg 2 for 16-bit audio)
+          cancelled: optional threading.Event to stop playback
+
+        Returns:
+          False if playback was cancelled, True otherwise.
+        """
+        if cancelled is None:
+            cancelled = threading.Event()
+        piece_bytes = int(self.CHUNK_S * sample_rate) * sample_width
+        bytes_per_s = float(sample_rate * sample_width)
+
+        aplay = None
+        if not self._output:
+            aplay = subprocess.Popen(self._aplay_cmd(sample_rate, sample_width),
+                                     stdin=subprocess.PIPE)
+        try:
+            end = time.monotonic()
+            try:
+                for piece in _pieces(chunks, piece_bytes):
+                    if cancelled.wait(max(0, end - self.LEAD_S - time.monotonic())):
+                        break
+                    if aplay:
+                        aplay.stdin.write(piece)
+                        aplay.stdin.flush()
+                        end = max(time.monotonic(), end) + len(piece) / bytes_per_s
+                    else:
+                        end = self._output.write(piece, sample_rate, sample_width)
+            except BrokenPipeError:
+                logger.error('aplay exited while playing')
+
+            if cancelled.wait(max(0, end - time.monotonic())):
+                if aplay:
+                    _kill_aplay(aplay)
+                else:
+                    self._output.restart()
+                return False
+            _close_aplay(aplay)
+            return True
+        finally:
+            # Eg the chunks iterable raised: don't leave aplay running.
+            if aplay and aplay.returncode is None:
+                _kill_aplay(aplay)
+
+    def close(self):
+        """Release the audio device kept open by a persistent Player."""
+        if self._output:
+            self._output.close()
+
+    def preload_wav(self, wav_path):
+        """Decode a WAV file into memory, so play_wav doesn't touch the disk.
 
-    def play_wav(self, wav_path):
+        Use this at startup for clips that must start quickly, like the
+        trigger sound.
+        """
+        self.pcm_cache.preload(os.path.abspath(wav_path))
+
+    def play_wav(self, wav_path, cancelled=None):
         """Play audio from the given WAV file.
 
-        The file should be mono and small enough to load into memory.
+        The file should be mono and small enough to load into memory. The
+        decoded audio is cached, see preload_wav.
         Args:
           wav_path: path to the wav file
-        """
-        with wave.open(wav_path, 'r') as wav:
-            if wav.getnchannels() != 1:
-                raise ValueError(wav_path + ' is not a mono file')
+          cancelled: optional threading.Event to stop playback, see play_bytes
 
-            frames = wav.readframes(wav.getnframes())
-            self.play_bytes(frames, wav.getframerate(), wav.getsampwidth())
+        Returns:
+          False if playback was cancelled, True otherwise.
+        """
+        frames, sample_rate, sample_width = self.pcm_cache.get(
+            os.path.abspath(wav_path))
+        return self.play_bytes(frames, sample_rate, sample_width, cancelled)
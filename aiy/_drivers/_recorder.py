@@ -16,6 +16,7 @@
 
 import logging
 import os
+import queue
 import subprocess
 import threading
 
@@ -23,6 +24,76 @@ import aiy._drivers._alsa
 
 logger = logging.getLogger('recorder')
 
+# Policies for processors that run on their own dispatch thread, applied when
+# the processor's queue is full.
+DISPATCH_BLOCK = 'block'
+DISPATCH_DROP_OLDEST = 'drop-oldest'
+DISPATCH_DROP_NEWEST = 'drop-newest'
+
+
+class _DispatchWorker(object):
+    """Feeds one processor from a bounded queue on its own thread.
+
+    The worker stands in for the processor in the recorder's processor list:
+    its add_data copies the borrowed chunk into the queue and returns
+    immediately, or after at most block_timeout_s with DISPATCH_BLOCK.
+    Chunks that don't fit are counted in 'dropped'.
+    """
+
+    def __init__(self, processor, queue_chunks, policy, block_timeout_s):
+        if policy not in (DISPATCH_BLOCK, DISPATCH_DROP_OLDEST, DISPATCH_DROP_NEWEST):
+            raise ValueError('unsupported dispatch policy: %s' % policy)
+
+        self.processor = processor
+        self.dropped = 0
+        self._policy = policy
+        self._block_timeout_s = block_timeout_s
+        self._queue = queue.Queue(queue_chunks)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add_data(self, data):
+        data = bytes(data)
+        if self._policy == DISPATCH_DROP_OLDEST:
+            while True:
+                try:
+                    self._queue.put_nowait(data)
+                    return
+                except queue.Full:
+                    self._discard_oldest()
+        try:
+            if self._policy == DISPATCH_BLOCK:
+                self._queue.put(data, timeout=self._block_timeout_s)
+            else:
+                self._queue.put_nowait(data)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Stop the thread, discarding any chunks not yet processed."""
+        self._closed = True
+        while True:
+            try:
+                self._queue.put_nowait(None)
+                return
+            except queue.Full:
+                self._discard_oldest()
+
+    def _discard_oldest(self):
+        try:
+            self._queue.get_nowait()
+            self.dropped += 1
+        except queue.Empty:
+            pass
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None or self._closed:
+                return
+            self.processor.add_data(data)
+
 
 class Recorder(threading.Thread):
     """A driver to record audio from the VoiceHat microphones.
@@ -31,16 +102,28 @@ class Recorder(threading.Thread):
     callbacks. It reads audio in a configurable format from the microphone,
     then converts it to a known format before passing it to the processors.
 
-    This driver accumulates input (audio samples) in a local buffer. Once the
-    buffer contains more than CHUNK_S seconds, it passes the chunk to all
-    processors. An audio processor defines a 'add_data' method that receives
-    the chunk of audio samples to process.
+    This driver reads input (audio samples) straight into a preallocated ring
+    of RING_CHUNKS slots, each CHUNK_S seconds long. Once a slot is full, it
+    passes a memoryview of that slot to all processors. An audio processor
+    defines a 'add_data' method that receives the chunk of audio samples to
+    process.
+
+    The chunk handed to 'add_data' is only borrowed: the slot is overwritten
+    once the ring wraps around, so a processor that keeps the data beyond the
+    call must copy it, eg with bytes(data).
+
+    The ring also keeps up to preroll_s seconds of already dispatched audio,
+    so a processor can be added with the audio from just before it was added.
     """
 
     CHUNK_S = 0.1
+    RING_CHUNKS = 4
+    BLOCK_TIMEOUT_S = 0.05
 
     def __init__(self, input_device='default',
-                 channels=1, bytes_per_sample=2, sample_rate_hz=16000):
+                 channels=1, bytes_per_sample=2, sample_rate_hz=16000,
+                 threaded_dispatch=False, queue_chunks=20,
+                 dispatch_policy=DISPATCH_DROP_OLDEST, preroll_s=0):
         """Create a Recorder with the given audio format.
 
         The Recorder will not start until start() is called. start() is called
@@ -50,13 +133,37 @@ class Recorder(threading.Thread):
         - channels: number of channels in audio read from the mic
         - bytes_per_sample: sample width in bytes (eg 2 for 16-bit audio)
         - sample_rate_hz: sample rate in hertz
+        - threaded_dispatch: if True, each processor gets its own thread and
+          bounded queue, so a slow processor can't stall the capture loop
+        - queue_chunks: default queue length of each processor, in chunks
+        - dispatch_policy: default policy when a processor's queue is full;
+          one of DISPATCH_BLOCK (wait up to BLOCK_TIMEOUT_S, then drop),
+          DISPATCH_DROP_OLDEST or DISPATCH_DROP_NEWEST
+        - preroll_s: seconds of past audio to keep for add_processor(preroll_s)
         """
 
         super().__init__(daemon=True)
 
-        self._processors = []
+        # Replaced rather than mutated, so the capture thread can iterate
+        # over it while processors are added and removed.
+        self._processors = ()
+        self._workers = {}
+        self._threaded_dispatch = threaded_dispatch
+        self._queue_chunks = queue_chunks
+        self._dispatch_policy = dispatch_policy
 
         self._chunk_bytes = int(self.CHUNK_S * sample_rate_hz) * channels * bytes_per_sample
+        self._preroll_chunks = int(round(preroll_s / self.CHUNK_S))
+        self._ring_chunks = self.RING_CHUNKS + self._preroll_chunks
+        self._ring = bytearray(self._chunk_bytes * self._ring_chunks)
+        # Number of chunks filled so far. Together with the processor list it
+        # is guarded by _lock, so a processor added with pre-roll sees every
+        # chunk exactly once.
+        self._chunks_captured = 0
+        # Targets still receiving their pre-roll; remove_processor() drops
+        # them from here.
+        self._adding = set()
+        self._lock = threading.Lock()
 
         self._cmd = [
             'arecord',
@@ -71,7 +178,8 @@ class Recorder(threading.Thread):
         self._arecord = None
         self._closed = False
 
-    def add_processor(self, processor):
+    def add_processor(self, processor, queue_chunks=None, dispatch_policy=None,
+                      preroll_s=0):
         """Add an audio processor.
 
         An audio processor is an object that has an 'add_data' method with the
@@ -84,20 +192,104 @@ class Recorder(threading.Thread):
             # processes the chunk of data here.
 
         The added processor may be called multiple times with chunks of audio data.
+        Each chunk is a memoryview into the recorder's ring buffer, which is
+        only valid for the duration of the call. Copy it if you need to keep it.
+
+        With threaded dispatch, the processor is called on its own thread with
+        a bytes copy of each chunk. queue_chunks and dispatch_policy override
+        the recorder's defaults for this processor, and are ignored otherwise.
+
+        If preroll_s is set, the processor first receives up to that many
+        seconds of audio captured before it was added (capped by the recorder's
+        own preroll_s). These chunks are delivered back to back rather than in
+        real time, so eg a speech request can catch up with the user. They are
+        delivered without holding the recorder's lock, so the processor may
+        call remove_processor() from add_data() meanwhile; chunks captured
+        during the pre-roll follow it before live dispatch starts.
         """
-        self._processors.append(processor)
+        if self._threaded_dispatch:
+            worker = _DispatchWorker(
+                processor,
+                queue_chunks or self._queue_chunks,
+                dispatch_policy or self._dispatch_policy,
+                self.BLOCK_TIMEOUT_S)
+            target = worker
+        else:
+            target = processor
+
+        with self._lock:
+            if target is not processor:
+                self._workers[processor] = target
+            if not preroll_s:
+                self._processors += (target,)
+                return
+            self._adding.add(target)
+            delivered = self._chunks_captured
+            audio = self._get_chunks(delivered, min(int(round(preroll_s / self.CHUNK_S)),
+                                                    self._preroll_chunks, delivered))
+
+        while True:
+            audio = memoryview(audio)
+            for start in range(0, len(audio), self._chunk_bytes):
+                if target not in self._adding:
+                    return  # removed during the pre-roll
+                target.add_data(audio[start:start + self._chunk_bytes])
+            with self._lock:
+                if target not in self._adding:
+                    return
+                if self._chunks_captured == delivered:
+                    self._adding.discard(target)
+                    self._processors += (target,)
+                    return
+                # The slot after the last captured chunk is being overwritten.
+                missed = self._chunks_captured - delivered
+                if missed > self._ring_chunks - 1:
+                    logger.warning('pre-roll was too slow, dropped %d chunks',
+                                   missed - self._ring_chunks + 1)
+                    missed = self._ring_chunks - 1
+                audio = self._get_chunks(self._chunks_captured, missed)
+                delivered = self._chunks_captured
 
     def remove_processor(self, processor):
-        """Remove an added audio processor."""
-        try:
-            self._processors.remove(processor)
-        except ValueError:
-            logger.warn("processor was not found in the list")
+        """Remove an added audio processor.
+
+        May be called from the processor's add_data(), on the capture thread.
+        """
+        with self._lock:
+            target = self._workers.pop(processor, processor)
+            if target in self._adding:
+                self._adding.discard(target)
+            elif target not in self._processors:
+                logger.warning("processor was not found in the list")
+                return
+            self._processors = tuple(p for p in self._processors if p is not target)
+        if target is not processor:
+            target.close()
+
+    def get_dropped_chunks(self, processor):
+        """Return how many chunks were dropped for a threaded processor."""
+        worker = self._workers.get(processor)
+        return worker.dropped if worker else 0
+
+    def _get_chunks(self, end, count):
+        """Copy the count chunks before chunk number end from the ring.
+
+        Must be called with _lock held, for chunks still in the ring.
+        """
+        first = (end - count) % self._ring_chunks
+        if first + count <= self._ring_chunks:
+            start = first * self._chunk_bytes
+            return bytes(self._ring[start:start + count * self._chunk_bytes])
+        wrapped = first + count - self._ring_chunks
+        return (bytes(self._ring[first * self._chunk_bytes:]) +
+                bytes(self._ring[:wrapped * self._chunk_bytes]))
 
     def run(self):
         """Reads data from arecord and passes to processors."""
 
-        self._arecord = subprocess.Popen(self._cmd, stdout=subprocess.PIPE)
+        # Unbuffered, so readinto() fills the ring directly from the pipe.
+        self._arecord = subprocess.Popen(
+            self._cmd, stdout=subprocess.PIPE, bufsize=0)
         logger.info("started recording")
 
         # Check for race-condition when __exit__ is called at the same time as
@@ -106,17 +298,7 @@ class Recorder(threading.Thread):
             self._arecord.kill()
             return
 
-        this_chunk = b''
-
-        while True:
-            input_data = self._arecord.stdout.read(self._chunk_bytes)
-            if not input_data:
-                break
-
-            this_chunk += input_data
-            if len(this_chunk) >= self._chunk_bytes:
-                self._handle_chunk(this_chunk[:self._chunk_bytes])
-                this_chunk = this_chunk[self._chunk_bytes:]
+        self._capture(self._arecord.stdout)
 
         if not self._closed:
             logger.error('Microphone recorder died unexpectedly, aborting...')
@@ -125,15 +307,38 @@ class Recorder(threading.Thread):
             logging.shutdown()
             os._exit(1)  # pylint: disable=protected-access
 
+    def _capture(self, stream):
+        """Fill the ring from the stream and dispatch each full slot.
+
+        Returns when the stream reaches EOF.
+        """
+        ring = memoryview(self._ring)
+        slot = self._chunks_captured % self._ring_chunks
+        while True:
+            start = slot * self._chunk_bytes
+            chunk = ring[start:start + self._chunk_bytes]
+            filled = 0
+            while filled < self._chunk_bytes:
+                count = stream.readinto(chunk[filled:])
+                if not count:
+                    return
+                filled += count
+
+            with self._lock:
+                self._chunks_captured += 1
+                processors = self._processors
+            self._handle_chunk(chunk, processors)
+            slot = (slot + 1) % self._ring_chunks
+
     def stop(self):
         """Stops the recorder and cleans up all resources."""
         self._closed = True
         if self._arecord:
             self._arecord.kill()
 
-    def _handle_chunk(self, chunk):
+    def _handle_chunk(self, chunk, processors):
         """Send audio chunk to all processors."""
-        for p in self._processors:
+        for p in processors:
             p.add_data(chunk)
 
     def __enter__(self):
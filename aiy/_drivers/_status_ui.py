@@ -14,8 +14,11 @@
 
 """A status UI powered by the LED on the VoiceHat."""
 
+import collections
 import logging
 import os.path
+import time
+import wave
 
 import aiy.audio
 import aiy.voicehat
@@ -28,10 +31,22 @@ class _StatusUi(object):
 
     The LED and optionally a trigger sound tell the user when the box is
     ready, listening or thinking.
+
+    Status changes don't block: the trigger sound is queued on the playback
+    queue. transitions holds (status, started, finished) time.monotonic()
+    stamps of the last TRANSITION_HISTORY calls to status(), and
+    trigger_sound_handle the PlaybackHandle of the last trigger sound.
     """
 
+    TRANSITION_HISTORY = 50
+    # Seconds the trigger sound may still come out of the speaker after its
+    # clip finished, from the sound card's buffer.
+    TRIGGER_SOUND_TAIL_S = 0.1
+
     def __init__(self):
         self._trigger_sound_wave = None
+        self.trigger_sound_handle = None
+        self.transitions = collections.deque(maxlen=self.TRANSITION_HISTORY)
         self._state_map = {
             "starting": aiy.voicehat.LED.PULSE_QUICK,
             "ready": aiy.voicehat.LED.BEACON_DARK,
@@ -40,22 +55,39 @@ class _StatusUi(object):
             "stopping": aiy.voicehat.LED.PULSE_QUICK,
             "power-off": aiy.voicehat.LED.OFF,
             "error": aiy.voicehat.LED.BLINK_3,
+            "music": "music",
+            "offline": "offline",
         }
         aiy.voicehat.get_led().set_state(aiy.voicehat.LED.OFF)
 
+    def set_pattern(self, status, pattern):
+        """Set the LED pattern shown for a status, adding the status if new.
+
+        The pattern is an aiy.voicehat.LedPattern, the name of a registered
+        pattern, or one of the aiy.voicehat.LED constants.
+        """
+        self._state_map[status] = pattern
+
     def set_trigger_sound_wave(self, trigger_sound_wave):
         """Set the trigger sound.
 
         A trigger sound is played when the status is 'listening' to indicate
         that the assistant is actively listening to the user.
         The trigger_sound_wave argument should be the path to a valid wave file.
-        If it is None, the trigger sound is disabled.
+        If it is None, the trigger sound is disabled. The file is decoded
+        now, so the sound plays from memory.
         """
         if not trigger_sound_wave:
             self._trigger_sound_wave = None
+            return
         expanded_path = os.path.expanduser(trigger_sound_wave)
         if os.path.exists(expanded_path):
             self._trigger_sound_wave = expanded_path
+            try:
+                aiy.audio.preload_wave(expanded_path)
+            except (OSError, EOFError, ValueError, wave.Error):
+                logger.exception('Could not preload trigger sound %s',
+                                 expanded_path)
         else:
             logger.warning(
                 'File %s specified as trigger sound does not exist.',
@@ -65,14 +97,44 @@ class _StatusUi(object):
     def status(self, status):
         """Activate the status.
 
-        This method updates the LED animation. Returns True if the status is
-        valid and has been updated.
+        This method updates the LED animation, and for 'listening' queues the
+        trigger sound. It returns without waiting for either. Returns True if
+        the status is valid and has been updated.
+
+        The trigger sound is played with PRIORITY_URGENT, so it pre-empts
+        anything else being played, such as the answer to the previous
+        question: the user asking something new interrupts it. Recognizers
+        call wait_for_trigger_sound() before they start listening.
         """
+        started = time.monotonic()
         if status not in self._state_map:
             logger.warning("unsupported state: %s, must be one of %s",
                            status, ",".join(self._state_map.keys()))
             return False
         aiy.voicehat.get_led().set_state(self._state_map[status])
         if status == 'listening' and self._trigger_sound_wave:
-            aiy.audio.play_wave(self._trigger_sound_wave)
+            self.trigger_sound_handle = aiy.audio.play_wave_async(
+                self._trigger_sound_wave, priority=aiy.audio.PRIORITY_URGENT)
+        finished = time.monotonic()
+        self.transitions.append((status, started, finished))
+        logger.debug('status %s set in %.0f us', status, (finished - started) * 1e6)
         return True
+
+    def wait_for_trigger_sound(self, preroll_s=0):
+        """Wait until the last trigger sound has been played.
+
+        Returns how many of the last preroll_s seconds of recorded audio
+        came after it, so that a recognizer's pre-roll doesn't include the
+        trigger sound picked up by the microphone.
+        """
+        handle = self.trigger_sound_handle
+        if handle is None:
+            return preroll_s
+        handle.wait()
+        if handle.started_at is None:
+            return preroll_s  # dropped before it played
+        quiet_s = time.monotonic() - handle.finished_at - self.TRIGGER_SOUND_TAIL_S
+        if quiet_s < 0:
+            time.sleep(-quiet_s)
+            return 0
+        return min(preroll_s, quiet_s)
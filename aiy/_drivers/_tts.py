@@ -14,18 +14,305 @@
 
 """Wrapper around a TTS system."""
 
+import collections
+import concurrent.futures
 import functools
+import hashlib
+import itertools
 import logging
 import os
-import subprocess
-import tempfile
+import re
+import threading
+import wave
 from aiy import i18n
+import aiy._drivers._tts_engine
 
 # Path to a tmpfs directory to avoid SD card wear
 TMP_DIR = '/run/user/%d' % os.getuid()
 
+# Synthesized phrases are kept in memory and, in a tmpfs directory, on disk.
+MEMORY_CACHE_BYTES = 8 * 1024 * 1024
+DISK_CACHE_BYTES = 16 * 1024 * 1024
+CACHE_DIR = os.path.join(TMP_DIR, 'aiy-tts-cache')
+
+WARM_UP_WORKERS = 2
+
+# Pipelined say() speaks sentences, or clauses of long sentences, one by one.
+MAX_CHUNK_CHARS = 120
+_SENTENCE_END = re.compile(r'(?<=[.!?;:])\s+')
+_CLAUSE_END = re.compile(r'(?<=,)\s+')
+
 logger = logging.getLogger('tts')
 
+_cache = None
+_cache_lock = threading.Lock()
+_engine = aiy._drivers._tts_engine.PicoEngine()
+
+
+def _read_wav(path):
+    with wave.open(path, 'r') as wav:
+        return (wav.readframes(wav.getnframes()), wav.getframerate(),
+                wav.getsampwidth())
+
+
+def _single(frames):
+    yield frames
+
+
+def _write_wav(path, audio):
+    frames, sample_rate, sample_width = audio
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(sample_width)
+        wav.setframerate(sample_rate)
+        wav.writeframes(frames)
+
+
+class _Abandoned(Exception):
+    """Whoever was synthesizing a phrase stopped before it was complete."""
+
+
+class _TtsCache(object):
+    """Synthesized audio, keyed by a hash of the engine, language and markup.
+
+    A phrase is looked up in a memory LRU of at most memory_bytes of PCM,
+    then among the WAV files in cache_dir, which are pruned oldest first
+    beyond disk_bytes. Only on a miss in both is the TTS engine run, once
+    per phrase even if several threads ask for it at the same time. The
+    disk tier is only used if the parent of cache_dir exists, so that it
+    is on the tmpfs and never on the SD card. It survives restarts of the
+    process, but not reboots.
+
+    On a miss, stream() hands out the engine's chunks as they are produced
+    and caches the phrase only once all of them have been read.
+    """
+
+    def __init__(self, memory_bytes=MEMORY_CACHE_BYTES, disk_bytes=DISK_CACHE_BYTES,
+                 cache_dir=CACHE_DIR):
+        self.metrics = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+        }
+        self._memory_bytes = memory_bytes
+        self._disk_bytes = disk_bytes
+        self._memory = collections.OrderedDict()
+        self._memory_used = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+        self._cache_dir = None
+        if disk_bytes and os.path.isdir(os.path.dirname(cache_dir)):
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                self._cache_dir = cache_dir
+            except OSError:
+                logger.warning('Not caching TTS output on disk: cannot create %s',
+                               cache_dir)
+
+    def get(self, words, lang):
+        """Return (frames, sample_rate, sample_width) of the spoken words."""
+        audio = self.stream(words, lang)
+        return b''.join(audio.chunks), audio.sample_rate, audio.sample_width
+
+    def stream(self, words, lang):
+        """Return a TtsAudio of the spoken words.
+
+        On a hit its chunks are the cached frames. On a miss they come from
+        the engine as it synthesizes, so playback can start right away.
+        Read them to the end, or close() them to give up.
+        """
+        engine = _engine
+        text = engine.markup(words)
+        key = hashlib.sha1(
+            ('%s\0%s\0%s' % (engine.name, lang, text)).encode('utf-8')).hexdigest()
+        while True:
+            with self._lock:
+                audio = self._memory.get(key)
+                if audio:
+                    self._memory.move_to_end(key)
+                    self.metrics['memory_hits'] += 1
+                    return _as_tts_audio(audio)
+                future = self._pending.get(key)
+                if future is None:
+                    future = self._pending[key] = concurrent.futures.Future()
+                    break
+            try:
+                return _as_tts_audio(future.result())
+            except _Abandoned:
+                pass  # try again, synthesizing it ourselves if need be
+
+        path = os.path.join(self._cache_dir, key + '.wav') if self._cache_dir else None
+        try:
+            audio = self._load(path) if path else None
+            if audio:
+                self._finish(key, future, audio)
+                return _as_tts_audio(audio)
+            with self._lock:
+                self.metrics['misses'] += 1
+            stream = engine.stream(text, lang)
+        except Exception as e:
+            self._finish(key, future, error=e)
+            raise
+        chunks = self._record(key, path, stream, future)
+        next(chunks)  # start it, so that close() always finishes the entry
+        return stream._replace(chunks=chunks)
+
+    def warm_up(self, phrases, lang, workers=WARM_UP_WORKERS):
+        """Synthesize phrases in the background, return a list of futures."""
+        with self._lock:
+            if not self._executor:
+                self._executor = concurrent.futures.ThreadPoolExecutor(workers)
+        return [self._executor.submit(self.get, words, lang) for words in phrases]
+
+    def _load(self, path):
+        try:
+            audio = _read_wav(path)
+            os.utime(path)
+        except (OSError, EOFError, wave.Error):
+            return None
+        with self._lock:
+            self.metrics['disk_hits'] += 1
+        return audio
+
+    def _record(self, key, path, stream, future):
+        """Yield the engine's chunks, then cache the audio they make up."""
+        frames = bytearray()
+        complete = False
+        try:
+            yield
+            for chunk in stream.chunks:
+                frames += chunk
+                yield chunk
+            complete = True
+        finally:
+            if complete:
+                audio = (bytes(frames), stream.sample_rate, stream.sample_width)
+                self._finish(key, future, audio)
+                if path:
+                    self._save(path, audio)
+            else:
+                stream.chunks.close()
+                self._finish(key, future, error=_Abandoned())
+
+    def _finish(self, key, future, audio=None, error=None):
+        """Cache audio (unless there was an error) and wake up waiters."""
+        if audio:
+            self._remember(key, audio)
+        with self._lock:
+            del self._pending[key]
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(audio)
+
+    def _save(self, path, audio):
+        try:
+            _write_wav(path + '.tmp', audio)
+            os.rename(path + '.tmp', path)
+            self._prune_disk()
+        except (OSError, wave.Error):
+            logger.exception('Could not cache TTS output in %s', self._cache_dir)
+
+    def _remember(self, key, audio):
+        size = len(audio[0])
+        if size > self._memory_bytes:
+            return
+        with self._lock:
+            self._memory[key] = audio
+            self._memory_used += size
+            while self._memory_used > self._memory_bytes:
+                _, old = self._memory.popitem(last=False)
+                self._memory_used -= len(old[0])
+
+    def _prune_disk(self):
+        files = []
+        for name in os.listdir(self._cache_dir):
+            if not name.endswith('.wav'):
+                continue
+            path = os.path.join(self._cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        used = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if used <= self._disk_bytes:
+                break
+            try:
+                os.unlink(path)
+                used -= size
+            except OSError:
+                pass
+
+
+def _split_text(words):
+    """Split text into sentences, and long sentences into clauses."""
+    chunks = []
+    for sentence in _SENTENCE_END.split(words.strip()):
+        if len(sentence) <= MAX_CHUNK_CHARS:
+            chunks.append(sentence)
+            continue
+        clause = ''
+        for part in _CLAUSE_END.split(sentence):
+            if clause and len(clause) + len(part) >= MAX_CHUNK_CHARS:
+                chunks.append(clause)
+                clause = part
+            else:
+                clause = clause + ' ' + part if clause else part
+        chunks.append(clause)
+    return [chunk for chunk in chunks if chunk]
+
+
+def _as_tts_audio(audio):
+    frames, sample_rate, sample_width = audio
+    return aiy._drivers._tts_engine.TtsAudio(sample_rate, sample_width, _single(frames))
+
+
+def _synthesize_ahead(cache, chunks, lang):
+    """Return a generator of the audio of each chunk.
+
+    The first chunk is synthesized right away, and each next one while the
+    previous one is consumed.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    upcoming = [executor.submit(cache.get, chunks[0], lang)] if chunks else []
+
+    def results():
+        try:
+            for i in range(len(chunks)):
+                current = upcoming.pop()
+                if i + 1 < len(chunks):
+                    upcoming.append(executor.submit(cache.get, chunks[i + 1], lang))
+                yield current.result()
+        finally:
+            # Don't hold up a cancel; a synthesis in flight still ends up cached.
+            executor.shutdown(wait=False)
+
+    return results()
+
+
+def set_engine(engine):
+    """Use the given TtsEngine for all further synthesis."""
+    global _engine
+    _engine = engine
+
+
+def get_engine():
+    """Return the TtsEngine in use, by default a PicoEngine."""
+    return _engine
+
+
+def get_cache():
+    """Return the TTS cache shared by say() and warm_up()."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = _TtsCache()
+        return _cache
+
 
 def create_say(player):
     """Return a function say(words) for the given player."""
@@ -33,26 +320,49 @@ def create_say(player):
     return functools.partial(say, player, lang=lang)
 
 
-def say(player, words, lang='en-US'):
+def say(player, words, lang='en-US', cancelled=None, pipelined=True):
     """Say the given words with TTS.
 
+    Repeated phrases are played from the cache, see get_cache().
+
     Args:
       player: To play the text-to-speech audio.
       words: string to say aloud.
       lang: language for the text-to-speech engine.
+      cancelled: optional threading.Event to stop speaking, see
+        Player.play_bytes.
+      pipelined: if True, split the text into sentences and synthesize the
+        next one while the current one plays, so long answers start sooner.
+
+    Returns:
+      False if speaking was cancelled, True otherwise.
     """
+    cache = get_cache()
+    chunks = _split_text(words) if pipelined else []
+    if len(chunks) < 2:
+        chunks = [words]
+    # The first chunk plays as it is synthesized, the others are synthesized
+    # one ahead meanwhile.
+    first = cache.stream(chunks[0], lang)
+    rest = _synthesize_ahead(cache, chunks[1:], lang)
     try:
-        (fd, tts_wav) = tempfile.mkstemp(suffix='.wav', dir=TMP_DIR)
-    except IOError:
-        logger.exception('Using fallback directory for TTS output')
-        (fd, tts_wav) = tempfile.mkstemp(suffix='.wav')
-    os.close(fd)
-    words = '<volume level="60"><pitch level="130">%s</pitch></volume>' % words
-    try:
-        subprocess.call(['pico2wave', '--lang', lang, '-w', tts_wav, words])
-        player.play_wav(tts_wav)
+        if cancelled is not None and cancelled.is_set():
+            return False
+        return player.play_chunks(
+            itertools.chain(first.chunks, (frames for frames, _, _ in rest)),
+            first.sample_rate, first.sample_width, cancelled)
     finally:
-        os.unlink(tts_wav)
+        first.chunks.close()
+        rest.close()
+
+
+def warm_up(phrases, lang='en-US'):
+    """Synthesize phrases in a background worker pool, so say() finds them.
+
+    Returns:
+      a list of concurrent.futures.Future, one per phrase.
+    """
+    return get_cache().warm_up(phrases, lang)
 
 
 def _main():
@@ -0,0 +1,185 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local TTS engines that stream PCM through a pipe."""
+
+import collections
+import logging
+import os
+import struct
+import subprocess
+import tempfile
+import threading
+
+logger = logging.getLogger('tts')
+
+# Path to a tmpfs directory to avoid SD card wear
+TMP_DIR = '/run/user/%d' % os.getuid()
+# tmpfs for everyone, for when TMP_DIR doesn't exist (eg no login session)
+SHM_DIR = '/dev/shm'
+
+# The audio of some words: sample_rate and sample_width describe the mono
+# PCM that the chunks iterable yields as the engine produces it.
+TtsAudio = collections.namedtuple('TtsAudio', ['sample_rate', 'sample_width', 'chunks'])
+
+_READ_BYTES = 4096
+
+
+class TtsEngine(object):
+    """A TTS engine, to be passed to aiy._drivers._tts.set_engine().
+
+    Subclasses implement stream(), and may override markup() to add
+    engine-specific markup to the words. The name and markup are part of
+    the TTS cache key, so different engines don't share cached audio.
+    """
+
+    name = None
+
+    def markup(self, words):
+        """Return the text, with any markup, that is passed to the engine."""
+        return words
+
+    def stream(self, words, lang):
+        """Start synthesizing words and return a TtsAudio.
+
+        Args:
+          words: the text returned by markup()
+          lang: language code like 'en-US'
+        """
+        raise NotImplementedError
+
+
+class WavPipeEngine(TtsEngine):
+    """An engine run as a command that writes a WAV file to its stdout.
+
+    Subclasses implement command(). The WAV header is parsed from the pipe
+    as it arrives, ignoring its size fields, which engines writing to a
+    pipe can't fill in. Nothing is written to the filesystem.
+    """
+
+    def command(self, words, lang):
+        """Return the argument list that synthesizes words to stdout."""
+        raise NotImplementedError
+
+    def stream(self, words, lang):
+        process = subprocess.Popen(self.command(words, lang), stdout=subprocess.PIPE)
+        try:
+            sample_rate, sample_width = _read_wav_header(process.stdout)
+        except (EOFError, ValueError):
+            process.stdout.close()
+            process.wait()
+            raise ValueError('%s produced no valid WAV output (exit code %s)' %
+                             (self.name, process.returncode))
+        return TtsAudio(sample_rate, sample_width, self._chunks(process))
+
+    def _chunks(self, process):
+        try:
+            while True:
+                data = process.stdout.read1(_READ_BYTES)
+                if not data:
+                    break
+                yield data
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            retcode = process.wait()
+            if retcode > 0:
+                logger.error('%s failed with %d', self.name, retcode)
+
+
+class PicoEngine(WavPipeEngine):
+    """SVOX Pico, through pico2wave.
+
+    pico2wave only writes to a file whose name ends in .wav, so it is given
+    a symlink to /dev/stdout, made once in TMP_DIR, or if that is missing
+    in a private directory on SHM_DIR, so it is never on the SD card.
+    """
+
+    name = 'pico'
+
+    def __init__(self, volume=60, pitch=130):
+        self._volume = volume
+        self._pitch = pitch
+        self._stdout_wav = None
+        self._lock = threading.Lock()
+
+    def markup(self, words):
+        return '<volume level="%d"><pitch level="%d">%s</pitch></volume>' % (
+            self._volume, self._pitch, words)
+
+    def command(self, words, lang):
+        return ['pico2wave', '--lang', lang, '-w', self._get_stdout_wav(), words]
+
+    def _get_stdout_wav(self):
+        with self._lock:
+            if not self._stdout_wav:
+                if os.path.isdir(TMP_DIR):
+                    directory = TMP_DIR
+                else:
+                    directory = tempfile.mkdtemp(prefix='aiy-tts-', dir=SHM_DIR)
+                path = os.path.join(directory, 'aiy-tts-stdout.wav')
+                if os.path.realpath(path) != os.path.realpath('/dev/stdout'):
+                    if os.path.lexists(path):
+                        os.unlink(path)
+                    os.symlink('/dev/stdout', path)
+                self._stdout_wav = path
+            return self._stdout_wav
+
+
+class EspeakEngine(WavPipeEngine):
+    """eSpeak NG (or eSpeak), which can write WAV to stdout by itself."""
+
+    name = 'espeak'
+
+    def __init__(self, command='espeak-ng', speed=None):
+        self._command = command
+        self._speed = speed
+
+    def command(self, words, lang):
+        cmd = [self._command, '--stdout', '-v', lang.lower()]
+        if self._speed:
+            cmd += ['-s', str(self._speed)]
+        return cmd + [words]
+
+
+def _read_exact(stream, count):
+    data = b''
+    while len(data) < count:
+        more = stream.read(count - len(data))
+        if not more:
+            raise EOFError('WAV stream ended early')
+        data += more
+    return data
+
+
+def _read_wav_header(stream):
+    """Read up to the start of the audio data, return (rate, width)."""
+    riff, _, wave_id = struct.unpack('<4sI4s', _read_exact(stream, 12))
+    if riff != b'RIFF' or wave_id != b'WAVE':
+        raise ValueError('not a WAV stream')
+    sample_format = None
+    while True:
+        chunk_id, size = struct.unpack('<4sI', _read_exact(stream, 8))
+        if chunk_id == b'data':
+            if not sample_format:
+                raise ValueError('WAV data before format')
+            return sample_format
+        body = _read_exact(stream, size + (size & 1))
+        if chunk_id == b'fmt ':
+            channels, sample_rate = struct.unpack('<HI', body[2:8])
+            bits = struct.unpack('<H', body[14:16])[0]
+            if channels != 1:
+                raise ValueError('TTS engine output is not mono')
+            sample_format = (sample_rate, bits // 8)
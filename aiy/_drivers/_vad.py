@@ -0,0 +1,156 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local voice activity detector that ends utterances without the server."""
+
+import logging
+
+import numpy
+
+logger = logging.getLogger('vad')
+
+# Energy of a full scale 16-bit sine, used to express frame energy in dBFS.
+_FULL_SCALE_DB = 10 * numpy.log10(32768.0 ** 2 / 2)
+
+
+class VoiceActivityDetector(object):
+    """An audio processor that detects speech from frame energy and zero crossings.
+
+    Each chunk from the Recorder is split into FRAME_S frames. For every frame
+    the detector computes the energy above a tracked noise floor and the zero
+    crossing rate, and turns them into a speech probability. Once speech has
+    been heard and is followed by trailing_silence_s of non-speech, it ends
+    the utterance: it calls end_audio() on the request and then the callback.
+
+    All per-frame work is vectorized with NumPy, so the cost per chunk is a
+    handful of array operations regardless of the frame count.
+
+    Usage:
+        vad = VoiceActivityDetector(request, callback=on_end_of_speech)
+        recorder.add_processor(vad)
+    """
+
+    FRAME_S = 0.02
+
+    # Zero crossing rates above this are more likely hiss or fricative noise
+    # than voiced speech, so they lower the speech probability.
+    VOICED_ZCR = 0.25
+
+    # Per chunk, the most the noise floor rises towards the quietest frame
+    # when that frame is clearly not speech (less than half of snr_db above
+    # the floor), and how much it drifts up when every frame may be speech.
+    # The drift lets the floor follow a louder background eventually without
+    # letting continuous speech raise it: 0.05 dB per 100 ms chunk takes
+    # about 30 s to close the gap to a talker 25 dB above the floor.
+    NOISE_RISE_DB = 0.5
+    NOISE_DRIFT_DB = 0.05
+
+    def __init__(self, request=None, callback=None, trailing_silence_s=0.8,
+                 min_speech_s=0.1, speech_threshold=0.5, snr_db=9.0,
+                 sample_rate_hz=16000):
+        """Create a detector for 16-bit mono audio.
+
+        Args:
+          request: object with an end_audio() method, eg a GenericSpeechRequest,
+            or None to only report probabilities.
+          callback: function without arguments called after end of speech.
+          trailing_silence_s: non-speech needed after speech to end the
+            utterance.
+          min_speech_s: speech needed before the utterance can end.
+          speech_threshold: probability above which a frame counts as speech.
+          snr_db: energy above the noise floor at which the probability is 0.5.
+          sample_rate_hz: sample rate of the audio.
+        """
+        self._request = request
+        self._callback = callback
+        self._frame_samples = int(self.FRAME_S * sample_rate_hz)
+        self._trailing_frames = int(round(trailing_silence_s / self.FRAME_S))
+        self._min_speech_frames = int(round(min_speech_s / self.FRAME_S))
+        self._speech_threshold = speech_threshold
+        self._snr_db = snr_db
+        self._probability_cb = None
+        self._noise_floor_db = None
+        self.reset()
+
+    def reset(self):
+        """Forget the previous utterance. The noise floor is kept."""
+        self.probabilities = numpy.zeros(0, dtype=numpy.float32)
+        self.speech_frames = 0
+        self.silence_frames = 0
+        self.ended = False
+
+    def set_probability_cb(self, cb):
+        """Call cb with a NumPy array of per-frame speech probabilities.
+
+        It is called once per chunk from the recorder thread.
+        """
+        self._probability_cb = cb
+
+    def add_data(self, data):
+        samples = numpy.frombuffer(data, dtype='<i2')
+        frame_count = len(samples) // self._frame_samples
+        if not frame_count:
+            return
+
+        frames = samples[:frame_count * self._frame_samples].reshape(
+            frame_count, self._frame_samples).astype(numpy.float32)
+        self.probabilities = probabilities = self._frame_probabilities(frames)
+
+        if self._probability_cb:
+            self._probability_cb(probabilities)
+
+        if not self.ended:
+            self._update_endpointer(probabilities >= self._speech_threshold)
+
+    def _frame_probabilities(self, frames):
+        energy_db = 10 * numpy.log10(
+            numpy.mean(frames * frames, axis=1) + 1e-3) - _FULL_SCALE_DB
+        signs = numpy.signbit(frames)
+        zcr = numpy.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+
+        # Track the noise floor from the quietest frames: follow it down at
+        # once, and only let frames that are clearly not speech raise it.
+        quietest = float(energy_db.min())
+        if self._noise_floor_db is None or quietest < self._noise_floor_db:
+            self._noise_floor_db = quietest
+        else:
+            rise = quietest - self._noise_floor_db
+            if rise < self._snr_db / 2:
+                self._noise_floor_db += min(self.NOISE_RISE_DB, rise)
+            else:
+                self._noise_floor_db += self.NOISE_DRIFT_DB
+
+        snr = energy_db - self._noise_floor_db
+        probabilities = 1 / (1 + numpy.exp(self._snr_db - snr))
+        noisiness = numpy.clip((zcr - self.VOICED_ZCR) / self.VOICED_ZCR, 0, 1)
+        probabilities *= 1 - 0.5 * noisiness
+        return probabilities.astype(numpy.float32)
+
+    def _update_endpointer(self, is_speech):
+        speech = numpy.flatnonzero(is_speech)
+        if len(speech):
+            self.speech_frames += len(speech)
+            self.silence_frames = len(is_speech) - 1 - int(speech[-1])
+        else:
+            self.silence_frames += len(is_speech)
+
+        if (self.speech_frames >= self._min_speech_frames and
+                self.silence_frames >= self._trailing_frames):
+            logger.info('local end of speech after %d speech frames',
+                        self.speech_frames)
+            self.ended = True
+            if self._request:
+                self._request.end_audio()
+            if self._callback:
+                self._callback()
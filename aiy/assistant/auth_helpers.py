@@ -21,10 +21,10 @@ import os
 import os.path
 import sys
 
-import google_auth_oauthlib.flow
-import google.auth.transport
 import google.oauth2.credentials
 
+import aiy._apis._credentials
+
 
 _ASSISTANT_OAUTH_SCOPE = (
     'https://www.googleapis.com/auth/assistant-sdk-prototype'
@@ -45,7 +45,7 @@ _ASSISTANT_CREDENTIALS = (
 _ASSISTANT_CREDENTIALS_FILE = os.path.expanduser('~/assistant.json')
 
 
-def _load_credentials(credentials_path):
+def _load_credentials(credentials_path, wait_for_token=True, background_refresh=True):
     migrate = False
     with open(credentials_path, 'r') as f:
         credentials_data = json.load(f)
@@ -58,12 +58,17 @@ def _load_credentials(credentials_path):
             json.dump(credentials_data, f)
     credentials = google.oauth2.credentials.Credentials(token=None,
                                                         **credentials_data)
-    http_request = google.auth.transport.requests.Request()
-    credentials.refresh(http_request)
+    # Reuses a cached access token if there is one, and unless the caller
+    # refreshes the credentials itself, keeps refreshing it in the background.
+    aiy._apis._credentials.get_credentials_manager(credentials).ensure_valid(
+        wait_for_token, background_refresh)
     return credentials
 
 
 def _credentials_flow_interactive(client_secrets_path):
+    # Only needed once, to authorize; it's slow to import.
+    import google_auth_oauthlib.flow
+
     flow = google_auth_oauthlib.flow.InstalledAppFlow.from_client_secrets_file(
         client_secrets_path,
         scopes=[_ASSISTANT_OAUTH_SCOPE])
@@ -88,11 +93,11 @@ def _save_credentials(credentials_path, credentials):
         }, f)
 
 
-def _try_to_get_credentials(client_secrets):
+def _try_to_get_credentials(client_secrets, wait_for_token=True, background_refresh=True):
     """Try to get credentials, or print an error and quit on failure."""
 
     if os.path.exists(_ASSISTANT_CREDENTIALS):
-        return _load_credentials(_ASSISTANT_CREDENTIALS)
+        return _load_credentials(_ASSISTANT_CREDENTIALS, wait_for_token, background_refresh)
 
     if not os.path.exists(_VR_CACHE_DIR):
         os.mkdir(_VR_CACHE_DIR)
@@ -121,7 +126,19 @@ User's Guide for more info.""")
     return credentials
 
 
-def get_assistant_credentials(credentials_file=None):
+def get_assistant_credentials(credentials_file=None, wait_for_token=True,
+                              background_refresh=True):
+    """Returns the Assistant credentials, authorizing first if needed.
+
+    Args:
+      credentials_file: path of the client secrets, used to authorize
+      wait_for_token: if False, return without waiting for an access token
+          when there is no cached one.
+      background_refresh: if False, don't refresh the token from a
+          background thread. Pass False for users, like the Assistant
+          library, that refresh the credentials themselves, and pass
+          wait_for_token=False too if they refresh a missing token.
+    """
     if credentials_file is None:
         credentials_file = _ASSISTANT_CREDENTIALS_FILE
-    return _try_to_get_credentials(credentials_file)
+    return _try_to_get_credentials(credentials_file, wait_for_token, background_refresh)
@@ -29,28 +29,82 @@ class _AssistantRecognizer(object):
     def __init__(self, credentials):
         self._request = aiy._apis._speech.AssistantSpeechRequest(credentials)
         self._recorder = aiy.audio.get_recorder()
+        self._preroll_s = 0
+        self._vad = None
 
-    def recognize(self):
+    def recognize(self, stream_audio=False):
         """Recognizes the user's speech and gets answers from Google Assistant.
 
         This function listens to the user's speech via the VoiceHat speaker and
         sends the audio to the Google Assistant Library. The response is returned in
         both text and audio.
 
+        If stream_audio is True, the answer is also played through the VoiceHat
+        speaker while it is received, and this function returns once it has
+        been played.
+
         Usage:
             transcript, audio = my_recognizer.recognize()
             if transcript is not None:
                 print('You said ', transcript)
                 aiy.audio.play_audio(audio)
+
+            # Or, to hear the answer sooner:
+            transcript, _ = my_recognizer.recognize(stream_audio=True)
         """
+        if stream_audio:
+            with aiy.audio.get_player().open_stream(
+                    aiy.audio.AUDIO_SAMPLE_RATE_HZ,
+                    aiy.audio.AUDIO_SAMPLE_SIZE) as stream:
+                self._request.set_audio_sink(stream)
+                try:
+                    return self.recognize()
+                finally:
+                    self._request.set_audio_sink(None)
+
         self._request.reset()
         self._request.set_endpointer_cb(self._endpointer_callback)
-        self._recorder.add_processor(self._request)
+        # Don't send the trigger sound, which the microphone picks up.
+        preroll_s = aiy.voicehat.wait_for_trigger_sound(self._preroll_s)
+        self._recorder.add_processor(self._request, preroll_s=preroll_s)
+        if self._vad:
+            self._vad.reset()
+            self._recorder.add_processor(self._vad)
         response = self._request.do_request()
         return response.transcript, response.response_audio
 
+    def set_preroll(self, preroll_s):
+        """Include audio from before recognize() was called.
+
+        The request starts with up to preroll_s seconds of audio captured
+        before recognize() (at most aiy.audio.RECORDER_PREROLL_S), so words
+        spoken right after the button press are not lost. This audio is
+        uploaded faster than real time. Use 0 to disable.
+        """
+        self._preroll_s = preroll_s
+
+    def enable_local_endpointer(self, trailing_silence_s=0.8):
+        """End utterances with a local voice activity detector.
+
+        The request stops sending audio after trailing_silence_s of silence
+        following speech, without waiting for the server to detect the end of
+        the utterance. Use None to rely on the server only.
+
+        This needs NumPy.
+        """
+        import aiy._drivers._vad
+
+        if trailing_silence_s is None:
+            self._vad = None
+        else:
+            self._vad = aiy._drivers._vad.VoiceActivityDetector(
+                self._request, callback=self._endpointer_callback,
+                trailing_silence_s=trailing_silence_s)
+
     def _endpointer_callback(self):
         self._recorder.remove_processor(self._request)
+        if self._vad:
+            self._recorder.remove_processor(self._vad)
 
 
 def get_assistant():
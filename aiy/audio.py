@@ -17,6 +17,7 @@
 import time
 import wave
 
+import aiy._drivers._playback
 import aiy._drivers._player
 import aiy._drivers._recorder
 import aiy._drivers._tts
@@ -24,9 +25,25 @@ import aiy._drivers._tts
 AUDIO_SAMPLE_SIZE = 2  # bytes per sample
 AUDIO_SAMPLE_RATE_HZ = 16000
 
+# Seconds of audio the recorder keeps so recognizers can include speech from
+# just before they were started.
+RECORDER_PREROLL_S = 2.0
+
+# Whether the shared player keeps one aplay process open for all clips,
+# rather than starting aplay for every trigger sound and answer. This holds
+# the audio device until the player has been idle for a while, so it is
+# opt-in: set it before the first get_player() call.
+PLAYER_PERSISTENT = False
+
+# Priorities for the *_async functions; urgent clips cut off normal ones.
+PRIORITY_URGENT = aiy._drivers._playback.PRIORITY_URGENT
+PRIORITY_NORMAL = aiy._drivers._playback.PRIORITY_NORMAL
+PRIORITY_BACKGROUND = aiy._drivers._playback.PRIORITY_BACKGROUND
+
 # Global variables. They are lazily initialized.
 _voicehat_recorder = None
 _voicehat_player = None
+_playback_queue = None
 _status_ui = None
 
 
@@ -67,7 +84,7 @@ def get_player():
     """
     global _voicehat_player
     if _voicehat_player is None:
-        _voicehat_player = aiy._drivers._player.Player()
+        _voicehat_player = aiy._drivers._player.Player(persistent=PLAYER_PERSISTENT)
     return _voicehat_player
 
 
@@ -79,7 +96,8 @@ def get_recorder():
     """
     global _voicehat_recorder
     if _voicehat_recorder is None:
-        _voicehat_recorder = aiy._drivers._recorder.Recorder()
+        _voicehat_recorder = aiy._drivers._recorder.Recorder(
+            preroll_s=RECORDER_PREROLL_S)
     return _voicehat_recorder
 
 
@@ -102,6 +120,14 @@ def play_wave(wave_file):
     player.play_wav(wave_file)
 
 
+def preload_wave(wave_file):
+    """Loads the given wave file into memory, so play_wave starts it at once.
+
+    The wave file has to be mono and small enough to be loaded in memory.
+    """
+    get_player().preload_wav(wave_file)
+
+
 def play_audio(audio_data):
     """Plays the given audio data."""
     player = get_player()
@@ -119,6 +145,58 @@ def say(words, lang=None):
     aiy._drivers._tts.say(aiy.audio.get_player(), words, lang=lang)
 
 
+def warm_up_speech(phrases, lang=None):
+    """Synthesizes phrases in the background, so say() can play them at once.
+
+    Returns a list of futures, one per phrase.
+    """
+    if not lang:
+        lang = aiy.i18n.get_language_code()
+    return aiy._drivers._tts.warm_up(phrases, lang)
+
+
+def get_playback_queue():
+    """Returns the queue that plays the *_async clips on the player.
+
+    Clips play one at a time in the background; see
+    aiy._drivers._playback.PlaybackQueue for priorities and pre-emption.
+    """
+    global _playback_queue
+    if _playback_queue is None:
+        _playback_queue = aiy._drivers._playback.PlaybackQueue(get_player())
+    return _playback_queue
+
+
+def play_wave_async(wave_file, priority=PRIORITY_NORMAL):
+    """Queues the given wave file and returns without waiting for it.
+
+    Returns a handle that can be waited for, awaited or cancelled.
+    """
+    return get_playback_queue().enqueue_wav(wave_file, priority)
+
+
+def play_audio_async(audio_data, priority=PRIORITY_NORMAL):
+    """Queues the given audio data, see play_wave_async."""
+    return get_playback_queue().enqueue_bytes(
+        audio_data, AUDIO_SAMPLE_RATE_HZ, AUDIO_SAMPLE_SIZE, priority)
+
+
+def say_async(words, lang=None, priority=PRIORITY_NORMAL):
+    """Queues the given words to be said, see say and play_wave_async."""
+    if not lang:
+        lang = aiy.i18n.get_language_code()
+    return get_playback_queue().enqueue(
+        lambda player, cancelled: aiy._drivers._tts.say(
+            player, words, lang=lang, cancelled=cancelled),
+        priority)
+
+
+def stop_playback():
+    """Silences the speaker and drops all queued clips, eg for barge-in."""
+    if _playback_queue is not None:
+        _playback_queue.flush()
+
+
 def get_status_ui():
     """Returns a driver to access the StatusUI daemon.
 
@@ -15,6 +15,8 @@
 """An API to access Google Speech recognition service."""
 
 import os.path
+import queue
+import threading
 
 import aiy._apis._speech
 import aiy.audio
@@ -34,18 +36,73 @@ class _CloudSpeechRecognizer(object):
     def __init__(self, credentials_file):
         self._request = aiy._apis._speech.CloudSpeechRequest(credentials_file)
         self._recorder = aiy.audio.get_recorder()
+        self._preroll_s = 0
+        self._vad = None
 
-    def recognize(self):
+    def recognize(self, partial_cb=None):
         """Recognizes the user's speech and transcript it into text.
 
         This function listens to the user's speech via the VoiceHat speaker. Then it
         contacts Google CloudSpeech APIs and returns a textual transcript if possible.
+
+        If partial_cb is given, it is called with each hypothesis as it arrives,
+        as a namedtuple (transcript, stability, is_final). It may call cancel()
+        to stop listening; the latest transcript is then returned.
         """
+        self._request.set_partial_result_cb(partial_cb)
         self._request.reset()
         self._request.set_endpointer_cb(self._endpointer_callback)
-        self._recorder.add_processor(self._request)
+        # Don't send the trigger sound, which the microphone picks up.
+        preroll_s = aiy.voicehat.wait_for_trigger_sound(self._preroll_s)
+        self._recorder.add_processor(self._request, preroll_s=preroll_s)
+        if self._vad:
+            self._vad.reset()
+            self._recorder.add_processor(self._vad)
         return self._request.do_request().transcript
 
+    def recognize_partials(self):
+        """Recognizes the user's speech, yielding hypotheses as they arrive.
+
+        Yields namedtuples (transcript, stability, is_final), where is_final
+        is set once the service has finalized the transcript. There may be
+        no final one, eg if the recognition is cancelled or the service
+        returns no final result: iteration then just ends, so check
+        is_final rather than relying on the last item. Stop iterating to
+        cancel the recognition, for example:
+
+        for partial in recognizer.recognize_partials():
+            if partial.transcript.strip() == 'stop' and partial.stability > 0.8:
+                stop_music()
+                break
+        """
+        partials = queue.Queue()
+
+        def _recognize():
+            try:
+                self.recognize(partial_cb=partials.put)
+            except Exception as exc:  # pylint: disable=broad-except
+                partials.put(exc)
+            partials.put(None)
+
+        thread = threading.Thread(target=_recognize, daemon=True)
+        thread.start()
+        try:
+            while True:
+                partial = partials.get()
+                if partial is None:
+                    return
+                if isinstance(partial, Exception):
+                    raise partial
+                yield partial
+        finally:
+            if thread.is_alive():
+                self.cancel()
+                thread.join()
+
+    def cancel(self):
+        """Stops a recognition in progress on another thread."""
+        self._request.cancel()
+
     def expect_phrase(self, phrase):
         """Explicitly tells the engine that the phrase is more likely to appear.
 
@@ -59,8 +116,38 @@ class _CloudSpeechRecognizer(object):
         """
         self._request.add_phrase(phrase)
 
+    def set_preroll(self, preroll_s):
+        """Include audio from before recognize() was called.
+
+        The request starts with up to preroll_s seconds of audio captured
+        before recognize() (at most aiy.audio.RECORDER_PREROLL_S), so words
+        spoken right after the button press are not lost. This audio is
+        uploaded faster than real time. Use 0 to disable.
+        """
+        self._preroll_s = preroll_s
+
+    def enable_local_endpointer(self, trailing_silence_s=0.8):
+        """End utterances with a local voice activity detector.
+
+        The request stops sending audio after trailing_silence_s of silence
+        following speech, without waiting for the server to detect the end of
+        the utterance. Use None to rely on the server only.
+
+        This needs NumPy.
+        """
+        import aiy._drivers._vad
+
+        if trailing_silence_s is None:
+            self._vad = None
+        else:
+            self._vad = aiy._drivers._vad.VoiceActivityDetector(
+                self._request, callback=self._endpointer_callback,
+                trailing_silence_s=trailing_silence_s)
+
     def _endpointer_callback(self):
         self._recorder.remove_processor(self._request)
+        if self._vad:
+            self._recorder.remove_processor(self._vad)
 
 
 def get_recognizer():
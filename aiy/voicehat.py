@@ -25,6 +25,11 @@ _GPIO_LED = 25
 # Import LED class to expose the LED constants.
 LED = aiy._drivers._led.LED
 
+# Expose LED patterns, for new states, eg
+#   register_led_pattern('alarm', LedPattern([(0, 0), (0.2, 100), (0.4, 0)]))
+LedPattern = aiy._drivers._led.Pattern
+register_led_pattern = aiy._drivers._led.register_pattern
+
 # Global variables. They are lazily initialized.
 _voicehat_button = None
 _voicehat_led = None
@@ -45,7 +50,7 @@ def get_button():
         ...
 
     Asynchronous usage:
-        def on_button_press(_):
+        def on_button_press():
             print('The button is pressed!')
 
         button = aiy.voicehat.get_button()
@@ -56,6 +61,9 @@ def get_button():
         # To cancel the callback, pass None:
         button.on_press(None)
         # Calling wait_for_press() also cancels any callback.
+
+    Long and double presses can be handled with on_long_press() and
+    on_double_press(), and wait_for_press() takes an optional timeout.
     """
     global _voicehat_button
     if _voicehat_button is None:
@@ -107,3 +115,14 @@ def get_status_ui():
     if _status_ui is None:
         _status_ui = aiy._drivers._status_ui._StatusUi()
     return _status_ui
+
+
+def wait_for_trigger_sound(preroll_s=0):
+    """Waits for the trigger sound, for recognizers about to start listening.
+
+    Returns how many of the last preroll_s seconds of audio were recorded
+    after the trigger sound (all of them if the status UI isn't used).
+    """
+    if _status_ui is None:
+        return preroll_s
+    return _status_ui.wait_for_trigger_sound(preroll_s)
@@ -0,0 +1,90 @@
+"""Benchmark the button driver: press latency, debouncing and gestures.
+
+Runs the real Button driver against the simulated RPi.GPIO, with contact
+bounce on every press. Measures the time from the first simulated edge to
+the on_press() callback and to wait_for_press() returning, and checks that
+each press, double press and long press is reported exactly once.
+
+Usage:
+    python3 -m benchmarks.button_latency [--presses 30] [--bounces 3]
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+from benchmarks import harness
+
+CHANNEL = 23
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--presses', type=int, default=30)
+    parser.add_argument('--bounces', type=int, default=3,
+                        help='contact bounces after each press edge')
+    parser.add_argument('--save', help='write the summary to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier --save')
+    args = parser.parse_args()
+
+    harness.install_fakes()
+    import RPi.GPIO as GPIO
+    import aiy._drivers._button
+
+    button = aiy._drivers._button.Button(CHANNEL)
+    samples = {'edge_to_callback': [], 'edge_to_wait_return': []}
+
+    def _press_later(delay=0.05, duration_s=0.1):
+        first_edge = len(GPIO.edges)
+        threading.Timer(delay, GPIO.simulate_press,
+                        [CHANNEL, duration_s, args.bounces]).start()
+        return first_edge
+
+    # wait_for_press(), and its timeout.
+    for _ in range(args.presses):
+        first_edge = _press_later()
+        if not button.wait_for_press(timeout=2):
+            sys.exit('wait_for_press() missed a press')
+        samples['edge_to_wait_return'].append(time.monotonic() - GPIO.edges[first_edge][2])
+        time.sleep(0.3)
+    start = time.monotonic()
+    if button.wait_for_press(timeout=0.2):
+        sys.exit('wait_for_press() returned without a press')
+    timeout_error = time.monotonic() - start - 0.2
+
+    # on_press() callbacks, spaced beyond the double press time.
+    called = []
+    button.on_press(lambda: called.append(time.monotonic()))
+    for _ in range(args.presses):
+        first_edge = _press_later(delay=0)
+        time.sleep(button.double_press_time + 0.2)
+        samples['edge_to_callback'].append(called[-1] - GPIO.edges[first_edge][2])
+    presses = len(called)
+
+    # Gestures.
+    gestures = []
+    button.on_double_press(lambda: gestures.append('double'))
+    button.on_long_press(lambda: gestures.append('long'))
+    _press_later(delay=0)
+    time.sleep(0.2)
+    _press_later(delay=0)
+    time.sleep(1)
+    _press_later(delay=0, duration_s=button.long_press_time + 0.3)
+    time.sleep(button.long_press_time + 0.6)
+
+    summary = harness.summarize(samples)
+    harness.print_summary(summary)
+    print('presses: %d/%d  bounces ignored: %d  gestures: %s  timeout error: %.1f ms' % (
+        presses, args.presses, button.metrics['bounces_ignored'], gestures,
+        timeout_error * 1e3))
+    if args.save:
+        harness.save(summary, args.save)
+    if args.compare:
+        harness.compare(summary, args.compare)
+    if presses != args.presses or gestures != ['double', 'long']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Benchmark time to first response with fresh and reused gRPC channels.
+
+Runs Cloud Speech requests against the local fake server, once creating a
+new request (and so a new channel) per turn, as before channels were cached,
+and once reusing one request and its cached channel.
+
+Usage:
+    python3 -m benchmarks.channel_reuse [--turns 50] [--latency 0.02]
+"""
+
+import argparse
+import statistics
+
+import aiy._apis._fake_server
+import aiy._apis._speech
+
+# 1.2 s of silence; the fake server's endpointer fires after 1 s of audio.
+_AUDIO = bytes(int(1.2 * 16000) * 2)
+_CHUNK_BYTES = 3200
+
+
+def _turn(request):
+    request.reset()
+    for start in range(0, len(_AUDIO), _CHUNK_BYTES):
+        request.add_data(_AUDIO[start:start + _CHUNK_BYTES])
+    request.end_audio()
+    request.do_request()
+    return request.timings
+
+
+def _report(name, timings):
+    first = sorted(t['first_response'] for t in timings)
+    print('%-7s first response: median %6.1f ms  p90 %6.1f ms  '
+          'channel: median %6.2f ms' % (
+              name, statistics.median(first) * 1e3,
+              first[int(len(first) * 0.9) - 1] * 1e3,
+              statistics.median(t['channel'] for t in timings) * 1e3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--turns', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='server delay before the first response')
+    args = parser.parse_args()
+
+    server = aiy._apis._fake_server.FakeSpeechServer([
+        aiy._apis._fake_server.Script(
+            transcript='what time is it',
+            first_response_delay_s=args.latency)])
+    server.start()
+    aiy._apis._speech.set_api_override(server.target)
+    try:
+        _report('fresh', [
+            _turn(aiy._apis._speech.CloudSpeechRequest(None))
+            for _ in range(args.turns)])
+        request = aiy._apis._speech.CloudSpeechRequest(None)
+        _report('reused', [_turn(request) for _ in range(args.turns)])
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
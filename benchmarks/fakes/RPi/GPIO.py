@@ -0,0 +1,193 @@
+"""A simulated RPi.GPIO for running the aiy drivers off a Raspberry Pi.
+
+Implements the part of the RPi.GPIO API the drivers use. Input levels are
+driven by the simulate_* functions, edge callbacks run on one background
+thread like in RPi.GPIO, and every PWM duty cycle change is timestamped.
+"""
+
+import queue
+import threading
+import time
+
+BCM = 11
+BOARD = 10
+IN = 1
+OUT = 0
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+_lock = threading.Lock()
+_levels = {}
+_idle_levels = {}
+_detectors = {}
+_callbacks_queue = queue.Queue()
+_callbacks_thread = None
+
+# Timestamps (time.monotonic) of simulated edges, as (channel, level, time).
+edges = []
+
+
+class _Detector(object):
+
+    def __init__(self, edge, bouncetime):
+        self.edge = edge
+        self.bouncetime = bouncetime
+        self.callbacks = []
+        self.detected = False
+        self.last_edge = None
+
+
+def setmode(mode):
+    pass
+
+
+def setwarnings(flag):
+    pass
+
+
+def setup(channel, direction, pull_up_down=PUD_OFF, initial=LOW):
+    with _lock:
+        level = HIGH if pull_up_down == PUD_UP else LOW
+        if direction == OUT:
+            level = initial
+        _levels[channel] = _idle_levels[channel] = level
+
+
+def input(channel):  # pylint: disable=redefined-builtin
+    return _levels.get(channel, LOW)
+
+
+def output(channel, value):
+    _levels[channel] = value
+
+
+def cleanup(channel=None):
+    with _lock:
+        if channel is None:
+            _detectors.clear()
+        else:
+            _detectors.pop(channel, None)
+
+
+def add_event_detect(channel, edge, callback=None, bouncetime=None):
+    with _lock:
+        if channel in _detectors:
+            raise RuntimeError('Conflicting edge detection already enabled for this GPIO channel')
+        _detectors[channel] = _Detector(edge, bouncetime)
+        if callback:
+            _detectors[channel].callbacks.append(callback)
+    _start_callbacks_thread()
+
+
+def add_event_callback(channel, callback):
+    with _lock:
+        if channel not in _detectors:
+            raise RuntimeError('Add event detection using add_event_detect first')
+        _detectors[channel].callbacks.append(callback)
+
+
+def remove_event_detect(channel):
+    with _lock:
+        _detectors.pop(channel, None)
+
+
+def event_detected(channel):
+    with _lock:
+        detector = _detectors.get(channel)
+        if detector and detector.detected:
+            detector.detected = False
+            return True
+    return False
+
+
+def simulate_level(channel, level):
+    """Drive an input to level, firing edge detection if it changed."""
+    now = time.monotonic()
+    with _lock:
+        if _levels.get(channel) == level:
+            return
+        _levels[channel] = level
+        edges.append((channel, level, now))
+        detector = _detectors.get(channel)
+        if not detector:
+            return
+        edge = RISING if level else FALLING
+        if detector.edge not in (edge, BOTH):
+            return
+        if (detector.bouncetime and detector.last_edge is not None and
+                now - detector.last_edge < detector.bouncetime / 1000.0):
+            return
+        detector.last_edge = now
+        detector.detected = True
+        callbacks = list(detector.callbacks)
+    for callback in callbacks:
+        _callbacks_queue.put((callback, channel))
+
+
+def simulate_press(channel, duration_s=0.15, bounces=0, bounce_s=0.002):
+    """Press a button wired to channel for duration_s, without blocking.
+
+    The pressed level is the opposite of the channel's idle level. bounces
+    adds that many short contact bounces after the first edge.
+    """
+    idle = _idle_levels.get(channel, HIGH)
+    pressed = LOW if idle else HIGH
+
+    def _press():
+        simulate_level(channel, pressed)
+        for _ in range(bounces):
+            time.sleep(bounce_s)
+            simulate_level(channel, idle)
+            time.sleep(bounce_s)
+            simulate_level(channel, pressed)
+        time.sleep(duration_s)
+        simulate_level(channel, idle)
+
+    threading.Thread(target=_press, daemon=True).start()
+
+
+def _start_callbacks_thread():
+    global _callbacks_thread
+    with _lock:
+        if _callbacks_thread is None:
+            _callbacks_thread = threading.Thread(target=_run_callbacks, daemon=True)
+            _callbacks_thread.start()
+
+
+def _run_callbacks():
+    while True:
+        callback, channel = _callbacks_queue.get()
+        callback(channel)
+
+
+class PWM(object):
+    """A PWM output that records its duty cycle changes."""
+
+    # All instances, so a benchmark can find the ones the drivers created.
+    instances = []
+
+    def __init__(self, channel, frequency):
+        self.channel = channel
+        self.frequency = frequency
+        self.duty_cycle = None
+        self.log = []
+        PWM.instances.append(self)
+
+    def start(self, duty_cycle):
+        self.ChangeDutyCycle(duty_cycle)
+
+    def ChangeDutyCycle(self, duty_cycle):  # pylint: disable=invalid-name
+        self.duty_cycle = duty_cycle
+        self.log.append((time.monotonic(), duty_cycle))
+
+    def ChangeFrequency(self, frequency):  # pylint: disable=invalid-name
+        self.frequency = frequency
+
+    def stop(self):
+        self.duty_cycle = None
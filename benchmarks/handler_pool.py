@@ -0,0 +1,94 @@
+"""Benchmark event-loop lag with command handlers run inline or pooled.
+
+Replays a stream of simulated Assistant events, some of which trigger a
+command handler that runs a subprocess (sleep, standing in for amixer,
+hostname or TTS), once calling handlers inline on the event loop as
+_process_event used to and once submitting them to a HandlerPool, with
+music commands in one serialization group.
+
+Metrics per mode:
+  event_lag   event due -> event handled (how late the LED/status would be)
+  loop_busy   time _process_event held the loop per event
+  handler     event due -> handler finished, for events with a handler
+
+Usage:
+    python3 -m benchmarks.handler_pool [--events 200] [--handler-s 0.3]
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks import harness
+
+import handler_pool
+
+
+def _events(count, interval_s, handler_fraction, rng):
+    """(due offset, group or None, has handler) for each simulated event."""
+    events = []
+    for i in range(count):
+        has_handler = rng.random() < handler_fraction
+        group = 'music' if has_handler and rng.random() < 0.5 else None
+        events.append((i * interval_s, group, has_handler))
+    return events
+
+
+def _run(events, handler_s, pooled):
+    pool = handler_pool.HandlerPool(max_pending=len(events)) if pooled else None
+    command = ['sleep', '%.3f' % handler_s]
+    samples = {'event_lag': [], 'loop_busy': [], 'handler': []}
+    tasks = []
+    start = time.monotonic()
+    for offset, group, has_handler in events:
+        due = start + offset
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        handled = time.monotonic()
+        samples['event_lag'].append(handled - due)
+        if has_handler:
+            if pooled:
+                tasks.append((due, pool.submit(handler_pool.call, command, group=group)))
+            else:
+                handler_pool.call(command)
+                samples['handler'].append(time.monotonic() - due)
+        samples['loop_busy'].append(time.monotonic() - handled)
+    for due, task in tasks:
+        task.wait()
+        samples['handler'].append(task.finished_at - due)
+    if pool:
+        pool.close()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.05,
+                        help='seconds between simulated events')
+    parser.add_argument('--handlers', type=float, default=0.1,
+                        help='fraction of events that run a handler')
+    parser.add_argument('--handler-s', type=float, default=0.3,
+                        help='seconds each handler runs its subprocess')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write the summary to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier --save')
+    args = parser.parse_args()
+
+    events = _events(args.events, args.interval, args.handlers, random.Random(args.seed))
+    samples = {}
+    for mode, pooled in (('inline', False), ('pooled', True)):
+        for metric, values in _run(events, args.handler_s, pooled).items():
+            samples['%s_%s' % (mode, metric)] = values
+
+    summary = harness.summarize(samples)
+    harness.print_summary(summary)
+    if args.save:
+        harness.save(summary, args.save)
+    if args.compare:
+        harness.compare(summary, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Shared helpers for the benchmarks: stand-ins, statistics and comparisons.
+
+install_fakes() must run before any aiy module that imports RPi.GPIO is
+imported. It puts the simulated RPi.GPIO on sys.path and the fake arecord
+and aplay (see benchmarks/fakes/bin) first on $PATH, so the real drivers
+run unchanged against them.
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+_FAKES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakes')
+
+
+def install_fakes(arecord_wav=None):
+    """Use the stand-ins for RPi.GPIO, arecord and aplay.
+
+    Args:
+      arecord_wav: WAV file the fake arecord plays on SIGUSR1.
+
+    Returns:
+      path of the fake aplay's timing log.
+    """
+    sys.path.insert(0, _FAKES_DIR)
+    os.environ['PATH'] = os.path.join(_FAKES_DIR, 'bin') + os.pathsep + os.environ['PATH']
+    if arecord_wav:
+        os.environ['FAKE_ARECORD_WAV'] = os.path.abspath(arecord_wav)
+    fd, log_path = tempfile.mkstemp(prefix='fake-aplay-', suffix='.jsonl')
+    os.close(fd)
+    os.environ['FAKE_APLAY_LOG'] = log_path
+    return log_path
+
+
+def read_aplay_log(log_path, since=None):
+    """Returns the fake aplay runs logged, optionally those started after since."""
+    with open(log_path) as f:
+        runs = [json.loads(line) for line in f if line.strip()]
+    return [run for run in runs if since is None or run['start'] >= since]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values, eg fraction=0.9 for p90."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Turns {metric: [values]} into {metric: {p50, p90, p99, mean, n}}."""
+    summary = {}
+    for metric, values in sorted(samples.items()):
+        values = [v for v in values if v is not None]
+        if not values:
+            continue
+        summary[metric] = {
+            'p50': percentile(values, 0.5),
+            'p90': percentile(values, 0.9),
+            'p99': percentile(values, 0.99),
+            'mean': sum(values) / len(values),
+            'n': len(values),
+        }
+    return summary
+
+
+def print_summary(summary, unit='ms', scale=1e3):
+    print('%-28s %9s %9s %9s %9s %5s' % ('metric', 'p50', 'p90', 'p99', 'mean', 'n'))
+    for metric, stats in sorted(summary.items()):
+        print('%-28s %9.2f %9.2f %9.2f %9.2f %5d' % (
+            metric + ' (%s)' % unit, stats['p50'] * scale, stats['p90'] * scale,
+            stats['p99'] * scale, stats['mean'] * scale, stats['n']))
+
+
+def save(summary, path):
+    with open(path, 'w') as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+
+
+def compare(summary, baseline_path, threshold=0.1, keys=('p50', 'p90')):
+    """Print how summary compares to a saved baseline.
+
+    Returns the list of (metric, key, baseline, value) that got worse by
+    more than threshold (a fraction) and by more than 1 ms.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    regressions = []
+    for metric, stats in sorted(summary.items()):
+        if metric not in baseline:
+            continue
+        for key in keys:
+            old, new = baseline[metric][key], stats[key]
+            change = (new - old) / old if old else 0.0
+            flag = ''
+            if new - old > max(threshold * old, 1e-3):
+                regressions.append((metric, key, old, new))
+                flag = '  REGRESSION'
+            print('%-28s %s %9.2f -> %9.2f ms (%+.0f%%)%s' % (
+                metric, key, old * 1e3, new * 1e3, change * 100, flag))
+    return regressions
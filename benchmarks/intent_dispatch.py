@@ -0,0 +1,163 @@
+"""Benchmark matching recognized text to my_assistant's local commands.
+
+Generates utterances (commands, commands with punctuation and case
+changes, near misses and ordinary Assistant queries) and times, per
+utterance, the compiled IntentDispatcher against a copy of the if/elif
+chain that _process_event used before, which split and compared the text
+once per branch. Also reports how often the two disagree, which is
+expected for near misses and inputs like 'Pause.' that the chain missed.
+
+Usage:
+    python3 -m benchmarks.intent_dispatch [--utterances 5000]
+"""
+
+import argparse
+import random
+import re
+import time
+
+from benchmarks import harness
+
+import intent_dispatcher
+
+COMMANDS = [
+    'continue', 'play', 'pause', 'stop', 'ip address', 'shut down', 'power off',
+    'restart', 'reboot', 'quit', 'speak dutch',
+]
+TEMPLATES = [
+    'play {track}', 'music volume up', 'music volume down a little',
+    'music volume up {n} percent', 'music volume down {n}%', 'volume {n} percent',
+    'set the volume to {n}%',
+]
+NEAR_MISSES = ['paws', 'stopp', 'speak dutsch', 'ip adress', 'continu']
+QUERIES = [
+    'what is the weather like tomorrow', 'how tall is the eiffel tower',
+    'tell me a joke', 'what time is it in new york', 'set a timer for ten minutes',
+    'who wrote the lord of the rings', 'turn on the living room lights',
+]
+TRACKS = ['bohemian rhapsody', 'the sound of silence', 'hey jude', 'clair de lune']
+
+
+def _utterances(count, rng):
+    utterances = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.3:
+            text = rng.choice(COMMANDS)
+        elif kind < 0.6:
+            text = rng.choice(TEMPLATES).format(track=rng.choice(TRACKS), n=rng.randint(1, 100))
+        elif kind < 0.7:
+            text = rng.choice(NEAR_MISSES)
+        else:
+            text = rng.choice(QUERIES)
+        if rng.random() < 0.2:
+            text = text.capitalize() + rng.choice(['.', '!', '?'])
+        utterances.append(text)
+    return utterances
+
+
+def _chain(text):
+    """The if/elif chain from _process_event, returning the command name."""
+    text = text.lower()
+    words = text.split(" ")
+    first = text.split(" ")[0]
+    if text == 'continue' or text == 'play':
+        return 'resume'
+    if text == 'pause':
+        return 'pause'
+    elif first == 'play':
+        return 'play'
+    elif text == 'stop':
+        return 'stop'
+    elif "volume" in text:
+        # volume() then scanned the words for the number
+        for word in words:
+            if re.sub('[^0-9]', '', word):
+                break
+        return 'volume'
+    elif text == 'ip address':
+        return 'ip address'
+    elif text == 'shut down' or text == 'power off':
+        return 'power off'
+    elif text == 'restart' or text == 'reboot':
+        return 'reboot'
+    elif text == 'quit':
+        return 'quit'
+    elif text == 'speak dutch':
+        return 'speak dutch'
+    return None
+
+
+def _dispatcher():
+    commands = intent_dispatcher.IntentDispatcher()
+    commands.exact(['continue', 'play'], 'resume')
+    commands.exact('pause', 'pause')
+    commands.exact('stop', 'stop')
+    commands.prefix('play', 'play')
+    for template in ['music volume <direction:up|down>',
+                     'music volume <direction:up|down> <n:int>',
+                     'music volume <direction:up|down> <n:int> percent',
+                     'music volume <direction:up|down> a <amount:little|lot>',
+                     'music volume <direction:up|down> a <amount:little|lot> bit',
+                     'volume <n:int>', 'volume <n:int> percent',
+                     'volume to <n:int> percent', 'set the volume to <n:int> percent']:
+        commands.pattern(template, 'volume')
+    commands.keyword('volume', 'volume')
+    commands.exact('ip address', 'ip address')
+    commands.exact(['shut down', 'power off'], 'power off', fuzzy=False)
+    commands.exact(['restart', 'reboot'], 'reboot', fuzzy=False)
+    commands.exact('quit', 'quit', fuzzy=False)
+    commands.exact('speak dutch', 'speak dutch')
+    return commands
+
+
+def _time_each(function, utterances, passes):
+    samples = []
+    for _ in range(passes):
+        for text in utterances:
+            start = time.perf_counter()
+            function(text)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--utterances', type=int, default=5000)
+    parser.add_argument('--passes', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write the summary to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier --save')
+    args = parser.parse_args()
+
+    utterances = _utterances(args.utterances, random.Random(args.seed))
+
+    start = time.perf_counter()
+    commands = _dispatcher()
+    commands.compile()
+    compile_s = time.perf_counter() - start
+
+    def dispatch(text):
+        match = commands.match(text)
+        return match.handler if match else None
+
+    summary = harness.summarize({
+        'chain': _time_each(_chain, utterances, args.passes),
+        'dispatcher': _time_each(dispatch, utterances, args.passes),
+        'dispatcher_compile': [compile_s],
+    })
+    harness.print_summary(summary, unit='us', scale=1e6)
+
+    disagree = [text for text in utterances if _chain(text) != dispatch(text)]
+    print('\n%d of %d utterances dispatched differently, eg:' % (len(disagree), len(utterances)))
+    for text in sorted(set(disagree))[:8]:
+        print('  %-32r chain=%-8s dispatcher=%s' % (text, _chain(text), dispatch(text)))
+
+    if args.save:
+        harness.save(summary, args.save)
+    if args.compare:
+        harness.compare(summary, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark the LED animator: wakeups, duty cycle changes and latency.
+
+Runs the real LED driver against the simulated RPi.GPIO. Shows each
+pattern for --seconds and counts the animator's wakeups and PWM duty
+cycle changes per second, then measures the latency from set_state() to
+the PWM change over --changes state changes.
+
+Usage:
+    python3 -m benchmarks.led_animator [--seconds 5] [--changes 50]
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks import harness
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--changes', type=int, default=50)
+    parser.add_argument('--save', help='write the latency summary to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier --save')
+    args = parser.parse_args()
+
+    harness.install_fakes()
+    import aiy._drivers._led
+
+    LED = aiy._drivers._led.LED
+    led = LED(channel=25)
+    led.start()
+    names = sorted((name for name in dir(LED) if name.isupper() and
+                    isinstance(getattr(LED, name), int)), key=lambda n: getattr(LED, n))
+
+    print('%-12s %12s %14s' % ('state', 'wakeups/s', 'duty changes/s'))
+    for name in names:
+        led.set_state(getattr(LED, name))
+        time.sleep(0.1)
+        wakeups = led.metrics['wakeups']
+        changes = led.metrics['duty_changes']
+        time.sleep(args.seconds)
+        print('%-12s %12.1f %14.1f' % (
+            name, (led.metrics['wakeups'] - wakeups) / args.seconds,
+            (led.metrics['duty_changes'] - changes) / args.seconds))
+
+    # Alternate between states whose first duty cycle differs, so each
+    # change shows up in the PWM log.
+    latencies = []
+    for i in range(args.changes):
+        time.sleep(random.uniform(0.05, 0.3))
+        state = LED.ON if i % 2 else LED.OFF
+        requested = time.monotonic()
+        led.set_state(state)
+        while led.pwm.duty_cycle != (100 if state == LED.ON else 0):
+            time.sleep(0.0005)
+        latencies.append(led.pwm.log[-1][0] - requested)
+    led.stop()
+
+    summary = harness.summarize({'state_change_latency': latencies})
+    harness.print_summary(summary)
+    if args.save:
+        harness.save(summary, args.save)
+    if args.compare:
+        harness.compare(summary, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark music control over mpv's JSON IPC against shell commands.
+
+Runs music_controller.MusicController against the fake mpv (see
+benchmarks/fakes/bin/mpv) and times single commands: pause/resume, a
+volume change and a seek. For comparison it times what my_assistant.py did
+before for the same actions: a 'screen -X stuff' shell per keystroke (five
+for a 10 % volume step) and a 'ps aux | grep' shell per state check, with
+a no-op command in place of screen so no session is needed.
+
+Usage:
+    python3 -m benchmarks.music_ipc [--commands 200]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import harness
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _time(fn, count):
+    samples = []
+    for _ in range(count):
+        start = time.monotonic()
+        fn()
+        samples.append(time.monotonic() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--commands', type=int, default=200)
+    parser.add_argument('--save', help='write the summary to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier --save')
+    args = parser.parse_args()
+
+    harness.install_fakes()
+    import music_controller
+
+    socket_path = os.path.join(tempfile.mkdtemp(), 'mpv.sock')
+    music = music_controller.MusicController(socket_path, mpv_args=['mpv'])
+    samples = {}
+    try:
+        start = time.monotonic()
+        music.play('test track')
+        samples['ipc_start_and_play'] = [time.monotonic() - start]
+        paused = [False]
+
+        def _toggle():
+            paused[0] = not paused[0]
+            music.set_pause(paused[0])
+
+        samples['ipc_pause'] = _time(_toggle, args.commands)
+        samples['ipc_volume_step'] = _time(lambda: music.change_volume(1), args.commands)
+        samples['ipc_seek'] = _time(lambda: music.seek(5), args.commands)
+        samples['ipc_state_check'] = _time(lambda: music.playing, args.commands)
+        music.stop()
+        time.sleep(0.05)
+        if music.playing:
+            sys.exit('state was not updated from events')
+    finally:
+        music.close()
+
+    shell_count = max(1, args.commands // 10)
+    samples['shell_keystroke'] = _time(
+        lambda: os.system('true "stuff \\" \\""'), shell_count)
+    samples['shell_volume_step'] = _time(
+        lambda: [os.system('true "stuff 0"') for _ in range(5)], shell_count)
+    samples['shell_state_check'] = _time(
+        lambda: subprocess.call('ps aux | grep -i [m]pv', shell=True,
+                                stdout=subprocess.DEVNULL), shell_count)
+
+    summary = harness.summarize(samples)
+    harness.print_summary(summary)
+    if args.save:
+        harness.save(summary, args.save)
+    if args.compare:
+        harness.compare(summary, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Benchmark cancel-to-silence latency of the playback queue.
+
+Queues a long clip on a PlaybackQueue, cancels it (or pre-empts it with an
+urgent clip) after a random delay, and reports the time from cancel() until
+aplay was stopped, with one aplay per clip and with a persistent player.
+Runs against the fake aplay, which consumes audio in real time.
+
+Usage:
+    python3 -m benchmarks.playback_cancel [--turns 30] [--preempt]
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks import harness
+
+SAMPLE_RATE_HZ = 16000
+
+
+def _run(persistent, turns, preempt, clip_s):
+    import aiy._drivers._playback
+    import aiy._drivers._player
+
+    player = aiy._drivers._player.Player(persistent=persistent)
+    playback = aiy._drivers._playback.PlaybackQueue(player)
+    clip = bytes(int(clip_s * SAMPLE_RATE_HZ) * 2)
+    earcon = bytes(int(0.1 * SAMPLE_RATE_HZ) * 2)
+    try:
+        for _ in range(turns):
+            handle = playback.enqueue_bytes(clip, SAMPLE_RATE_HZ)
+            time.sleep(random.uniform(0.2, clip_s / 2))
+            if preempt:
+                urgent = playback.enqueue_bytes(
+                    earcon, SAMPLE_RATE_HZ,
+                    priority=aiy._drivers._playback.PRIORITY_URGENT)
+                handle.wait()
+                urgent.wait()
+            else:
+                handle.cancel()
+                handle.wait()
+    finally:
+        playback.close()
+        player.close()
+    return list(playback.cancel_latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--turns', type=int, default=30)
+    parser.add_argument('--clip', type=float, default=3.0,
+                        help='seconds of audio in the cancelled clip')
+    parser.add_argument('--preempt', action='store_true',
+                        help='cut clips off with an urgent clip, not cancel()')
+    parser.add_argument('--save', help='write the summary to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier --save')
+    args = parser.parse_args()
+
+    harness.install_fakes()
+    summary = harness.summarize({
+        'cancel_to_silence_per_clip': _run(False, args.turns, args.preempt, args.clip),
+        'cancel_to_silence_persistent': _run(True, args.turns, args.preempt, args.clip),
+    })
+    harness.print_summary(summary)
+    if args.save:
+        harness.save(summary, args.save)
+    if args.compare:
+        harness.compare(summary, args.compare)
+
+
+if __name__ == '__main__':
+    main()
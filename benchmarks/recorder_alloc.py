@@ -0,0 +1,115 @@
+"""Benchmark allocations and CPU of the Recorder chunk assembly loop.
+
+Feeds a synthetic raw audio stream through the legacy `this_chunk += data`
+assembly and through Recorder._capture (ring buffer + readinto), and reports
+CPU time, peak traced memory and garbage collections per second of audio.
+
+CPU time is the best of --repeats runs without tracemalloc, which slows
+down every allocation; peak memory is traced in a separate run.
+
+Usage:
+    python3 -m benchmarks.recorder_alloc [--seconds 600] [--repeats 5]
+"""
+
+import argparse
+import gc
+import io
+import time
+import tracemalloc
+
+import aiy._drivers._recorder
+
+
+class _NullProcessor(object):
+    """Touches every chunk, like a processor would, and drops it."""
+
+    def __init__(self):
+        self.total = 0
+
+    def add_data(self, data):
+        self.total += len(data)
+
+
+class _TrickleStream(io.RawIOBase):
+    """A raw stream that returns short reads, like a pipe from arecord."""
+
+    def __init__(self, total_bytes, read_bytes):
+        super().__init__()
+        self._left = total_bytes
+        self._read_bytes = read_bytes
+        self._silence = memoryview(bytes(read_bytes))
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        count = min(len(buf), self._read_bytes, self._left)
+        buf[:count] = self._silence[:count]
+        self._left -= count
+        return count
+
+
+def _legacy_capture(stream, chunk_bytes, processor):
+    """The chunk assembly loop Recorder.run used before the ring buffer."""
+    this_chunk = b''
+    while True:
+        input_data = stream.read(chunk_bytes)
+        if not input_data:
+            break
+
+        this_chunk += input_data
+        if len(this_chunk) >= chunk_bytes:
+            processor.add_data(this_chunk[:chunk_bytes])
+            this_chunk = this_chunk[chunk_bytes:]
+
+
+def _measure(name, seconds, run, repeats):
+    cpu = None
+    for _ in range(repeats):
+        gc.collect()
+        collections_before = sum(s['collections'] for s in gc.get_stats())
+        cpu_start = time.process_time()
+        run()
+        duration = time.process_time() - cpu_start
+        collections = sum(s['collections'] for s in gc.get_stats()) - collections_before
+        cpu = duration if cpu is None else min(cpu, duration)
+
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-8s cpu/s audio: %8.1f us  peak traced: %8d B  gc runs: %d' % (
+        name, cpu / seconds * 1e6, peak, collections))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=600,
+                        help='seconds of 16 kHz mono 16-bit audio to capture')
+    parser.add_argument('--read-bytes', type=int, default=4096,
+                        help='bytes returned by each pipe read')
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='CPU timing runs, the fastest is reported')
+    args = parser.parse_args()
+
+    recorder = aiy._drivers._recorder.Recorder()
+    chunk_bytes = recorder._chunk_bytes  # pylint: disable=protected-access
+    total = int(args.seconds * 16000) * 2
+
+    def legacy():
+        stream = io.BufferedReader(_TrickleStream(total, args.read_bytes))
+        _legacy_capture(stream, chunk_bytes, _NullProcessor())
+
+    def ring():
+        processor = _NullProcessor()
+        recorder.add_processor(processor)
+        recorder._capture(_TrickleStream(total, args.read_bytes))  # pylint: disable=protected-access
+        recorder.remove_processor(processor)
+
+    _measure('legacy', args.seconds, legacy, args.repeats)
+    _measure('ring', args.seconds, ring, args.repeats)
+
+
+if __name__ == '__main__':
+    main()
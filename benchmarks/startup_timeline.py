@@ -0,0 +1,70 @@
+"""Summarize and compare the startup timelines my_assistant records.
+
+my_assistant.py appends one JSON line per startup to
+~/.cache/voice-recognizer/startup_timeline.jsonl (see startup_timeline.py).
+This prints p50/p90 over the recorded startups of each phase's duration,
+and of the time since process start of each mark ('imported', 'ready').
+Save the summary for one release and compare the next one against it.
+
+Metrics:
+  <phase>          duration of the phase
+  <phase>_end      phase end, since process start
+  <mark>_at        mark, since process start
+
+Usage:
+    python3 -m benchmarks.startup_timeline [log.jsonl] [--mode fast]
+        [--last 20] [--save release.json] [--compare previous.json]
+"""
+
+import argparse
+import json
+import os
+
+from benchmarks import harness
+
+DEFAULT_LOG = os.path.expanduser('~/.cache/voice-recognizer/startup_timeline.jsonl')
+
+
+def _load(path, mode, last):
+    with open(path) as f:
+        timelines = [json.loads(line) for line in f if line.strip()]
+    if mode:
+        timelines = [timeline for timeline in timelines if timeline.get('mode') == mode]
+    return timelines[-last:] if last else timelines
+
+
+def _samples(timelines):
+    samples = {}
+    for timeline in timelines:
+        for name, (start, end) in timeline['phases'].items():
+            samples.setdefault(name, []).append(end - start)
+            samples.setdefault(name + '_end', []).append(end)
+        for name, at in timeline['marks'].items():
+            samples.setdefault(name + '_at', []).append(at)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('log', nargs='?', default=DEFAULT_LOG)
+    parser.add_argument('--mode', choices=('fast', 'serial'),
+                        help='only startups in this mode')
+    parser.add_argument('--last', type=int, help='only the last LAST startups')
+    parser.add_argument('--save', help='write the summary to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier --save')
+    args = parser.parse_args()
+
+    timelines = _load(args.log, args.mode, args.last)
+    if not timelines:
+        parser.error('no startups recorded in %s' % args.log)
+    print('%d startups from %s' % (len(timelines), args.log))
+    summary = harness.summarize(_samples(timelines))
+    harness.print_summary(summary)
+    if args.save:
+        harness.save(summary, args.save)
+    if args.compare:
+        harness.compare(summary, args.compare)
+
+
+if __name__ == '__main__':
+    main()
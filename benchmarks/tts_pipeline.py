@@ -0,0 +1,73 @@
+"""Benchmark time to first audio of whole-text and sentence-pipelined TTS.
+
+Says texts of a few lengths with _tts.say(pipelined=False), which
+synthesizes the whole text in one engine run, and with pipelined=True,
+which plays each sentence while the next one is synthesized. Runs against
+the fake pico2wave and aplay (see benchmarks/fakes/bin), with the TTS
+cache disabled so every run synthesizes. The fake writes its audio only
+once it is done, so say() playing the engine's output as it arrives
+doesn't shorten first_audio here, as it does with a streaming engine.
+
+Metrics per text length and mode:
+  first_audio  say() called -> first byte reaches aplay
+  wall         say() called -> say() returns
+  overhead     wall minus the duration of the audio
+
+Usage:
+    python3 -m benchmarks.tts_pipeline [--runs 2]
+"""
+
+import argparse
+import time
+
+from benchmarks import harness
+
+_SENTENCE = 'The quick brown fox jumps over the lazy dog near the river bank. '
+TEXTS = {
+    '1_sentence': _SENTENCE,
+    '3_sentences': _SENTENCE * 3,
+    '8_sentences': _SENTENCE * 8,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=2)
+    parser.add_argument('--save', help='write the summary to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier --save')
+    args = parser.parse_args()
+
+    aplay_log = harness.install_fakes()
+
+    import aiy._drivers._player
+    import aiy._drivers._tts
+
+    aiy._drivers._tts._cache = aiy._drivers._tts._TtsCache(  # pylint: disable=protected-access
+        memory_bytes=0, disk_bytes=0)
+    player = aiy._drivers._player.Player()
+
+    samples = {}
+    for name, text in sorted(TEXTS.items()):
+        for pipelined in (False, True):
+            mode = 'pipelined' if pipelined else 'whole'
+            for _ in range(args.runs):
+                start = time.monotonic()
+                aiy._drivers._tts.say(player, text, pipelined=pipelined)
+                wall = time.monotonic() - start
+                runs = harness.read_aplay_log(aplay_log, since=start)
+                audio_s = sum(run['bytes'] / (run['rate'] * run['width']) for run in runs)
+                first = min(run['first_byte'] for run in runs if run['first_byte'])
+                for metric, value in (('first_audio', first - start), ('wall', wall),
+                                      ('overhead', wall - audio_s)):
+                    samples.setdefault('%s_%s_%s' % (name, mode, metric), []).append(value)
+
+    summary = harness.summarize(samples)
+    harness.print_summary(summary)
+    if args.save:
+        harness.save(summary, args.save)
+    if args.compare:
+        harness.compare(summary, args.compare)
+
+
+if __name__ == '__main__':
+    main()
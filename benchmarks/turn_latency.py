@@ -0,0 +1,217 @@
+"""End-to-end turn latency benchmark.
+
+Runs the real Recorder, Player, _StatusUi, Button and the aiy.cloudspeech or
+aiy.assistant.grpc recognizer against stand-ins: a WAV-backed arecord, a
+timing aplay, a simulated RPi.GPIO and the local fake speech server. Each
+turn presses the button, "speaks" the WAV and waits for the answer.
+
+Metrics per turn:
+  press_to_listening         button edge -> request attached to the recorder,
+                             after the 0.1 s earcon has played
+  press_to_led               button edge -> LED switched to 'listening'
+  speech_end_to_transcript   end of the spoken WAV -> final transcript
+  transcript_to_first_audio  transcript -> first answer byte in aplay
+                             (assistant only)
+  cpu_per_turn               CPU time of this process during the turn
+  cpu_children_per_turn      CPU time of aplay processes that exited
+
+Usage:
+    python3 -m benchmarks.turn_latency [--api assistant] [--turns 20]
+        [--wav speech.wav] [--save results.json] [--compare baseline.json]
+
+The exit status is 1 if --compare finds a regression above --threshold.
+"""
+
+import argparse
+import math
+import os
+import resource
+import signal
+import struct
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+from benchmarks import harness
+
+BUTTON_CHANNEL = 23
+LED_CHANNEL = 25
+SAMPLE_RATE_HZ = 16000
+
+
+def _write_tone(path, seconds, frequency, volume=0.3):
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE_HZ)
+        wav.writeframes(b''.join(
+            struct.pack('<h', int(volume * 32767 * math.sin(
+                2 * math.pi * frequency * i / SAMPLE_RATE_HZ)))
+            for i in range(int(seconds * SAMPLE_RATE_HZ))))
+
+
+def _wav_seconds(path):
+    with wave.open(path, 'rb') as wav:
+        return wav.getnframes() / wav.getframerate()
+
+
+def _cpu(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _first_after(log, when, value):
+    """Time of the first entry in a PWM log at or after when with value."""
+    for timestamp, duty_cycle in log:
+        if timestamp >= when and duty_cycle == value:
+            return timestamp
+    return None
+
+
+def main():  # pylint: disable=too-many-locals,too-many-statements
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--api', choices=['cloudspeech', 'assistant'],
+                        default='cloudspeech')
+    parser.add_argument('--turns', type=int, default=20)
+    parser.add_argument('--wav', help='16 kHz mono 16-bit speech to "say" each turn')
+    parser.add_argument('--server-endpointer', type=float, default=0.3,
+                        help='seconds after the speech before the server endpoints')
+    parser.add_argument('--server-latency', type=float, default=0.0,
+                        help='server delay before its first response')
+    parser.add_argument('--response-audio', type=float, default=1.0,
+                        help='seconds of Assistant answer audio')
+    parser.add_argument('--preroll', type=float, default=0,
+                        help='recognizer pre-roll in seconds')
+    parser.add_argument('--local-endpointer', type=float, default=None,
+                        help='use the local VAD with this trailing silence')
+    parser.add_argument('--idle', type=float, default=0.5,
+                        help='seconds between turns')
+    parser.add_argument('--save', help='write the summary to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier --save')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown that counts as a regression')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='turn-latency-')
+    speech_wav = args.wav
+    if not speech_wav:
+        speech_wav = os.path.join(workdir, 'speech.wav')
+        _write_tone(speech_wav, 1.5, 180)
+    earcon_wav = os.path.join(workdir, 'earcon.wav')
+    _write_tone(earcon_wav, 0.1, 880)
+    speech_s = _wav_seconds(speech_wav)
+
+    aplay_log = harness.install_fakes(arecord_wav=speech_wav)
+
+    # Imported only now, so they pick up the simulated RPi.GPIO.
+    import RPi.GPIO as GPIO
+    import aiy._apis._fake_server
+    import aiy._apis._speech
+    import aiy.assistant.grpc
+    import aiy.audio
+    import aiy.cloudspeech
+    import aiy.voicehat
+
+    server = aiy._apis._fake_server.FakeSpeechServer([aiy._apis._fake_server.Script(
+        transcript='what is the weather like',
+        endpoint_after_s=speech_s + args.server_endpointer,
+        first_response_delay_s=args.server_latency,
+        response_audio_s=args.response_audio,
+        response_bytes_per_s=SAMPLE_RATE_HZ * 2)])
+    server.start()
+    aiy._apis._speech.set_api_override(server.target)
+
+    if args.api == 'assistant':
+        recognizer = aiy.assistant.grpc._AssistantRecognizer(None)  # pylint: disable=protected-access
+    else:
+        recognizer = aiy.cloudspeech._CloudSpeechRecognizer(None)  # pylint: disable=protected-access
+    recognizer.set_preroll(args.preroll)
+    if args.local_endpointer is not None:
+        recognizer.enable_local_endpointer(args.local_endpointer)
+    request = recognizer._request  # pylint: disable=protected-access
+
+    button = aiy.voicehat.get_button()
+    status_ui = aiy.voicehat.get_status_ui()
+    status_ui.set_trigger_sound_wave(earcon_wav)
+    led_pwm = [pwm for pwm in GPIO.PWM.instances if pwm.channel == LED_CHANNEL][0]
+
+    recorder = aiy.audio.get_recorder()
+    attached = []
+    add_processor = recorder.add_processor
+
+    def _timed_add_processor(processor, *a, **kw):
+        add_processor(processor, *a, **kw)
+        if processor is request:
+            attached.append(time.monotonic())
+
+    recorder.add_processor = _timed_add_processor
+    recorder.start()
+    while not recorder._arecord:  # pylint: disable=protected-access
+        time.sleep(0.01)
+    arecord_pid = recorder._arecord.pid  # pylint: disable=protected-access
+
+    samples = {name: [] for name in (
+        'press_to_listening', 'press_to_led', 'speech_end_to_transcript',
+        'transcript_to_first_audio', 'cpu_per_turn', 'cpu_children_per_turn')}
+    try:
+        for turn in range(args.turns):
+            status_ui.status('ready')
+            time.sleep(args.idle)
+
+            def _press():
+                GPIO.simulate_press(BUTTON_CHANNEL)
+                os.kill(arecord_pid, signal.SIGUSR1)
+
+            cpu_start = _cpu(resource.RUSAGE_SELF)
+            children_start = _cpu(resource.RUSAGE_CHILDREN)
+            edge_count = len(GPIO.edges)
+            # Press once wait_for_press() is waiting, like a user would.
+            threading.Timer(0.05, _press).start()
+
+            button.wait_for_press()
+            press = GPIO.edges[edge_count][2]
+            status_ui.status('listening')
+            if args.api == 'assistant':
+                transcript, _ = recognizer.recognize(stream_audio=True)
+            else:
+                transcript = recognizer.recognize()
+            status_ui.status('thinking')
+
+            samples['cpu_per_turn'].append(_cpu(resource.RUSAGE_SELF) - cpu_start)
+            samples['cpu_children_per_turn'].append(
+                _cpu(resource.RUSAGE_CHILDREN) - children_start)
+            samples['press_to_listening'].append(attached[-1] - press)
+            led_on = _first_after(led_pwm.log, press, 100)
+            samples['press_to_led'].append(led_on - press if led_on else None)
+
+            transcript_at = None
+            if 'transcript' in request.timings:
+                transcript_at = request.start_time + request.timings['transcript']
+                samples['speech_end_to_transcript'].append(
+                    transcript_at - (press + speech_s))
+            if args.api == 'assistant' and transcript_at:
+                first_bytes = [run['first_byte'] for run in harness.read_aplay_log(
+                    aplay_log, since=press) if run['first_byte'] and
+                               run['first_byte'] >= transcript_at]
+                if first_bytes:
+                    samples['transcript_to_first_audio'].append(
+                        min(first_bytes) - transcript_at)
+            print('turn %d: %r' % (turn + 1, transcript), file=sys.stderr)
+    finally:
+        recorder.stop()
+        server.stop()
+
+    summary = harness.summarize(samples)
+    harness.print_summary(summary)
+    if args.save:
+        harness.save(summary, args.save)
+    if args.compare and harness.compare(summary, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
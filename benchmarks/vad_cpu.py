@@ -0,0 +1,100 @@
+"""Benchmark the CPU cost of the local voice activity detector.
+
+Runs VoiceActivityDetector over synthetic 16 kHz audio (noise with voiced
+bursts) in Recorder-sized chunks, pinned to one core where the platform
+allows it, and reports CPU time per second of audio.
+
+It also checks that a long continuous utterance isn't cut off: the noise
+floor must not rise with the speech, so the utterance should end about
+trailing_silence_s after the speech does.
+
+Usage:
+    python3 -m benchmarks.vad_cpu [--seconds 300]
+"""
+
+import argparse
+import os
+import time
+
+import numpy
+
+import aiy._drivers._recorder
+import aiy._drivers._vad
+
+SAMPLE_RATE_HZ = 16000
+
+
+def _synthetic_audio(seconds):
+    """Background noise with 1 s voiced bursts every 3 s."""
+    rng = numpy.random.RandomState(0)
+    t = numpy.arange(int(seconds * SAMPLE_RATE_HZ)) / SAMPLE_RATE_HZ
+    audio = rng.normal(0, 100, len(t))
+    voiced = (t % 3) < 1
+    audio += voiced * 4000 * numpy.sin(2 * numpy.pi * 180 * t)
+    return numpy.clip(audio, -32768, 32767).astype('<i2').tobytes()
+
+
+def _long_utterance(speech_s, lead_s=0.5, tail_s=2.0):
+    """Background noise with speech_s of continuous, syllable-modulated voice.
+
+    The voice is about 25 dB above the noise.
+    """
+    rng = numpy.random.RandomState(1)
+    t = numpy.arange(int((lead_s + speech_s + tail_s) * SAMPLE_RATE_HZ)) / SAMPLE_RATE_HZ
+    audio = rng.normal(0, 100, len(t))
+    voiced = (t >= lead_s) & (t < lead_s + speech_s)
+    envelope = 0.7 + 0.3 * numpy.sin(2 * numpy.pi * 4 * t)
+    audio += voiced * 2500 * envelope * numpy.sin(2 * numpy.pi * 180 * t)
+    return numpy.clip(audio, -32768, 32767).astype('<i2').tobytes()
+
+
+def _end_of_speech_s(audio, chunk_bytes):
+    """Return the audio time at which the detector ended the utterance."""
+    vad = aiy._drivers._vad.VoiceActivityDetector()
+    for start in range(0, len(audio), chunk_bytes):
+        vad.add_data(audio[start:start + chunk_bytes])
+        if vad.ended:
+            return (start + chunk_bytes) / 2 / SAMPLE_RATE_HZ
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=300,
+                        help='seconds of audio to process')
+    parser.add_argument('--utterance', type=float, default=12,
+                        help='seconds of the long continuous utterance')
+    args = parser.parse_args()
+
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+
+    audio = memoryview(_synthetic_audio(args.seconds))
+    chunk_bytes = int(aiy._drivers._recorder.Recorder.CHUNK_S * SAMPLE_RATE_HZ) * 2
+    ends = []
+    vad = aiy._drivers._vad.VoiceActivityDetector(
+        callback=lambda: ends.append(True))
+
+    cpu_start = time.process_time()
+    for start in range(0, len(audio), chunk_bytes):
+        vad.add_data(audio[start:start + chunk_bytes])
+        if vad.ended:
+            vad.reset()
+    cpu = time.process_time() - cpu_start
+
+    print('cpu per audio second: %.1f us (%.3f%% of one core)' % (
+        cpu / args.seconds * 1e6, cpu / args.seconds * 100))
+    print('utterances ended locally: %d' % len(ends))
+
+    ended = _end_of_speech_s(_long_utterance(args.utterance), chunk_bytes)
+    speech_end = 0.5 + args.utterance
+    if ended is None:
+        print('%.0f s utterance: never ended locally' % args.utterance)
+    else:
+        print('%.0f s utterance: ended at %.1f s, %.1f s after the speech%s' % (
+            args.utterance, ended, ended - speech_end,
+            ' (CUT OFF)' if ended < speech_end else ''))
+
+
+if __name__ == '__main__':
+    main()
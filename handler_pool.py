@@ -0,0 +1,279 @@
+"""Run command handlers on a bounded pool of worker threads.
+
+The Assistant library delivers events on one thread, so a handler that
+runs a subprocess or waits for speech there holds up every event after it.
+A HandlerPool runs handlers on a few worker threads instead:
+
+- Handlers in the same group run one at a time, in submission order, so
+  eg music commands can't overtake each other. Ungrouped handlers run
+  as soon as a worker is free.
+- At most max_pending handlers wait for a worker; more are rejected with
+  PoolBusy rather than piling up.
+- A task can be cancelled. If it hasn't started it never runs; if it has,
+  its cancelled event is set and call() and check_output() kill their
+  subprocess. A timeout cancels the task the same way.
+
+Python threads can't be stopped from outside, so a handler that ignores
+cancellation keeps its worker (and its group) until it returns.
+
+Usage:
+    pool = HandlerPool()
+    pool.submit(music.play, 'hey jude', group='music')
+    pool.submit(handler_pool.call, ['amixer', 'set', 'Master', '50%'], timeout=5)
+"""
+
+import collections
+import logging
+import queue
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger('handlers')
+
+# Number of queue wait and run times kept in the metrics.
+HISTORY = 100
+
+_local = threading.local()
+
+
+class PoolBusy(Exception):
+    """Too many handlers are waiting for a worker."""
+
+
+class Task(object):
+    """A handler submitted to a HandlerPool.
+
+    cancelled is a threading.Event that is set when the task is cancelled
+    or times out; long-running handlers can check or wait on it.
+    submitted_at, started_at and finished_at are time.monotonic() values,
+    or None until they happen.
+    """
+
+    def __init__(self, handler, args, name, group, timeout):
+        self.handler = handler
+        self.args = args
+        self.name = name
+        self.group = group
+        self.timeout = timeout
+        self.cancelled = threading.Event()
+        self.timed_out = False
+        self.result = None
+        self.error = None
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+
+    def cancel(self):
+        """Stop the task from running, or ask it to stop if it runs."""
+        self.cancelled.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait until the task finished or was dropped; return done()."""
+        return self._done.wait(timeout)
+
+
+def current_task():
+    """Return the Task running on this thread, or None."""
+    return getattr(_local, 'task', None)
+
+
+def call(args, poll_s=0.05, **kwargs):
+    """Like subprocess.call(), but kills the command if the task is cancelled.
+
+    Outside a pool task this is subprocess.call().
+    """
+    process = subprocess.Popen(args, **kwargs)
+    _communicate(process, poll_s)
+    return process.returncode
+
+
+def check_output(args, poll_s=0.05, **kwargs):
+    """Like subprocess.check_output(), killing the command on cancellation."""
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, **kwargs)
+    output = _communicate(process, poll_s)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, args, output)
+    return output
+
+
+def _communicate(process, poll_s):
+    task = current_task()
+    while True:
+        try:
+            return process.communicate(timeout=poll_s)[0]
+        except subprocess.TimeoutExpired:
+            if task and task.cancelled.is_set():
+                logger.info('killing %s of cancelled %s', process.args, task.name)
+                process.kill()
+
+
+class HandlerPool(object):
+    """A fixed number of worker threads with serialization groups.
+
+    metrics holds counts of what happened to submitted tasks, and deques of
+    the most recent queue wait (submitted -> started) and run times. They
+    are updated from several threads, under the pool's lock.
+    """
+
+    def __init__(self, workers=3, max_pending=16, default_timeout=30):
+        self._max_pending = max_pending
+        self._default_timeout = default_timeout
+        self._lock = threading.Lock()
+        self._runnable = queue.Queue()
+        self._groups = {}  # group -> deque of tasks waiting for the running one
+        self._pending = 0
+        self._tasks = set()
+        self.metrics = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'cancelled': 0,
+            'timeouts': 0,
+            'rejected': 0,
+            'queue_wait_s': collections.deque(maxlen=HISTORY),
+            'run_s': collections.deque(maxlen=HISTORY),
+        }
+        self._workers = [threading.Thread(target=self._work, name='handler-%d' % i, daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, handler, *args, group=None, timeout=None, name=None):
+        """Run handler(*args) on a worker and return its Task.
+
+        Args:
+          group: tasks with the same group run one at a time, in order
+          timeout: seconds after which the running task is cancelled, or
+              the pool's default_timeout if None; 0 for no timeout
+          name: for log messages, defaults to the handler's name
+
+        Raises:
+          PoolBusy: if max_pending tasks are already waiting.
+        """
+        if timeout is None:
+            timeout = self._default_timeout
+        task = Task(handler, args, name or getattr(handler, '__name__', repr(handler)),
+                    group, timeout)
+        with self._lock:
+            if self._pending >= self._max_pending:
+                self.metrics['rejected'] += 1
+                raise PoolBusy('%d handlers waiting, rejecting %s' % (self._pending, task.name))
+            self._pending += 1
+            self._tasks.add(task)
+            self.metrics['submitted'] += 1
+            if group is None:
+                runnable = True
+            elif group in self._groups:
+                self._groups[group].append(task)
+                runnable = False
+            else:
+                self._groups[group] = collections.deque()
+                runnable = True
+        if runnable:
+            self._runnable.put(task)
+        return task
+
+    def cancel_group(self, group):
+        """Cancel the running and waiting tasks of a group.
+
+        Tasks waiting behind the group's running one are dropped at once,
+        so they no longer count against max_pending.
+        """
+        with self._lock:
+            tasks = [task for task in self._tasks if task.group == group]
+            dropped = list(self._groups.get(group, ()))
+            if dropped:
+                self._groups[group].clear()
+                self._pending -= len(dropped)
+                self._tasks.difference_update(dropped)
+                self.metrics['cancelled'] += len(dropped)
+        for task in tasks:
+            task.cancel()
+        for task in dropped:
+            task._done.set()  # pylint: disable=protected-access
+
+    def cancel_all(self):
+        with self._lock:
+            tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+
+    def close(self, timeout=None):
+        """Cancel all tasks and stop the workers."""
+        self.cancel_all()
+        for _ in self._workers:
+            self._runnable.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _work(self):
+        while True:
+            task = self._runnable.get()
+            if task is None:
+                return
+            with self._lock:
+                self._pending -= 1
+            self._run(task)
+            self._release(task)
+
+    def _run(self, task):
+        if task.cancelled.is_set():
+            with self._lock:
+                self.metrics['cancelled'] += 1
+            return
+
+        task.started_at = time.monotonic()
+        with self._lock:
+            self.metrics['queue_wait_s'].append(task.started_at - task.submitted_at)
+        timer = None
+        if task.timeout:
+            timer = threading.Timer(task.timeout, self._time_out, (task,))
+            timer.daemon = True
+            timer.start()
+        _local.task = task
+        try:
+            task.result = task.handler(*task.args)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception('%s failed', task.name)
+            task.error = e
+        finally:
+            _local.task = None
+            if timer:
+                timer.cancel()
+            task.finished_at = time.monotonic()
+
+        with self._lock:
+            self.metrics['run_s'].append(task.finished_at - task.started_at)
+            if task.error:
+                self.metrics['failed'] += 1
+            elif task.cancelled.is_set():
+                self.metrics['cancelled'] += 1
+            else:
+                self.metrics['completed'] += 1
+
+    def _time_out(self, task):
+        logger.warning('%s did not finish in %.1f s, cancelling it', task.name, task.timeout)
+        task.timed_out = True
+        with self._lock:
+            self.metrics['timeouts'] += 1
+        task.cancel()
+
+    def _release(self, task):
+        """Mark task done and start the next task of its group."""
+        following = None
+        with self._lock:
+            self._tasks.discard(task)
+            if task.group is not None:
+                waiting = self._groups[task.group]
+                if waiting:
+                    following = waiting.popleft()
+                else:
+                    del self._groups[task.group]
+        task._done.set()  # pylint: disable=protected-access
+        if following:
+            self._runnable.put(following)
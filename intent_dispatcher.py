@@ -0,0 +1,178 @@
+"""Match recognized text to command handlers in one pass.
+
+Commands are registered as exact phrases, word prefixes, slot patterns or
+keywords, and compiled once into a phrase dict, a word trie and a single
+alternation regex. match() then normalizes the text once and tries, in
+order: exact phrases, patterns, the longest prefix, keywords, and finally
+a fuzzy match against the exact phrases that allow it.
+
+Usage:
+    dispatcher = IntentDispatcher()
+    dispatcher.exact(['stop', 'stop the music'], lambda match: stop())
+    dispatcher.prefix('play', lambda match: play(match.slots['rest']))
+    dispatcher.pattern('volume up <n:int> percent',
+                       lambda match: volume(match.slots['n']))
+    dispatcher.dispatch('Volume up 10%')   # calls volume(10)
+"""
+
+import collections
+import difflib
+import re
+
+# What matched: the handler, the kind of rule, the rule itself (phrase,
+# prefix, template or keyword), the extracted slots and the normalized words.
+Match = collections.namedtuple('Match', ['handler', 'kind', 'rule', 'slots', 'words'])
+
+_SLOT = re.compile(r'<(\w+)(?::([^>]+))?>')
+_PUNCTUATION = re.compile(r"[^\w\s%']")
+
+
+def normalize(text):
+    """Lower-case text, drop punctuation and spell out '%'."""
+    text = _PUNCTUATION.sub(' ', text.lower()).replace('%', ' percent ')
+    return ' '.join(text.split())
+
+
+class IntentDispatcher(object):
+    """A command table, compiled on first use or by compile()."""
+
+    FUZZY_CUTOFF = 0.85
+    # Shorter phrases are only matched exactly: one edit in 'stop' or
+    # 'play' already makes another word ('top', 'plays').
+    FUZZY_MIN_LENGTH = 6
+
+    def __init__(self, fuzzy_cutoff=FUZZY_CUTOFF):
+        self._fuzzy_cutoff = fuzzy_cutoff
+        self._exact = {}
+        self._fuzzy_phrases = []
+        self._trie = {}
+        self._patterns = []
+        self._keywords = {}
+        self._regex = None
+        self._converters = {}
+        self._compiled = False
+
+    def exact(self, phrases, handler, fuzzy=True):
+        """Match any of the phrases exactly.
+
+        With fuzzy, near misses like 'continu' for 'continue' match too;
+        turn it off for commands that must not fire by accident. Phrases
+        shorter than FUZZY_MIN_LENGTH characters never match fuzzily.
+        """
+        if isinstance(phrases, str):
+            phrases = [phrases]
+        for phrase in phrases:
+            phrase = normalize(phrase)
+            self._exact[phrase] = handler
+            if fuzzy and len(phrase) >= self.FUZZY_MIN_LENGTH:
+                self._fuzzy_phrases.append(phrase)
+        self._compiled = False
+
+    def prefix(self, prefix, handler):
+        """Match text starting with the words of prefix.
+
+        The remaining text is the 'rest' slot. The longest prefix wins.
+        """
+        node = self._trie
+        for word in normalize(prefix).split():
+            node = node.setdefault(word, {})
+        node[None] = (prefix, handler)
+        self._compiled = False
+
+    def pattern(self, template, handler):
+        """Match text against a template with <slots>.
+
+        A slot is <name> for any words, <name:int> for a number, or
+        <name:a|b|c> for one of the given words. Eg
+        'volume <direction:up|down> <n:int> percent'.
+        """
+        self._patterns.append((template, handler))
+        self._compiled = False
+
+    def keyword(self, word, handler):
+        """Match text containing the word, if nothing more specific does."""
+        self._keywords[normalize(word)] = (word, handler)
+        self._compiled = False
+
+    def compile(self):
+        """Build the pattern regex; called by match() after any change."""
+        alternatives = []
+        self._converters = {}
+        for index, (template, _) in enumerate(self._patterns):
+            parts = []
+            position = 0
+            for slot in _SLOT.finditer(template):
+                parts.append(re.escape(normalize(template[position:slot.start()])))
+                name, kind = slot.groups()
+                group = '_%d_%s' % (index, name)
+                if kind == 'int':
+                    parts.append(r'(?P<%s>\d+)' % group)
+                    self._converters[group] = int
+                elif kind:
+                    words = '|'.join(re.escape(normalize(w)) for w in kind.split('|'))
+                    parts.append(r'(?P<%s>%s)' % (group, words))
+                else:
+                    parts.append(r'(?P<%s>.+?)' % group)
+                position = slot.end()
+            parts.append(re.escape(normalize(template[position:])))
+            body = r'\s*'.join(part for part in parts if part)
+            alternatives.append(r'(?P<_%d>%s)' % (index, body))
+        self._regex = re.compile(r'\A(?:%s)\Z' % '|'.join(alternatives)) if alternatives else None
+        self._compiled = True
+
+    def match(self, text):
+        """Return the Match for text, or None."""
+        if not self._compiled:
+            self.compile()
+        text = normalize(text)
+        words = text.split()
+
+        handler = self._exact.get(text)
+        if handler:
+            return Match(handler, 'exact', text, {}, words)
+
+        if self._regex:
+            found = self._regex.match(text)
+            if found:
+                index = int(found.lastgroup[1:])
+                prefix = '_%d_' % index
+                slots = {}
+                for group, value in found.groupdict().items():
+                    if value is not None and group.startswith(prefix):
+                        slots[group[len(prefix):]] = self._converters.get(group, str)(value)
+                template, handler = self._patterns[index]
+                return Match(handler, 'pattern', template, slots, words)
+
+        node, best, depth = self._trie, None, 0
+        for i, word in enumerate(words):
+            node = node.get(word)
+            if node is None:
+                break
+            if None in node:
+                best, depth = node[None], i + 1
+        if best:
+            return Match(best[1], 'prefix', best[0], {'rest': ' '.join(words[depth:])}, words)
+
+        for word in words:
+            entry = self._keywords.get(word)
+            if entry:
+                return Match(entry[1], 'keyword', entry[0], {}, words)
+
+        # difflib's ratio is at most 2 * shorter / (shorter + longer), so a
+        # ratio of cutoff needs shorter / longer >= cutoff / (2 - cutoff);
+        # most queries are ruled out without running difflib.
+        bound = self._fuzzy_cutoff / (2 - self._fuzzy_cutoff)
+        low, high = len(text) * bound, len(text) / bound
+        candidates = [phrase for phrase in self._fuzzy_phrases if low <= len(phrase) <= high]
+        if candidates:
+            close = difflib.get_close_matches(text, candidates, 1, self._fuzzy_cutoff)
+            if close:
+                return Match(self._exact[close[0]], 'fuzzy', close[0], {}, words)
+        return None
+
+    def dispatch(self, text):
+        """Call handler(match) for the text's Match; return the Match or None."""
+        match = self.match(text)
+        if match:
+            match.handler(match)
+        return match
@@ -0,0 +1,279 @@
+"""Control a persistent mpv music player over its JSON IPC socket.
+
+One mpv process is started on first use and kept running idle between
+tracks. Commands go over a Unix socket (mpv --input-ipc-server), so pause,
+volume and seek are a single round trip instead of a shell per keystroke.
+The player state (playing, paused, volume) is kept up to date from the
+property-change events mpv pushes, so reading it costs nothing.
+
+Usage:
+    music = MusicController()
+    music.play('bohemian rhapsody')   # plays the first YouTube result
+    music.change_volume(-10)
+    music.set_pause(True)
+
+mpv plays YouTube through youtube-dl, see
+https://mpv.io/manual/stable/#json-ipc for the protocol.
+"""
+
+import itertools
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger('music')
+
+# Path to a tmpfs directory; at boot it may not exist yet, then the socket
+# goes in a private directory made in the temporary directory instead.
+TMP_DIR = '/run/user/%d' % os.getuid()
+SOCKET_NAME = 'aiy-mpv-%d.sock' % os.getuid()
+MPV_ARGS = ['mpv', '--idle=yes', '--no-video', '--no-terminal', '--ytdl-format=bestaudio']
+
+# Properties mirrored from mpv events, with their values while mpv is idle.
+_OBSERVED = {'pause': False, 'idle-active': True, 'volume': None, 'media-title': None}
+
+
+class MusicError(Exception):
+    """An mpv command failed, or mpv could not be reached."""
+
+
+class MusicController(object):
+    """A client for one mpv process, started when first needed.
+
+    Commands may be sent from any thread. Each waits at most timeout
+    seconds for mpv's reply. metrics holds the number of commands and the
+    latency of the last and slowest one.
+    """
+
+    START_TIMEOUT_S = 5
+
+    def __init__(self, socket_path=None, mpv_args=MPV_ARGS, timeout=2):
+        self._socket_path = socket_path
+        self._mpv_args = list(mpv_args)
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        # Held while connecting, which may include starting mpv, so that only
+        # one mpv is started without holding _lock all that time.
+        self._connect_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._socket_dir = None  # made by _connect(), removed by close()
+        self._request_ids = itertools.count(1)
+        self._pending = {}
+        self._socket = None
+        self._process = None
+        self._state = dict(_OBSERVED)
+        self.metrics = {
+            'commands': 0,
+            'last_command_s': None,
+            'max_command_s': None,
+        }
+
+    @property
+    def playing(self):
+        """True if a track is loaded, paused or not."""
+        return self._socket is not None and not self._state['idle-active']
+
+    @property
+    def paused(self):
+        return self.playing and bool(self._state['pause'])
+
+    @property
+    def volume(self):
+        """mpv's volume in percent, or None if unknown."""
+        return self._state['volume']
+
+    @property
+    def title(self):
+        return self._state['media-title'] if self.playing else None
+
+    def play(self, query):
+        """Replace whatever plays with the first YouTube result for query."""
+        self.command('loadfile', 'ytdl://ytsearch1:%s' % query, 'replace')
+        self.command('set_property', 'pause', False)
+
+    def set_pause(self, paused):
+        """Pause or resume playback; does nothing if nothing is playing."""
+        if self.playing:
+            self.command('set_property', 'pause', bool(paused))
+
+    def change_volume(self, delta):
+        """Change the volume by delta percent points, in one command."""
+        self.command('add', 'volume', delta)
+
+    def set_volume(self, volume):
+        self.command('set_property', 'volume', volume)
+
+    def seek(self, seconds, absolute=False):
+        """Seek by seconds, or to seconds from the start if absolute."""
+        if self.playing:
+            self.command('seek', seconds, 'absolute' if absolute else 'relative')
+
+    def stop(self):
+        """Stop playback, leaving mpv running idle for the next track."""
+        if self._socket is not None:
+            self.command('stop')
+
+    def close(self):
+        """Disconnect and stop the mpv process, if this started it."""
+        with self._lock:
+            sock, self._socket = self._socket, None
+            process, self._process = self._process, None
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        if process:
+            process.terminate()
+            process.wait()
+        with self._connect_lock:
+            if self._socket_dir:
+                shutil.rmtree(self._socket_dir, ignore_errors=True)
+                self._socket_dir = self._socket_path = None
+
+    def command(self, *args):
+        """Send a command to mpv and return its data.
+
+        Starts mpv first if needed. Raises MusicError if mpv reports an
+        error or doesn't reply in time.
+        """
+        start = time.monotonic()
+        sock = self._connect()
+        request_id = next(self._request_ids)
+        reply = {'_done': threading.Event()}
+        with self._lock:
+            self._pending[request_id] = reply
+        try:
+            message = json.dumps({'command': list(args), 'request_id': request_id})
+            with self._send_lock:
+                sock.sendall(message.encode('utf-8') + b'\n')
+            if not reply['_done'].wait(self._timeout):
+                raise MusicError('mpv did not reply to %s' % (args,))
+        except OSError as e:
+            self._disconnect(sock)
+            raise MusicError('lost connection to mpv: %s' % e)
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+        if 'error' not in reply:
+            raise MusicError('lost connection to mpv')
+        if reply['error'] != 'success':
+            raise MusicError('mpv: %s failed: %s' % (args[0], reply['error']))
+        latency = time.monotonic() - start
+        self.metrics['commands'] += 1
+        self.metrics['last_command_s'] = latency
+        self.metrics['max_command_s'] = max(latency, self.metrics['max_command_s'] or 0)
+        return reply.get('data')
+
+    def _connect(self):
+        with self._lock:
+            if self._socket is not None:
+                return self._socket
+        with self._connect_lock:
+            with self._lock:
+                if self._socket is not None:
+                    return self._socket
+            if not self._socket_path:
+                if os.path.isdir(TMP_DIR):
+                    self._socket_path = os.path.join(TMP_DIR, SOCKET_NAME)
+                else:
+                    # Not a predictable name in a directory others can write to.
+                    self._socket_dir = tempfile.mkdtemp(prefix='aiy-mpv-')
+                    self._socket_path = os.path.join(self._socket_dir, SOCKET_NAME)
+            sock = self._try_connect()
+            if sock is None:
+                sock = self._start_mpv()
+            with self._lock:
+                self._socket = sock
+                self._state = dict(_OBSERVED)
+            threading.Thread(target=self._read, args=(sock,), daemon=True).start()
+
+        # Have mpv push changes of the properties we mirror.
+        for observer_id, name in enumerate(sorted(_OBSERVED), 1):
+            message = json.dumps({'command': ['observe_property', observer_id, name]})
+            with self._send_lock:
+                sock.sendall(message.encode('utf-8') + b'\n')
+        return sock
+
+    def _start_mpv(self):
+        """Start mpv and connect to it; stop it again if that fails."""
+        logger.info('starting mpv')
+        with self._lock:
+            old, self._process = self._process, None
+        if old and old.poll() is None:
+            # Started by us but no longer reachable.
+            old.terminate()
+            old.wait()
+        process = subprocess.Popen(
+            self._mpv_args + ['--input-ipc-server=%s' % self._socket_path],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        sock = None
+        deadline = time.monotonic() + self.START_TIMEOUT_S
+        while sock is None and time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise MusicError('mpv exited with %d' % process.returncode)
+            time.sleep(0.02)
+            sock = self._try_connect()
+        if sock is None:
+            process.terminate()
+            process.wait()
+            raise MusicError('mpv did not open %s' % self._socket_path)
+        with self._lock:
+            self._process = process
+        return sock
+
+    def _try_connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self._socket_path)
+            return sock
+        except OSError:
+            sock.close()
+            return None
+
+    def _disconnect(self, sock):
+        with self._lock:
+            if self._socket is sock:
+                self._socket = None
+            pending = list(self._pending.values())
+        for reply in pending:
+            reply['_done'].set()
+
+    def _read(self, sock):
+        """Dispatch replies and events from mpv until the socket closes."""
+        with sock.makefile('rb') as stream:
+            try:
+                for line in stream:
+                    try:
+                        message = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        logger.warning('bad message from mpv: %r', line)
+                        continue
+                    if 'event' in message:
+                        self._on_event(message)
+                    elif 'request_id' in message:
+                        with self._lock:
+                            reply = self._pending.get(message['request_id'])
+                        if reply:
+                            reply.update(message)
+                            reply['_done'].set()
+            except OSError:
+                pass
+        logger.info('disconnected from mpv')
+        self._disconnect(sock)
+
+    def _on_event(self, message):
+        if message['event'] == 'property-change' and message.get('name') in _OBSERVED:
+            self._state[message['name']] = message.get('data')
+        elif message['event'] == 'idle':
+            self._state['idle-active'] = True
+        elif message['event'] == 'start-file':
+            self._state['idle-active'] = False
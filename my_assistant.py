@@ -11,23 +11,53 @@ It is available for Raspberry Pi 2/3 only; Pi Zero is not supported.
 """
 
 
+import collections
+import concurrent.futures
 import logging
-import sys, os, re
+import sys, os
 import threading
-import subprocess
+
+import startup_timeline
+# Startup is timed from here on, and from process start before that
+STARTUP = startup_timeline.StartupTimeline()
 
 #sys.path.append('/home/pi/AIY-voice-kit-python/src/aiy')
 sys.path.insert(0, '/home/pi/AIY-voice-kit-python/env/lib/python3.4/site-packages')
 sys.path.insert(0, '/home/pi/AIY-voice-kit-python/src')
-import aiy.assistant.auth_helpers
 import aiy.audio
 import aiy.voicehat
-from google.assistant.library import Assistant
-from google.assistant.library.event import EventType
+import handler_pool
+import intent_dispatcher
+import music_controller
 import RPi.GPIO as gpio
 import time
 import locale
 locale.setlocale(locale.LC_ALL, 'en_GB.utf8')
+STARTUP.mark('imported')
+
+# Run the startup steps concurrently, without waiting for a fresh access
+# token; False runs them one after another, as before, for comparison
+FAST_STARTUP = True
+# One JSON line per startup, see benchmarks/startup_timeline.py
+STARTUP_TIMELINE_PATH = os.path.expanduser('~/.cache/voice-recognizer/startup_timeline.jsonl')
+
+# The Assistant library is slow to import, so _import_assistant_library()
+# does it in a startup step instead of here
+Assistant = None
+EventType = None
+
+# Fixed phrases, synthesized ahead so they are spoken without delay
+PHRASES = [
+    'music volume up 5 percent', 'music volume up 10 percent', 'music volume up 20 percent',
+    'music volume down 5 percent', 'music volume down 10 percent', 'music volume down 20 percent',
+    'Could not hear what percentage to set the volume to!',
+    'shutting down', 'See you in a bit!', 'Quitting assistant application',
+]
+
+# Events that held the event loop longer than this are logged
+EVENT_LAG_WARNING_S = 0.05
+# Number of (event type, seconds) kept in MyAssistant.event_lag
+EVENT_LAG_HISTORY = 100
 
 logging.basicConfig(
     level=logging.INFO,
@@ -41,12 +71,78 @@ class MyAssistant(object):
     To support the button trigger, we need to run the event loop in a separate
     thread. Otherwise, the on_button_pressed() method will never get a chance to
     be invoked.
+
+    Command handlers run on a handler_pool.HandlerPool, so slow ones (TTS,
+    subprocesses, the music player) don't hold up the events after them.
+    event_lag records how long each event kept the event loop busy.
     """
     def __init__(self):
         self._task = threading.Thread(target=self._run_task)
         self._can_start_conversation = False
         self._assistant = None
-        self.mpsyt_stop()
+        self._music = music_controller.MusicController()
+        self.music_pause_level = 0 # 0: not pauzed, 1: auto pauzed, 2: pauzed by user
+        self._handlers = handler_pool.HandlerPool()
+        self.event_lag = collections.deque(maxlen=EVENT_LAG_HISTORY)
+        self._commands = self._build_commands()
+
+    def _build_commands(self):
+        """The local voice commands, compiled once into one dispatcher."""
+        commands = intent_dispatcher.IntentDispatcher()
+        # music commands run one at a time, in the order they were said
+        commands.exact(['continue', 'play'], self._pooled(lambda match: self.music_pause(0), 'music'))
+        commands.exact('pause', self._pooled(lambda match: self.music_pause(2), 'music'))
+        commands.exact('stop', self._stop_music)
+        commands.prefix('play', self._pooled(lambda match: self.music_play(match.slots['rest']), 'music'))
+        music_volume = self._pooled(lambda match: self.music_volume_command(match.slots), 'music')
+        for template in ['music volume <direction:up|down>',
+                         'music volume <direction:up|down> <n:int>',
+                         'music volume <direction:up|down> <n:int> percent',
+                         'music volume <direction:up|down> a <amount:little|lot>',
+                         'music volume <direction:up|down> a <amount:little|lot> bit']:
+            commands.pattern(template, music_volume)
+        set_volume = self._pooled(lambda match: self.set_volume(match.slots['n']), 'volume')
+        for template in ['volume <n:int>', 'volume <n:int> percent',
+                         'volume to <n:int> percent', 'set the volume to <n:int> percent']:
+            commands.pattern(template, set_volume)
+        # any other mention of the volume
+        commands.keyword('volume', self._pooled(lambda match: aiy.audio.say_async(
+            'Could not hear what percentage to set the volume to!')))
+        commands.exact('ip address', self._pooled(lambda match: self.say_ip(), timeout=10))
+        # no fuzzy matching for commands that must not fire by accident
+        commands.exact(['shut down', 'power off'],
+                       self._pooled(lambda match: self.power_off_pi(), 'system'), fuzzy=False)
+        commands.exact(['restart', 'reboot'],
+                       self._pooled(lambda match: self.reboot_pi(), 'system'), fuzzy=False)
+        # quit exits from the event loop thread, as before
+        commands.exact('quit', lambda match: self.quit(), fuzzy=False)
+        commands.exact('speak dutch', self._pooled(lambda match: self.translate()))
+        commands.compile()
+        return commands
+
+    def _pooled(self, handler, group=None, timeout=None):
+        """Wrap a command handler to run on the handler pool."""
+        def submit(match):
+            if not self._submit(handler, match, group=group, timeout=timeout, name=match.rule):
+                aiy.audio.say_async('Sorry, I am still busy')
+        return submit
+
+    def _submit(self, handler, *args, **kwargs):
+        """Submit to the handler pool; never raises, so the event loop survives.
+
+        Returns the task, or None if the pool was busy.
+        """
+        try:
+            return self._handlers.submit(handler, *args, **kwargs)
+        except handler_pool.PoolBusy:
+            logging.warning('handler pool busy, dropping %s', kwargs.get('name') or handler.__name__)
+            return None
+
+    def _stop_music(self, match):
+        # stop overrides any music command still waiting or running
+        self._handlers.cancel_group('music')
+        if not self._submit(self.music_stop, group='music', name=match.rule):
+            aiy.audio.say_async('Sorry, I am still busy')
 
     def start(self):
         """Starts the assistant.
@@ -56,11 +152,42 @@ class MyAssistant(object):
         self._task.start()
 
     def _run_task(self):
-        credentials = aiy.assistant.auth_helpers.get_assistant_credentials()
-        with Assistant(credentials) as assistant:
+        credentials = self._run_startup_steps()
+        with STARTUP.phase('assistant_start'):
+            assistant = Assistant(credentials)
+        with assistant:
             self._assistant = assistant
             for event in assistant.start():
+                start = time.monotonic()
                 self._process_event(event)
+                lag = time.monotonic() - start
+                self.event_lag.append((event.type, lag))
+                if lag > EVENT_LAG_WARNING_S:
+                    logging.warning('%s held the event loop for %.0f ms', event.type, lag * 1000)
+
+    def _run_startup_steps(self):
+        """Run the independent startup steps, return the credentials."""
+        STARTUP.mode = 'fast' if FAST_STARTUP else 'serial'
+        steps = [
+            ('status_ui', self._start_status_ui),
+            ('assistant_library', _import_assistant_library),
+            ('credentials', lambda: _load_credentials(wait_for_token=not FAST_STARTUP)),
+            ('player', aiy.audio.get_playback_queue),
+            ('tts_warm_up', lambda: aiy.audio.warm_up_speech(PHRASES)),
+        ]
+        with STARTUP.phase('startup_steps'):
+            if not FAST_STARTUP:
+                results = {name: STARTUP.timed(name, step)() for name, step in steps}
+            else:
+                with concurrent.futures.ThreadPoolExecutor(len(steps)) as executor:
+                    futures = {name: executor.submit(STARTUP.timed(name, step))
+                               for name, step in steps}
+                results = {name: future.result() for name, future in futures.items()}
+        return results['credentials']
+
+    def _start_status_ui(self):
+        aiy.voicehat.get_status_ui().status('starting')
+        aiy.voicehat.get_button()
 
     def _on_button_pressed(self):
         # Check if we can start a conversation. 'self._can_start_conversation'
@@ -77,14 +204,17 @@ class MyAssistant(object):
             self._can_start_conversation = True
             # Start the voicehat button trigger.
             aiy.voicehat.get_button().on_press(self._on_button_pressed)
+            STARTUP.mark('ready')
+            STARTUP.log()
+            STARTUP.append_to(STARTUP_TIMELINE_PATH)
             if sys.stdout.isatty():
                 print('Say "OK, Google" or press the button, then speak. '
                       'Press Ctrl+C to quit...')
 
         elif event.type == EventType.ON_CONVERSATION_TURN_STARTED:
             self._can_start_conversation = False
-            if self.mpsyt_has_player() and self.mpsyt_pause_level == 0:
-                self.mpsyt_pause(1) # auto pause player
+            aiy.audio.stop_playback() # barge-in: stop speaking when the user talks
+            self._submit(self.music_auto_pause, True, group='music')
             status_ui.status('listening')
         elif event.type == EventType.ON_END_OF_UTTERANCE:
             status_ui.status('thinking')
@@ -92,143 +222,100 @@ class MyAssistant(object):
         elif event.type == EventType.ON_CONVERSATION_TURN_FINISHED:
             status_ui.status('ready')
             self._can_start_conversation = True
-            if self.mpsyt_has_player() and self.mpsyt_pause_level == 1:
-                self.mpsyt_pause(0) # auto resume player   
+            self._submit(self.music_auto_pause, False, group='music')
 
         elif event.type == EventType.ON_ASSISTANT_ERROR and event.args and event.args['is_fatal']:
-            self.mpsyt_stop()
+            self._handlers.cancel_all()
+            self.music_stop()
             sys.exit(1)
 
         elif event.type == EventType.ON_RECOGNIZING_SPEECH_FINISHED and event.args:
             print('You said:', event.args['text'])
-            text = event.args['text'].lower()
-            words = text.split(" ")
-            first = text.split(" ")[0]
-            if text=='continue' or text=='play':
-                self._assistant.stop_conversation()
-                self.mpsyt_pause(0)
-            if text=='pause':
-                self._assistant.stop_conversation()
-                self.mpsyt_pause(2)
-            elif first=='play': self.mpsyt_play(words)
-            elif text=='stop': 
+            match = self._commands.match(event.args['text'])
+            if match:
                 self._assistant.stop_conversation()
-                self.mpsyt_stop()
-            elif "volume" in text: self.volume(words)
-            elif text == 'ip address': self.say_ip()                 
-            elif text == 'shut down' or text=='power off': self.power_off_pi()                 
-            elif text == 'restart' or text=='reboot': self.reboot_pi()                
-            elif text == 'quit': self.quit()                
-            elif text == 'speak dutch': self.translate()
-
-    def mpsyt_volume(self, change: int):
-        if change > 0: 
-            for x in range(0, change, 2): os.system('screen -X stuff "0"')
-            aiy.audio.say('music volume up {} percent'.format(change))
-        if change < 0: 
-            for x in range(0, change, -2): os.system('screen -X stuff "9"')
-            aiy.audio.say('music volume down {} percent'.format(-1 * change))
-
-    #def volume(self, words: List[str]): python 3.5
-    def volume(self, words: list):
-        self._assistant.stop_conversation()
-        percent = self.get_int(words)
-        if 'music' in words: # change music volume
-            if 'up' in words:
-                if 'little' in words: self.mpsyt_volume(5)
-                elif 'lot' in words: self.mpsyt_volume(20)
-                elif percent == None or percent == 0: self.mpsyt_volume(10)
-                else: self.mpsyt_volume(percent)
-            elif 'down' in words:
-                if 'little' in words: self.mpsyt_volume(-5)
-                elif 'lot' in words: self.mpsyt_volume(-20)
-                elif percent == None or percent == 0: self.mpsyt_volume(-10)
-                else: self.mpsyt_volume(-1 * percent)
-        else: # set master volume
-            if percent == None: aiy.audio.say("Could not hear what percentage to set the volume to!")
-            else:
-                subprocess.call('amixer set Master {}%'.format(percent), shell=True)
-                aiy.audio.say("Volume to {} percent.".format(percent))
+                match.handler(match)
 
-    def get_int(self, words: list) -> int:
-        r = None
-        try:
-            for word in words:
-                t = re.sub('[^0-9]','', word) # remove for example % sign
-                if t != '':
-                    r = int(t)
-                    return r
-        except: pass
-        return r
-    # uses: https://github.com/mps-youtube/mps-youtube
+    def music_volume(self, change: int):
+        # one IPC command, no shell per 2% step
+        if not self.music_command(self._music.change_volume, change): return
+        if change > 0: aiy.audio.say_async('music volume up {} percent'.format(change))
+        if change < 0: aiy.audio.say_async('music volume down {} percent'.format(-1 * change))
+
+    def music_volume_command(self, slots: dict):
+        # 'up', 'up 15 percent', 'up a little', 'down a lot'
+        step = slots.get('n') or {'little': 5, 'lot': 20}.get(slots.get('amount'), 10)
+        self.music_volume(step if slots['direction'] == 'up' else -step)
+
+    def set_volume(self, percent: int):
+        handler_pool.call('amixer set Master {}%'.format(percent), shell=True)
+        aiy.audio.say_async("Volume to {} percent.".format(percent))
+
+    # Music plays in one long-running mpv, controlled over its JSON IPC socket
+    # (see music_controller.py); mpv finds and streams the track with youtube-dl.
     #
     # setup:
-    # /home/pi/AIY-voice-kit-python/env/bin/python3 -m pip install mps-youtube
-    # /home/pi/AIY-voice-kit-python/env/bin/python3 -m pip install youtube-dl
     # sudo apt update; sudo apt upgrade; sudo apt install mpv
-    # run /home/pi/AIY-voice-kit-python/env/bin/mpsyt and configure mpv as default player
-    # sudo apt install screen
+    # /home/pi/AIY-voice-kit-python/env/bin/python3 -m pip install youtube-dl
     #
     # if you think mpv always starts playing to loud? Create file `~/.config/mpv/mpv.conf` containing `volume=25`
-    # locale error in mpsyt? add `export LC_ALL=C` to the end of `/etc/profile` set set environment variable. Check with `printenv | grep -i lc`.
-    # error? sudo dpkg-reconfigure locales (install locale en_US.UTF-8 and set as default, check with locale -a)
-    def mpsyt_play(self, words: list):
-        words.pop(0)
-        self._assistant.stop_conversation()
-        #track = words.replace("play","")
-        track = " ".join(words)
-        #os.system('export LC_ALL=C')#https://askubuntu.com/questions/205378/unsupported-locale-setting-fault-by-command-not-found
-        os.putenv('LC_ALL', 'C')
-        self.mpsyt_stop()
-        #https://serverfault.com/questions/178457/can-i-send-some-text-to-the-stdin-of-an-active-process-running-in-a-screen-sessi
-        os.system('screen -d -m /home/pi/AIY-voice-kit-python/env/bin/mpsyt')
-        os.system('screen -X stuff "/' + track + '\n1\n"')
-        aiy.audio.say('One moment, Playing' + track)
-    def mpsyt_has_player(self) -> bool:
-        #https://stackoverflow.com/questions/4760215/running-shell-command-from-python-and-capturing-the-output
-        # ps aux | grep -i [m]pv
-        #t = subprocess.run('ps aux | grep -i [m]pv', shell=True, stdout=subprocess.PIPE).stdout.decode('utf-8') # requires python 3.5
+    def music_play(self, track: str):
+        self.music_pause_level = 0
+        if self.music_command(self._music.play, track):
+            aiy.audio.say_async('One moment, Playing' + track)
+        else:
+            aiy.audio.say_async('Sorry, I could not start the music player')
+    def music_pause(self, level: int):
+        if (self.music_pause_level == 0 and level > 0) or (self.music_pause_level > 0 and level == 0):
+            self.music_command(self._music.set_pause, level > 0)
+        self.music_pause_level = level
+    def music_auto_pause(self, paused: bool):
+        # pause the player while listening, unless the user paused it
+        if not self._music.playing: return
+        if paused and self.music_pause_level == 0: self.music_pause(1)
+        elif not paused and self.music_pause_level == 1: self.music_pause(0)
+    def music_stop(self):
+        self.music_pause_level = 0
+        self.music_command(self._music.stop)
+    def music_command(self, command, *args) -> bool:
         try:
-            t = subprocess.check_output(['ps aux | grep -i [m]pv'], shell=True).decode('utf-8')
-        except subprocess.CalledProcessError:
-            t = '' # returned non-zero exit status 1 just means that nothing was found by grep
-        #print('mpsyt_has_player:', t, ', mpsyt_pauzed_auto: ', self.mpsyt_pauzed_auto, ', mpsyt_pauzed_user: ', self.mpsyt_pauzed_user)
-        if t == '': return False
-        else: return True
-    mpsyt_pause_level = 0 # 0: not pauzed, 1: auto pauzed, 2: pauzed by user
-    def mpsyt_pause(self, level: int):
-        if (self.mpsyt_pause_level == 0 and level > 0) or (self.mpsyt_pause_level > 0 and level == 0):
-            os.system('screen -X stuff " "')
-        self.mpsyt_pause_level = level
-    def mpsyt_stop(self):
-        self.mpsyt_pause_level = 0
-        os.system('pkill screen') # os.system('pkill mpsyt') os.system('pkill mpv')
+            command(*args)
+            return True
+        except music_controller.MusicError:
+            logging.exception('music command failed')
+            return False
     
     def say_ip(self):
-        self._assistant.stop_conversation()
-        ip_address = subprocess.check_output("hostname -I | cut -d' ' -f1", shell=True)
-        aiy.audio.say('My IP address is %s' % ip_address.decode('utf-8'))
+        ip_address = handler_pool.check_output("hostname -I | cut -d' ' -f1", shell=True)
+        aiy.audio.say_async('My IP address is %s' % ip_address.decode('utf-8'))
 
     def power_off_pi(self):
-        self._assistant.stop_conversation()
-        aiy.audio.say('shutting down')
-        subprocess.call('sudo shutdown now', shell=True)
+        aiy.audio.say_async('shutting down').wait()
+        handler_pool.call('sudo shutdown now', shell=True)
 
     def reboot_pi(self):
-        self._assistant.stop_conversation()
-        aiy.audio.say('See you in a bit!')
-        subprocess.call('sudo reboot', shell=True)
+        aiy.audio.say_async('See you in a bit!').wait()
+        handler_pool.call('sudo reboot', shell=True)
 
     def quit(self):
-        self._assistant.stop_conversation()
-        self.mpsyt_stop()
-        aiy.audio.say('Quitting assistant application')
+        self._handlers.cancel_all()
+        self.music_stop()
+        aiy.audio.say_async('Quitting assistant application').wait()
         sys.exit()
 
     def translate(self):
-        self._assistant.stop_conversation()
-        self._assistant.stop_conversation()
-        aiy.audio.say('goedemorgen', 'nl-NL')
+        aiy.audio.say_async('goedemorgen', 'nl-NL')
+
+def _import_assistant_library():
+    global Assistant, EventType
+    from google.assistant.library import Assistant
+    from google.assistant.library.event import EventType
+
+def _load_credentials(wait_for_token):
+    import aiy.assistant.auth_helpers
+    # The Assistant library refreshes the credentials itself, so no background refresh
+    return aiy.assistant.auth_helpers.get_assistant_credentials(
+        wait_for_token=wait_for_token, background_refresh=False)
 
 def main(): MyAssistant().start()
 if __name__ == '__main__':
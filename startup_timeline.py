@@ -0,0 +1,102 @@
+"""Record how long each phase of startup takes, from process start.
+
+Times are seconds since the process started (read from /proc, so they
+include the interpreter and imports before this module was loaded).
+Phases are intervals and may overlap when steps run concurrently; marks
+are points, such as 'ready'. Each startup can be appended as one JSON line
+to a log, and benchmarks/startup_timeline.py compares logs across releases.
+
+Usage:
+    timeline = StartupTimeline()
+    with timeline.phase('credentials'):
+        credentials = load_credentials()
+    timeline.mark('ready')
+    timeline.append_to(path)
+"""
+
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('startup')
+
+
+def _process_start():
+    """Return time.monotonic() at the start of this process, or now if unknown."""
+    try:
+        with open('/proc/self/stat') as f:
+            # Fields after the command name, which may contain spaces;
+            # starttime is field 22, in clock ticks since boot.
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        started = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.monotonic()
+    return time.monotonic() - max(0.0, uptime - started)
+
+
+class StartupTimeline(object):
+    """Phases and marks of one startup, safe to record from any thread."""
+
+    def __init__(self, mode=None):
+        self.mode = mode
+        self.phases = {}  # name -> (start, end)
+        self.marks = {}  # name -> time
+        self._origin = _process_start()
+        self._lock = threading.Lock()
+
+    def now(self):
+        """Seconds since the process started."""
+        return time.monotonic() - self._origin
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = self.now()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = (start, self.now())
+
+    def timed(self, name, function):
+        """Wrap function so each call is recorded as phase name."""
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def mark(self, name):
+        with self._lock:
+            self.marks[name] = self.now()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'phases': {name: list(times) for name, times in self.phases.items()},
+                'marks': dict(self.marks),
+            }
+
+    def log(self):
+        data = self.to_dict()
+        for name, (start, end) in sorted(data['phases'].items(), key=lambda item: item[1]):
+            logger.info('%-20s %7.3f -> %7.3f s (%.3f s)', name, start, end, end - start)
+        for name, at in sorted(data['marks'].items(), key=lambda item: item[1]):
+            logger.info('%-20s %7.3f s', name, at)
+
+    def append_to(self, path):
+        """Append the timeline as one JSON line to path."""
+        try:
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(path, 'a') as f:
+                f.write(json.dumps(self.to_dict(), sort_keys=True) + '\n')
+        except OSError:
+            logger.exception('could not save the startup timeline to %s', path)